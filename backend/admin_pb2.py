@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
+# source: admin.proto
+# Protobuf Python Version: 6.31.1
+"""Generated protocol buffer code."""
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import runtime_version as _runtime_version
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    6,
+    31,
+    1,
+    '',
+    'admin.proto'
+)
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0b\x61\x64min.proto\x12\x05\x61\x64min\"\x0f\n\rStatusRequest\"\x9e\x03\n\x0eStatusResponse\x12\x10\n\x08uptime_s\x18\x01 \x01(\x01\x12\x1e\n\x04rpcs\x18\x02 \x03(\x0b\x32\x10.admin.RpcStatus\x12\"\n\x06queues\x18\x03 \x03(\x0b\x32\x12.admin.QueueStatus\x12\x18\n\x10worker_processes\x18\x04 \x01(\x05\x12\"\n\x06models\x18\x05 \x03(\x0b\x32\x12.admin.ModelStatus\x12!\n\x05\x63\x61\x63he\x18\x06 \x01(\x0b\x32\x12.admin.CacheStatus\x12#\n\x06memory\x18\x07 \x01(\x0b\x32\x13.admin.MemoryStatus\x12)\n\tadmission\x18\x08 \x01(\x0b\x32\x16.admin.AdmissionStatus\x12\x30\n\rsingle_flight\x18\t \x01(\x0b\x32\x19.admin.SingleFlightStatus\x12%\n\x07quality\x18\n \x01(\x0b\x32\x14.admin.QualityStatus\x12,\n\rpose_batching\x18\x0b \x01(\x0b\x32\x15.admin.BatchingStatus\"\x93\x01\n\tRpcStatus\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x10\n\x08requests\x18\x02 \x01(\x03\x12\x0e\n\x06\x65rrors\x18\x03 \x01(\x03\x12\x11\n\tin_flight\x18\x04 \x01(\x05\x12\x15\n\rlatency_avg_s\x18\x05 \x01(\x01\x12\x15\n\rlatency_p50_s\x18\x06 \x01(\x01\x12\x15\n\rlatency_p95_s\x18\x07 \x01(\x01\"\xa8\x01\n\x0bQueueStatus\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\r\n\x05\x64\x65pth\x18\x02 \x01(\x05\x12\x10\n\x08max_size\x18\x03 \x01(\x05\x12\x11\n\tin_flight\x18\x04 \x01(\x05\x12\x0f\n\x07workers\x18\x05 \x01(\x05\x12\x10\n\x08rejected\x18\x06 \x01(\x03\x12\x1a\n\x12\x61vg_service_time_s\x18\x07 \x01(\x01\x12\x18\n\x10\x65stimated_wait_s\x18\x08 \x01(\x01\"\x84\x01\n\x0bModelStatus\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x12\n\nsize_bytes\x18\x02 \x01(\x03\x12\x0e\n\x06in_use\x18\x03 \x01(\x05\x12\x0e\n\x06idle_s\x18\x04 \x01(\x01\x12\x0f\n\x07version\x18\x05 \x01(\x05\x12\x10\n\x08\x64raining\x18\x06 \x01(\x08\x12\x10\n\x08replicas\x18\x07 \x01(\x05\"\xa8\x01\n\x0b\x43\x61\x63heStatus\x12\x0c\n\x04hits\x18\x01 \x01(\x03\x12\x11\n\tdisk_hits\x18\x02 \x01(\x03\x12\x0e\n\x06misses\x18\x03 \x01(\x03\x12\x10\n\x08hit_rate\x18\x04 \x01(\x01\x12\x16\n\x0ememory_entries\x18\x05 \x01(\x05\x12\x14\n\x0cmemory_bytes\x18\x06 \x01(\x03\x12\x14\n\x0c\x64isk_entries\x18\x07 \x01(\x05\x12\x12\n\ndisk_bytes\x18\x08 \x01(\x03\"p\n\x0cMemoryStatus\x12\x11\n\trss_bytes\x18\x01 \x01(\x03\x12\x1b\n\x13gpu_allocated_bytes\x18\x02 \x01(\x03\x12\x1a\n\x12gpu_reserved_bytes\x18\x03 \x01(\x03\x12\x14\n\x0cmodels_bytes\x18\x04 \x01(\x03\"\x88\x02\n\x0f\x41\x64missionStatus\x12\x36\n\x08\x61\x64mitted\x18\x01 \x03(\x0b\x32$.admin.AdmissionStatus.AdmittedEntry\x12.\n\x04shed\x18\x02 \x03(\x0b\x32 .admin.AdmissionStatus.ShedEntry\x12\x17\n\x0ftenant_rejected\x18\x03 \x01(\x03\x12\x16\n\x0e\x61\x63tive_tenants\x18\x04 \x01(\x05\x1a/\n\rAdmittedEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x03:\x02\x38\x01\x1a+\n\tShedEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x03:\x02\x38\x01\"K\n\x12SingleFlightStatus\x12\x0f\n\x07started\x18\x01 \x01(\x03\x12\x11\n\tcoalesced\x18\x02 \x01(\x03\x12\x11\n\tin_flight\x18\x03 \x01(\x05\"\xe2\x01\n\rQualityStatus\x12\x30\n\x06\x63hosen\x18\x01 \x03(\x0b\x32 .admin.QualityStatus.ChosenEntry\x12<\n\rstage_costs_s\x18\x02 \x03(\x0b\x32%.admin.QualityStatus.StageCostsSEntry\x1a-\n\x0b\x43hosenEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x03:\x02\x38\x01\x1a\x32\n\x10StageCostsSEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x01:\x02\x38\x01\"\xd3\x01\n\x0e\x42\x61tchingStatus\x12\x0f\n\x07\x62\x61tches\x18\x01 \x01(\x03\x12\x10\n\x08requests\x18\x02 \x01(\x03\x12\x16\n\x0e\x61vg_batch_size\x18\x03 \x01(\x01\x12K\n\x14\x62\x61tch_size_histogram\x18\x04 \x03(\x0b\x32-.admin.BatchingStatus.BatchSizeHistogramEntry\x1a\x39\n\x17\x42\x61tchSizeHistogramEntry\x12\x0b\n\x03key\x18\x01 \x01(\x05\x12\r\n\x05value\x18\x02 \x01(\x03:\x02\x38\x01\"2\n\rReloadRequest\x12\x11\n\tcomponent\x18\x01 \x01(\t\x12\x0e\n\x06source\x18\x02 \x01(\t\"x\n\x0eReloadResponse\x12\x11\n\tcomponent\x18\x01 \x01(\t\x12\x0f\n\x07version\x18\x02 \x01(\x05\x12\x0e\n\x06source\x18\x03 \x01(\t\x12\x0e\n\x06load_s\x18\x04 \x01(\x01\x12\x10\n\x08warmup_s\x18\x05 \x01(\x01\x12\x10\n\x08\x64raining\x18\x06 \x01(\x05\x32\x84\x01\n\x0c\x41\x64minService\x12\x38\n\tGetStatus\x12\x14.admin.StatusRequest\x1a\x15.admin.StatusResponse\x12:\n\x0bReloadModel\x12\x14.admin.ReloadRequest\x1a\x15.admin.ReloadResponseb\x06proto3')
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'admin_pb2', _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+  DESCRIPTOR._loaded_options = None
+  _globals['_ADMISSIONSTATUS_ADMITTEDENTRY']._loaded_options = None
+  _globals['_ADMISSIONSTATUS_ADMITTEDENTRY']._serialized_options = b'8\001'
+  _globals['_ADMISSIONSTATUS_SHEDENTRY']._loaded_options = None
+  _globals['_ADMISSIONSTATUS_SHEDENTRY']._serialized_options = b'8\001'
+  _globals['_QUALITYSTATUS_CHOSENENTRY']._loaded_options = None
+  _globals['_QUALITYSTATUS_CHOSENENTRY']._serialized_options = b'8\001'
+  _globals['_QUALITYSTATUS_STAGECOSTSSENTRY']._loaded_options = None
+  _globals['_QUALITYSTATUS_STAGECOSTSSENTRY']._serialized_options = b'8\001'
+  _globals['_BATCHINGSTATUS_BATCHSIZEHISTOGRAMENTRY']._loaded_options = None
+  _globals['_BATCHINGSTATUS_BATCHSIZEHISTOGRAMENTRY']._serialized_options = b'8\001'
+  _globals['_STATUSREQUEST']._serialized_start=22
+  _globals['_STATUSREQUEST']._serialized_end=37
+  _globals['_STATUSRESPONSE']._serialized_start=40
+  _globals['_STATUSRESPONSE']._serialized_end=454
+  _globals['_RPCSTATUS']._serialized_start=457
+  _globals['_RPCSTATUS']._serialized_end=604
+  _globals['_QUEUESTATUS']._serialized_start=607
+  _globals['_QUEUESTATUS']._serialized_end=775
+  _globals['_MODELSTATUS']._serialized_start=778
+  _globals['_MODELSTATUS']._serialized_end=910
+  _globals['_CACHESTATUS']._serialized_start=913
+  _globals['_CACHESTATUS']._serialized_end=1081
+  _globals['_MEMORYSTATUS']._serialized_start=1083
+  _globals['_MEMORYSTATUS']._serialized_end=1195
+  _globals['_ADMISSIONSTATUS']._serialized_start=1198
+  _globals['_ADMISSIONSTATUS']._serialized_end=1462
+  _globals['_ADMISSIONSTATUS_ADMITTEDENTRY']._serialized_start=1370
+  _globals['_ADMISSIONSTATUS_ADMITTEDENTRY']._serialized_end=1417
+  _globals['_ADMISSIONSTATUS_SHEDENTRY']._serialized_start=1419
+  _globals['_ADMISSIONSTATUS_SHEDENTRY']._serialized_end=1462
+  _globals['_SINGLEFLIGHTSTATUS']._serialized_start=1464
+  _globals['_SINGLEFLIGHTSTATUS']._serialized_end=1539
+  _globals['_QUALITYSTATUS']._serialized_start=1542
+  _globals['_QUALITYSTATUS']._serialized_end=1768
+  _globals['_QUALITYSTATUS_CHOSENENTRY']._serialized_start=1671
+  _globals['_QUALITYSTATUS_CHOSENENTRY']._serialized_end=1716
+  _globals['_QUALITYSTATUS_STAGECOSTSSENTRY']._serialized_start=1718
+  _globals['_QUALITYSTATUS_STAGECOSTSSENTRY']._serialized_end=1768
+  _globals['_BATCHINGSTATUS']._serialized_start=1771
+  _globals['_BATCHINGSTATUS']._serialized_end=1982
+  _globals['_BATCHINGSTATUS_BATCHSIZEHISTOGRAMENTRY']._serialized_start=1925
+  _globals['_BATCHINGSTATUS_BATCHSIZEHISTOGRAMENTRY']._serialized_end=1982
+  _globals['_RELOADREQUEST']._serialized_start=1984
+  _globals['_RELOADREQUEST']._serialized_end=2034
+  _globals['_RELOADRESPONSE']._serialized_start=2036
+  _globals['_RELOADRESPONSE']._serialized_end=2156
+  _globals['_ADMINSERVICE']._serialized_start=2159
+  _globals['_ADMINSERVICE']._serialized_end=2291
+# @@protoc_insertion_point(module_scope)
@@ -0,0 +1,179 @@
+import functools
+import io
+import json
+from contextlib import contextmanager
+
+from PIL import Image
+
+from .image_io import capped_size
+from .ml_models import cfg
+from .inference_queue import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+
+PRIORITIES = {
+    "high": PRIORITY_HIGH,
+    "normal": PRIORITY_NORMAL,
+    "low": PRIORITY_LOW,
+}
+
+#costs are counted in denoising steps, the queues learn how many seconds a step takes.
+#the default step counts are the ones RelightingModel.predict and change_pose_image use
+RELIGHT_STEPS = 50
+POSE_DEFAULT_STEPS = 30
+#upscaling, depth estimation and shadow raymarching run at the input resolution
+RELIGHT_STEPS_PER_MEGAPIXEL = 10
+POSE_STEPS_PER_MEGAPIXEL = 2
+#every light is rendered into the custom env map
+RELIGHT_STEPS_PER_LIGHT = 1
+
+
+class AdmissionRejected(Exception):
+    """Raised when the admission controller sheds a request or its tenant is at its limit."""
+
+    def __init__(self, message, retry_after_ms):
+        super().__init__(message)
+        self.retry_after_ms = retry_after_ms
+
+
+def image_megapixels(image_data):
+    """Size an encoded image is decoded at in megapixels, read from its header without decoding it."""
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            width, height = capped_size(*image.size, cfg.MAX_INPUT_PIXELS)
+    except Exception:
+        #let the request fail in the pipeline with a proper error
+        return 0.0
+    return width * height / 1e6
+
+
+def count_lights(json_data):
+    """Number of lights in a RelightRequest's json_data, 0 if there are none or it does not parse."""
+    try:
+        lights = json.loads(json_data).get("lights") if json_data else None
+    except (ValueError, AttributeError):
+        return 0
+    return len(lights) if isinstance(lights, list) else 0
+
+
+def estimate_relight_cost(request, image_data=None, megapixels=None):
+    """Estimated cost of a RelightRequest in denoising steps, `megapixels` is the size of an already decoded image."""
+    lights = count_lights(request.json_data)
+    if megapixels is None:
+        megapixels = image_megapixels(request.image_data if image_data is None else image_data)
+    return RELIGHT_STEPS + megapixels * RELIGHT_STEPS_PER_MEGAPIXEL + lights * RELIGHT_STEPS_PER_LIGHT
+
+
+def estimate_pose_cost(request, image_data=None, megapixels=None):
+    """Estimated cost of a PoseRequest in denoising steps, `megapixels` is the size of an already decoded image."""
+    steps = request.num_steps or POSE_DEFAULT_STEPS
+    if request.strength:
+        #img2img inpainting only runs the last `strength` fraction of the schedule
+        steps *= min(request.strength, 1.0)
+    if megapixels is None:
+        megapixels = image_megapixels(request.image_data if image_data is None else image_data)
+    return steps + megapixels * POSE_STEPS_PER_MEGAPIXEL
+
+
+class AdmissionController:
+    """
+    Decides which requests enter the inference queues, and with which priority.
+
+    Tenants and priority classes come from gRPC metadata. A tenant may only have a
+    limited number of requests queued or running at once, and a request is shed when
+    the estimated wait in front of it exceeds the limit of its priority class. Low
+    priority has the tightest limit, so it is shed first as the queues fill up.
+
+    Args:
+        tenant_header: Metadata key naming the tenant
+        priority_header: Metadata key with the priority class ("high", "normal" or "low")
+        default_priority: Class of requests without (or with an unknown) priority header
+        tenant_max_concurrency: Requests a tenant may have admitted at once (0 for no limit).
+                                Requests without a tenant header are not limited
+        max_wait_s: Dict of priority class -> longest estimated queue wait to admit (0 never sheds)
+    """
+
+    def __init__(self, tenant_header="x-tenant-id", priority_header="x-priority", default_priority="normal",
+                 tenant_max_concurrency=0, max_wait_s=None):
+        self.tenant_header = tenant_header
+        self.priority_header = priority_header
+        self.default_priority = PRIORITIES[default_priority]
+        self.tenant_max_concurrency = tenant_max_concurrency
+        self.max_wait_s = {PRIORITIES[name]: limit for name, limit in (max_wait_s or {}).items()}
+
+        self.active = {}  #tenant -> admitted requests that have not finished yet
+        self.admitted = {name: 0 for name in PRIORITIES}
+        self.shed = {name: 0 for name in PRIORITIES}
+        self.tenant_rejected = 0
+
+    def classify(self, context):
+        """Returns (tenant or None, priority) of a call from its invocation metadata."""
+        metadata = dict(context.invocation_metadata() or ())
+        tenant = metadata.get(self.tenant_header) or None
+        priority = PRIORITIES.get(str(metadata.get(self.priority_header, "")).lower(), self.default_priority)
+        return tenant, priority
+
+    @contextmanager
+    def admit(self, context, queue, cost):
+        """
+        Admit a request to `queue` or raise AdmissionRejected.
+
+        Yields a ticket whose `submit(fn, *args, **kwargs)` enqueues work with the request's
+        priority and cost. The tenant's slot is held until the with block ends.
+        """
+        tenant, priority = self.classify(context)
+        name = _priority_name(priority)
+
+        if tenant is not None and self.tenant_max_concurrency:
+            if self.active.get(tenant, 0) >= self.tenant_max_concurrency:
+                self.tenant_rejected += 1
+                raise AdmissionRejected(
+                    f"Tenant {tenant} already has {self.tenant_max_concurrency} requests in progress",
+                    queue.retry_after_ms()
+                )
+
+        limit = self.max_wait_s.get(priority, 0)
+        wait_s = queue.estimated_wait_s(priority)
+        if limit and wait_s > limit:
+            self.shed[name] += 1
+            raise AdmissionRejected(
+                f"{queue.name} is overloaded for {name} priority requests "
+                f"(estimated wait {wait_s:.0f} s, limit {limit} s)",
+                int(1000 * (wait_s - limit))
+            )
+
+        self.admitted[name] += 1
+        if tenant is not None:
+            self.active[tenant] = self.active.get(tenant, 0) + 1
+        try:
+            yield _Ticket(queue, priority, cost)
+        finally:
+            if tenant is not None:
+                self.active[tenant] -= 1
+                if not self.active[tenant]:
+                    del self.active[tenant]
+
+    def stats(self):
+        """
+        Returns:
+            dict: admitted / shed counts by priority class, tenant rejections and active tenants
+        """
+        return {
+            "admitted": dict(self.admitted),
+            "shed": dict(self.shed),
+            "tenant_rejected": self.tenant_rejected,
+            "active_tenants": len(self.active),
+        }
+
+
+class _Ticket:
+    def __init__(self, queue, priority, cost):
+        self.queue = queue
+        self.priority = priority
+        self.cost = cost
+
+    def submit(self, fn, *args, **kwargs):
+        """InferenceQueue.submit with the admitted request's priority and cost."""
+        return self.queue.enqueue(functools.partial(fn, *args, **kwargs), self.priority, self.cost)
+
+
+def _priority_name(priority):
+    return next(name for name, value in PRIORITIES.items() if value == priority)
@@ -0,0 +1,321 @@
+"""
+Load generator for the Aurora gRPC backend.
+
+Drives RelightingService and PoseChangingService with a configurable request mix and
+reports throughput, latency percentiles and error counts as JSON:
+
+    python -m backend.bench --target localhost:50051 --mode closed --concurrency 8 --duration 60
+    python -m backend.bench --mode open --rate 0.5 --mix relight=1,pose=3 --image-size 1024x768 --lights 0 --lights 3
+
+Closed loop keeps `--concurrency` requests in flight back to back. Open loop starts requests
+at `--rate` per second (Poisson arrivals) regardless of how fast the server answers, the
+way independent clients behave. To benchmark without GPUs, start the server with
+`models.stub: true` in config.yaml.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+import grpc
+from PIL import Image
+
+from . import relighting_pb2
+from . import relighting_pb2_grpc
+from . import pose_pb2
+from . import pose_pb2_grpc
+from .synthetic import synthetic_image, object_mask, encode_png, random_lights, random_skeleton
+
+OUTPUT_FORMATS = {"png": 0, "jpeg": 1, "webp": 2, "raw": 3}
+
+
+def parse_size(text):
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height or width)
+
+
+def parse_mix(text):
+    """'relight=3,pose=1' -> {'relight': 3.0, 'pose': 1.0}"""
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in ("relight", "pose"):
+            raise argparse.ArgumentTypeError(f"unknown request kind {kind!r}, use relight and/or pose")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+class Workload:
+    """Pre-encoded inputs and the request factory, so the client spends its time waiting on the server."""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.kinds = list(args.mix)
+        self.weights = [args.mix[kind] for kind in self.kinds]
+        self.request_seed = args.seed * 1_000_000
+
+        self.images = []  #(png bytes, mask png bytes, width, height)
+        for path in args.image:
+            with Image.open(path) as image:
+                image = image.convert("RGB")
+            self.images.append((encode_png(image), encode_png(object_mask(*image.size)), *image.size))
+        for width, height in args.image_size or ([] if args.image else [(512, 512)]):
+            image = synthetic_image(width, height, self.rng)
+            self.images.append((encode_png(image), encode_png(object_mask(width, height)), width, height))
+
+        if args.lights_file:
+            with open(args.lights_file, "rb") as f:
+                self.lights = [f.read()]
+        else:
+            self.lights = [random_lights(count, self.rng) if count else b"" for count in args.lights or [2]]
+
+        self.skeleton = None
+        if args.skeleton_file:
+            with open(args.skeleton_file, "rb") as f:
+                self.skeleton = f.read()
+
+    def next_request(self):
+        """Returns (kind, request) of the next request to send."""
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        image_data, mask_data, width, height = self.rng.choice(self.images)
+        options = {
+            "output_format": OUTPUT_FORMATS[self.args.output_format],
+            "quality": self.args.quality,
+        }
+        if not self.args.allow_cache_hits:
+            #a fresh seed per request keeps the server's result cache out of the measurement
+            self.request_seed += 1
+            options["seed"] = self.request_seed
+
+        if kind == "relight":
+            return kind, relighting_pb2.RelightRequest(
+                image_data=image_data,
+                mask_data=mask_data,
+                json_data=self.rng.choice(self.lights),
+                **options
+            )
+
+        skeleton = self.skeleton or random_skeleton(width, height, self.args.skeleton_offset, self.rng)
+        return kind, pose_pb2.PoseRequest(
+            image_data=image_data,
+            new_skeleton_data=skeleton,
+            num_steps=self.args.steps,
+            strength=self.args.strength,
+            **options
+        )
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list, None when it is empty."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(q / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize_latencies(values):
+    values = sorted(values)
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": sum(values) / len(values),
+        "max": values[-1],
+    }
+
+
+class Recorder:
+    """Collects the outcome of every request that started after the warmup."""
+
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.results = []  #(kind, status code name, latency_s, time to first message or None)
+        self.dropped = 0
+        self.first_start = None
+        self.last_end = None
+
+    def record(self, kind, start, end, code, first_message_s=None):
+        if start < self.measure_from:
+            return
+        self.first_start = start if self.first_start is None else min(self.first_start, start)
+        self.last_end = end if self.last_end is None else max(self.last_end, end)
+        self.results.append((kind, code, end - start, first_message_s))
+
+    def report(self, kinds):
+        elapsed = (self.last_end - self.first_start) if self.results else 0.0
+
+        def summary(results):
+            ok = [latency for _, code, latency, _ in results if code == "OK"]
+            first = [first for _, code, _, first in results if code == "OK" and first is not None]
+            errors = {}
+            for _, code, _, _ in results:
+                if code != "OK":
+                    errors[code] = errors.get(code, 0) + 1
+            summary = {
+                "requests": len(results),
+                "ok": len(ok),
+                "errors": errors,
+                "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+                "latency_s": summarize_latencies(ok),
+            }
+            if first:
+                summary["first_message_s"] = summarize_latencies(first)
+            return summary
+
+        report = {"duration_s": elapsed, "dropped": self.dropped, "total": summary(self.results)}
+        report["by_kind"] = {kind: summary([r for r in self.results if r[0] == kind]) for kind in kinds}
+        return report
+
+
+async def send(stubs, kind, request, args):
+    """Send one request. Returns (status code name, seconds to the first streamed message or None)."""
+    relight_stub, pose_stub = stubs
+    try:
+        if not args.streaming:
+            call = relight_stub.Relight if kind == "relight" else pose_stub.ChangePose
+            await call(request, timeout=args.timeout, metadata=args.metadata)
+            return "OK", None
+
+        method = relight_stub.RelightStream if kind == "relight" else pose_stub.ChangePoseStream
+        start = time.monotonic()
+        first_message_s = None
+        async for _ in method(request, timeout=args.timeout, metadata=args.metadata):
+            if first_message_s is None:
+                first_message_s = time.monotonic() - start
+        return "OK", first_message_s
+    except grpc.RpcError as e:
+        return e.code().name, None
+
+
+async def run_benchmark(args):
+    workload = Workload(args)
+    start = time.monotonic()
+    recorder = Recorder(start + args.warmup)
+    deadline = start + args.warmup + args.duration
+    budget = {"left": args.requests}
+
+    def take():
+        #False once the duration is over or --requests have been started
+        if time.monotonic() >= deadline or budget["left"] == 0:
+            return False
+        if budget["left"] is not None:
+            budget["left"] -= 1
+        return True
+
+    channel_options = [("grpc.max_receive_message_length", -1), ("grpc.max_send_message_length", -1)]
+    async with grpc.aio.insecure_channel(args.target, options=channel_options) as channel:
+        stubs = (relighting_pb2_grpc.RelightingServiceStub(channel), pose_pb2_grpc.PoseChangingServiceStub(channel))
+
+        async def one():
+            kind, request = workload.next_request()
+            request_start = time.monotonic()
+            code, first_message_s = await send(stubs, kind, request, args)
+            recorder.record(kind, request_start, time.monotonic(), code, first_message_s)
+
+        if args.mode == "closed":
+            async def client():
+                while take():
+                    await one()
+
+            await asyncio.gather(*(client() for _ in range(args.concurrency)))
+        else:
+            in_flight = set()
+            rng = random.Random(args.seed + 1)
+            next_arrival = time.monotonic()
+            while take():
+                await asyncio.sleep(max(next_arrival - time.monotonic(), 0))
+                next_arrival += rng.expovariate(args.rate)
+                if len(in_flight) >= args.concurrency:
+                    #the client is saturated, count it instead of queueing it up locally
+                    if time.monotonic() >= start + args.warmup:
+                        recorder.dropped += 1
+                    continue
+                task = asyncio.create_task(one())
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            if in_flight:
+                await asyncio.gather(*in_flight)
+
+    report = recorder.report(workload.kinds)
+    report["config"] = {
+        "target": args.target,
+        "mode": args.mode,
+        "concurrency": args.concurrency,
+        "rate": args.rate if args.mode == "open" else None,
+        "mix": args.mix,
+        "image_sizes": [[width, height] for _, _, width, height in workload.images],
+        "lights": args.lights or [2],
+        "streaming": args.streaming,
+        "output_format": args.output_format,
+        "warmup_s": args.warmup,
+    }
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark an Aurora backend node over gRPC")
+    parser.add_argument("--target", default="localhost:50051", help="host:port of the server")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed",
+                        help="closed: --concurrency clients send back to back, open: Poisson arrivals at --rate")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Requests in flight (closed loop) or the most allowed in flight (open loop)")
+    parser.add_argument("--rate", type=float, default=1.0, help="Open loop arrival rate in requests per second")
+    parser.add_argument("--duration", type=float, default=60.0, help="Measured seconds, after the warmup")
+    parser.add_argument("--warmup", type=float, default=0.0, help="Seconds of load before measuring starts")
+    parser.add_argument("--requests", type=int, default=None, help="Stop after starting this many requests")
+    parser.add_argument("--mix", type=parse_mix, default={"relight": 1.0, "pose": 1.0},
+                        help="Request mix as kind=weight, e.g. relight=3,pose=1")
+    parser.add_argument("--image", action="append", default=[], help="Input image file (repeatable)")
+    parser.add_argument("--image-size", action="append", type=parse_size,
+                        help="Synthetic input image size WxH (repeatable, default 512x512)")
+    parser.add_argument("--lights", action="append", type=int,
+                        help="Number of random lights per relight request (repeatable, default 2)")
+    parser.add_argument("--lights-file", help="LightsRequest json sent with every relight request instead")
+    parser.add_argument("--skeleton-offset", type=float, default=40.0,
+                        help="Largest random keypoint offset in pixels of pose requests")
+    parser.add_argument("--skeleton-file", help="new_skeleton_data json sent with every pose request instead")
+    parser.add_argument("--steps", type=int, default=30, help="num_steps of pose requests")
+    parser.add_argument("--strength", type=float, default=0.85, help="strength of pose requests")
+    parser.add_argument("--output-format", choices=tuple(OUTPUT_FORMATS), default="png")
+    parser.add_argument("--quality", type=int, default=0, help="JPEG/WebP quality (0 for the server default)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Use RelightStream/ChangePoseStream and also report the time to the first message")
+    parser.add_argument("--allow-cache-hits", action="store_true",
+                        help="Send repeated requests as they are instead of giving each one a fresh seed")
+    parser.add_argument("--metadata", action="append", default=[],
+                        help="key=value gRPC metadata for every request, e.g. x-priority=low (repeatable)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request deadline in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the workload generator")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    args.metadata = tuple(tuple(item.split("=", 1)) for item in args.metadata)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run_benchmark(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    total = report["total"]
+    latency = total["latency_s"]
+    print(
+        f"[INFO] : {total['ok']}/{total['requests']} ok, {total['throughput_rps']:.2f} req/s, "
+        f"p50 {latency['p50'] or 0:.2f} s, p95 {latency['p95'] or 0:.2f} s, p99 {latency['p99'] or 0:.2f} s",
+        file=sys.stderr
+    )
+
+
+if __name__ == "__main__":
+    main()
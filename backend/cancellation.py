@@ -0,0 +1,98 @@
+import threading
+import time
+
+
+class RequestCancelled(Exception):
+    """Raised by CancelToken.check() once nobody is waiting for the request's result anymore."""
+
+    def __init__(self, reason="cancelled"):
+        super().__init__(f"Request {reason}")
+        self.reason = reason
+
+    def __reduce__(self):
+        return RequestCancelled, (self.reason,)
+
+
+class CancelToken:
+    """
+    Tells long running work that its client has gone away or its deadline has passed.
+
+    Pipelines take an optional `cancel_token` and call `cancel_token.check()` between stages
+    and once per denoising step, which raises RequestCancelled so the remaining work is skipped.
+
+    Args:
+        deadline: time.monotonic() value after which the request counts as cancelled (None for no deadline)
+        event: Object with set() / is_set() backing the token, e.g. a multiprocessing.Event
+               shared with a worker process (a new threading.Event by default)
+    """
+
+    def __init__(self, deadline=None, event=None):
+        self.deadline = deadline
+        self._event = event if event is not None else threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def reason(self):
+        """'cancelled', 'deadline exceeded' or None while the request is still wanted."""
+        if self._event.is_set():
+            return "cancelled"
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return "deadline exceeded"
+        return None
+
+    @property
+    def cancelled(self):
+        return self.reason is not None
+
+    def check(self):
+        reason = self.reason
+        if reason is not None:
+            raise RequestCancelled(reason)
+
+
+class SharedCancelToken(CancelToken):
+    """
+    Token of work done for several requests at once, cancelled only when every one of them is.
+
+    Args:
+        tokens: CancelTokens of the requests sharing the work, None for a request that is never cancelled
+    """
+
+    def __init__(self, tokens=()):
+        super().__init__()
+        self._tokens = list(tokens)
+        self._lock = threading.Lock()
+
+    def add(self, token):
+        """Share the work with one more request."""
+        with self._lock:
+            self._tokens.append(token)
+
+    @property
+    def reason(self):
+        if self._event.is_set():
+            return "cancelled"
+        with self._lock:
+            tokens = list(self._tokens)
+        reasons = [token.reason if token is not None else None for token in tokens]
+        if not reasons or None in reasons:
+            return None
+        return reasons[-1]
+
+
+def context_cancel_token(context):
+    """
+    CancelToken for a gRPC call, cancelled when the RPC terminates (client disconnect, deadline)
+    and expiring with the call's deadline. Works with grpc and grpc.aio servicer contexts.
+    """
+    remaining = context.time_remaining()
+    token = CancelToken(deadline=time.monotonic() + remaining if remaining is not None else None)
+    if hasattr(context, "add_done_callback"):
+        #grpc.aio, runs on the event loop when the call is done
+        context.add_done_callback(lambda _: token.cancel())
+    elif not context.add_callback(token.cancel):
+        #sync server, add_callback returns False if the call already terminated
+        token.cancel()
+    return token
@@ -0,0 +1,208 @@
+import glob
+import json
+import os
+import queue
+import random
+import struct
+import threading
+import time
+
+from . import relighting_pb2
+from . import pose_pb2
+
+#request message of every RPC, chunked uploads are captured as the reassembled request
+REQUEST_TYPES = {
+    "Relight": relighting_pb2.RelightRequest,
+    "RelightStream": relighting_pb2.RelightRequest,
+    "RelightChunked": relighting_pb2.RelightRequest,
+    "ChangePose": pose_pb2.PoseRequest,
+    "ChangePoseStream": pose_pb2.PoseRequest,
+    "ChangePoseChunked": pose_pb2.PoseRequest,
+}
+
+#every record is <header length><request length> as little-endian uint32, the JSON header and the request proto
+_RECORD_PREFIX = struct.Struct("<II")
+FILE_PATTERN = "capture-*.bin"
+
+#metadata set by the gRPC stack rather than the client, replays get their own
+_TRANSPORT_METADATA = ("user-agent", ":authority")
+
+
+def replayable_metadata(metadata):
+    """(key, value) pairs of the invocation `metadata` a replay should send again, binary headers are left out."""
+    return [
+        (key, value) for key, value in metadata or ()
+        if not key.endswith("-bin") and not key.startswith("grpc-") and key not in _TRANSPORT_METADATA
+    ]
+
+
+class CapturedRequest:
+    """
+    One sampled request, filled in by the handler and written once it completes.
+
+    Args:
+        rpc: RPC method name, e.g. "RelightStream"
+        metadata: Invocation metadata worth replaying, (key, value) pairs
+        deadline_s: Seconds the client gave the call, None without a deadline
+    """
+
+    def __init__(self, rpc, metadata=(), deadline_s=None):
+        self.rpc = rpc
+        self.metadata = list(metadata)
+        self.deadline_s = deadline_s
+        self.arrival_unix_s = time.time()
+        self.arrival_s = time.perf_counter()
+        self.request = None
+
+    def set_request(self, request, image_data=None, mask_data=None):
+        """Attach the request, with the image/mask of a chunked upload put back into it."""
+        if image_data is not None or mask_data is not None:
+            captured = type(request)()
+            captured.CopyFrom(request)
+            if image_data is not None:
+                captured.image_data = bytes(image_data)
+            if mask_data is not None:
+                captured.mask_data = bytes(mask_data)
+            request = captured
+        self.request = request
+
+
+class TrafficCapture:
+    """
+    Writes a sample of the served requests to rotating capture files for offline replay
+    (python -m backend.replay).
+
+    Every record holds the raw request proto, the RPC, its arrival time, deadline and
+    metadata, the status it finished with and its tracer spans. Records are written by a
+    background thread, requests completing while its queue is full are dropped instead of
+    holding up the server.
+
+    Args:
+        directory: Directory of the capture files
+        sample_rate: Share of the requests captured (0-1)
+        max_file_bytes: A new file is started once the current one is larger
+        max_files: The oldest files are deleted beyond this many
+        max_pending: Records waiting for the writer before new ones are dropped
+    """
+
+    def __init__(self, directory, sample_rate, max_file_bytes=256 * 1024 * 1024, max_files=20, max_pending=64):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.captured = 0
+        self.dropped = 0
+        self._pending = queue.Queue(max_pending)
+        self._file = None
+        self._file_index = 0
+        self._writer = threading.Thread(target=self._write_loop, name="traffic-capture", daemon=True)
+        self._writer.start()
+
+    def sample(self, rpc, metadata=(), deadline_s=None):
+        """Returns a CapturedRequest for the call if it is sampled, None otherwise."""
+        if random.random() >= self.sample_rate:
+            return None
+        return CapturedRequest(rpc, metadata, deadline_s)
+
+    def finish(self, captured, code, spans=()):
+        """Queue `captured` for writing once its call ended with status `code` (a grpc.StatusCode name)."""
+        if captured.request is None:
+            #the call failed before its request was known, e.g. a broken upload
+            return
+        try:
+            self._pending.put_nowait((captured, code, time.perf_counter() - captured.arrival_s, list(spans)))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Write the queued records and close the current file."""
+        self._pending.put(None)
+        self._writer.join()
+
+    def _write_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            try:
+                self._write(*item)
+            except Exception as e:
+                self.dropped += 1
+                print(f"[WARNING] : Could not write captured request: {e}")
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, captured, code, elapsed_s, spans):
+        header = json.dumps({
+            "rpc": captured.rpc,
+            "arrival_unix_s": captured.arrival_unix_s,
+            "deadline_s": captured.deadline_s,
+            "metadata": captured.metadata,
+            "code": code,
+            "elapsed_s": elapsed_s,
+            #[name, start relative to the arrival, wall seconds, CPU seconds or None]
+            "spans": [
+                [span.name, span.start_s - captured.arrival_s, span.wall_s, span.cpu_s]
+                for span in sorted(spans, key=lambda span: span.start_s)
+            ],
+        }).encode()
+        payload = captured.request.SerializeToString()
+
+        if self._file is None or self._file.tell() >= self.max_file_bytes:
+            self._rotate()
+        self._file.write(_RECORD_PREFIX.pack(len(header), len(payload)))
+        self._file.write(header)
+        self._file.write(payload)
+        self._file.flush()
+        self.captured += 1
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        self._file_index += 1
+        name = f"capture-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._file_index:04d}.bin"
+        self._file = open(os.path.join(self.directory, name), "wb")
+
+        files = sorted(glob.glob(os.path.join(self.directory, FILE_PATTERN)), key=os.path.getmtime)
+        for path in files[:max(len(files) - self.max_files, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        """
+        Returns:
+            dict: requests written and requests dropped because the writer fell behind
+        """
+        return {"captured": self.captured, "dropped": self.dropped}
+
+
+def capture_files(paths):
+    """Capture files named by `paths` (files or directories), oldest first."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, FILE_PATTERN)))
+        else:
+            files.append(path)
+    return sorted(files, key=os.path.getmtime)
+
+
+def read_capture(path):
+    """Yield (header dict, request proto) for every record in the capture file `path`."""
+    with open(path, "rb") as f:
+        while True:
+            prefix = f.read(_RECORD_PREFIX.size)
+            if len(prefix) < _RECORD_PREFIX.size:
+                #end of file, or a record cut short by a crash
+                return
+            header_len, payload_len = _RECORD_PREFIX.unpack(prefix)
+            header_data = f.read(header_len)
+            payload = f.read(payload_len)
+            if len(header_data) < header_len or len(payload) < payload_len:
+                return
+            header = json.loads(header_data)
+            yield header, REQUEST_TYPES[header["rpc"]].FromString(payload)
@@ -0,0 +1,114 @@
+class UploadBuffer:
+    """
+    Preallocated buffer that an upload's chunks are copied into, in order.
+
+    Args:
+        size: Announced size of the upload in bytes
+        max_size: Largest upload accepted, guards the preallocation against bogus headers
+    """
+
+    def __init__(self, size, max_size):
+        if size < 0 or size > max_size:
+            raise ValueError(f"Upload size {size} is outside the accepted range (0-{max_size} bytes)")
+        self.data = bytearray(size)
+        self.filled = 0
+
+    def write(self, chunk):
+        end = self.filled + len(chunk)
+        if end > len(self.data):
+            raise ValueError(f"Upload is larger than the announced {len(self.data)} bytes")
+        self.data[self.filled:end] = chunk
+        self.filled = end
+
+    @property
+    def complete(self):
+        return self.filled == len(self.data)
+
+
+class ChunkWriter:
+    """
+    Write-only file object that hands out fixed-size chunks as soon as they fill up.
+
+    Passing it to `PIL.Image.save` streams the encoded image while the encoder is still running.
+
+    Args:
+        emit: Callable(data, offset, last) receiving each chunk
+        chunk_size: Chunk size in bytes (the last chunk may be smaller)
+    """
+
+    def __init__(self, emit, chunk_size):
+        self.emit = emit
+        self.chunk_size = chunk_size
+        self.offset = 0
+        self._pending = bytearray()
+
+    def write(self, data):
+        self._pending += data
+        while len(self._pending) >= self.chunk_size:
+            self._send(bytes(self._pending[:self.chunk_size]), last=False)
+            del self._pending[:self.chunk_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Send whatever is left as the last chunk."""
+        self._send(bytes(self._pending), last=True)
+        self._pending = bytearray()
+
+    def _send(self, data, last):
+        self.emit(data, self.offset, last)
+        self.offset += len(data)
+
+
+def iter_chunks(data, chunk_size):
+    """Split `data` into consecutive chunks of at most `chunk_size` bytes."""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield bytes(view[start:start + chunk_size])
+
+
+class ChunkedUpload:
+    """
+    Assembles a header-then-chunks upload (RelightChunk / PoseChunk) into preallocated buffers.
+
+    The header announces `<part>_size` for every part, the chunks arrive as `<part>_chunk`
+    payloads. For example parts=("image", "mask") for RelightChunk.
+
+    Args:
+        parts: Names of the uploaded parts
+        max_size: Largest accepted size per part in bytes
+    """
+
+    def __init__(self, parts, max_size):
+        self.parts = parts
+        self.max_size = max_size
+        self.header = None
+        self.buffers = {}
+
+    def add(self, message):
+        kind = message.WhichOneof("payload")
+        if kind == "header":
+            if self.header is not None:
+                raise ValueError("Upload has more than one header")
+            self.header = message.header
+            self.buffers = {
+                part: UploadBuffer(getattr(self.header, f"{part}_size"), self.max_size) for part in self.parts
+            }
+        elif self.header is None:
+            raise ValueError("Upload must start with a header")
+        elif kind is not None:
+            self.buffers[kind[:-len("_chunk")]].write(getattr(message, kind))
+
+    def finish(self):
+        """
+        Returns:
+            tuple: (request from the header, {part: bytearray})
+        """
+        if self.header is None:
+            raise ValueError("Upload must start with a header")
+        for part, buffer in self.buffers.items():
+            if not buffer.complete:
+                raise ValueError(f"Upload ended after {buffer.filled} of {len(buffer.data)} {part} bytes")
+        return self.header.request, {part: buffer.data for part, buffer in self.buffers.items()}
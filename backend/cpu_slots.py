@@ -0,0 +1,189 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import torch
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+
+def available_cores():
+    """Cores this process may run on, in order."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_slots(num_slots, reserved_cores=0, cores=None):
+    """
+    Split the available cores into `num_slots` contiguous groups of equal size.
+
+    The first `reserved_cores` are left out for the server's own threads, the leftover cores
+    of an uneven split go unused. An explicit `cores` layout (list of core lists) is used as is.
+
+    Returns:
+        list of tuple: the cores of every slot
+    """
+    if cores:
+        return [tuple(slot) for slot in cores]
+    usable = available_cores()
+    if reserved_cores and len(usable) > reserved_cores:
+        usable = usable[reserved_cores:]
+    per_slot = len(usable) // num_slots
+    if per_slot == 0:
+        raise ValueError(f"Cannot split {len(usable)} cores into {num_slots} slots")
+    return [tuple(usable[i * per_slot:(i + 1) * per_slot]) for i in range(num_slots)]
+
+
+def apply_thread_limits(cores, pin=True, opencv=True):
+    """
+    Size torch, numba and OpenCV to `cores` and pin the calling thread to them.
+
+    Affinity, torch (OpenMP) and numba thread counts are per thread, thread pools the thread
+    starts afterwards inherit them. OpenCV's count is process-wide, `opencv=False` leaves it
+    alone. numba is only sized once something imported it, importing it here would add its
+    startup cost to every process.
+    """
+    num_threads = len(cores)
+    if pin and hasattr(os, "sched_setaffinity"):
+        #pid 0 is the calling thread on Linux
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(num_threads)
+    numba = sys.modules.get("numba")
+    if numba is not None:
+        numba.set_num_threads(min(num_threads, numba.config.NUMBA_NUM_THREADS))
+    if opencv and cv2 is not None:
+        cv2.setNumThreads(num_threads)
+
+
+def thread_limits():
+    """Affinity, torch and numba thread counts of the calling thread, for restore_thread_limits()."""
+    affinity = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else None
+    numba = sys.modules.get("numba")
+    return affinity, torch.get_num_threads(), numba.get_num_threads() if numba is not None else None
+
+
+def merge_thread_limits(limits):
+    """
+    Limits of one thread doing the work of the threads whose thread_limits() are `limits`.
+
+    The cores are their union, the thread counts their sums, at most one thread per core.
+    """
+    affinities = [affinity for affinity, _, _ in limits if affinity is not None]
+    affinity = set().union(*affinities) if affinities else None
+    cap = len(affinity) if affinity else None
+    torch_threads = sum(torch_threads for _, torch_threads, _ in limits)
+    numba_counts = [numba_threads for _, _, numba_threads in limits if numba_threads is not None]
+    numba_threads = sum(numba_counts) if numba_counts else None
+    if numba_threads is not None:
+        numba_threads = min(numba_threads, sys.modules["numba"].config.NUMBA_NUM_THREADS)
+    if cap:
+        torch_threads = min(torch_threads, cap)
+        numba_threads = min(numba_threads, cap) if numba_threads is not None else None
+    return affinity, torch_threads, numba_threads
+
+
+def restore_thread_limits(limits):
+    """Put the calling thread back to `limits` taken by thread_limits()."""
+    affinity, torch_threads, numba_threads = limits
+    if affinity is not None:
+        os.sched_setaffinity(0, affinity)
+    torch.set_num_threads(torch_threads)
+    numba = sys.modules.get("numba")
+    if numba is not None and numba_threads is not None:
+        numba.set_num_threads(numba_threads)
+
+
+class CpuSlots:
+    """
+    Hands out CPU inference slots, disjoint groups of cores, one request at a time each.
+
+    Without it every concurrent request sizes torch, numba, OpenCV and MediaPipe to all cores
+    and the server's threads oversubscribe the machine. A thread entering a slot is pinned to
+    its cores with matching torch and numba thread counts until it leaves the slot, the others
+    wait for a free slot. OpenCV's thread count is process-wide, it is set once to the size of
+    the largest slot, so that every slot running OpenCV at once keeps to the slots' cores.
+
+    Args:
+        layout: List of core tuples, one per slot (see plan_slots)
+    """
+
+    #how often a waiting request looks at its cancel token
+    CANCEL_POLL_S = 0.1
+
+    def __init__(self, layout):
+        self.layout = [tuple(cores) for cores in layout]
+        self._free = list(range(len(self.layout)))
+        self._cond = threading.Condition()
+        #limits of the threads in a slot from before they entered it
+        self._saved = threading.local()
+        self._requests = [0] * len(self.layout)
+        self._waited = 0
+        self._wait_s = 0.0
+        if cv2 is not None:
+            cv2.setNumThreads(max(len(cores) for cores in self.layout))
+        print(f"[INFO] : {len(self.layout)} CPU inference slots of "
+              f"{', '.join(str(len(cores)) for cores in self.layout)} cores")
+
+    def acquire(self, cancel_token=None):
+        """
+        Wait for a free slot and pin the calling thread to it. Returns the slot index for release().
+
+        With a `cancel_token` the wait ends with its RequestCancelled once it fires.
+        """
+        start = time.perf_counter()
+        with self._cond:
+            while not self._free:
+                self._cond.wait(self.CANCEL_POLL_S if cancel_token is not None else None)
+                if cancel_token is not None and not self._free:
+                    cancel_token.check()
+            index = min(self._free)
+            self._free.remove(index)
+            self._requests[index] += 1
+            waited = time.perf_counter() - start
+            if waited > 0.001:
+                self._waited += 1
+                self._wait_s += waited
+
+        self._saved.limits = thread_limits()
+        apply_thread_limits(self.layout[index], opencv=False)
+        return index
+
+    def release(self, index):
+        """Free slot `index`, the thread that acquired it gets its affinity and thread counts back."""
+        limits = getattr(self._saved, "limits", None)
+        if limits is not None:
+            restore_thread_limits(limits)
+            self._saved.limits = None
+        with self._cond:
+            self._free.append(index)
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self, cancel_token=None):
+        """Context manager running its body in a free slot, yields the slot index."""
+        index = self.acquire(cancel_token)
+        try:
+            yield index
+        finally:
+            self.release(index)
+
+    def stats(self):
+        """
+        Returns:
+            dict: slots, cores per slot, busy slots, requests per slot, requests that waited and their total wait
+        """
+        with self._cond:
+            return {
+                "slots": len(self.layout),
+                "cores": [len(cores) for cores in self.layout],
+                "busy": len(self.layout) - len(self._free),
+                "requests": list(self._requests),
+                "waited": self._waited,
+                "wait_s": self._wait_s,
+            }
@@ -0,0 +1,79 @@
+import asyncio
+import functools
+import io
+from concurrent import futures
+
+from .ml_models import cfg
+from .tracing import traced
+#pose.proto defines the same OutputFormat values
+from .relighting_pb2 import PNG, JPEG, WEBP, RAW_RGB
+
+#encoding runs here instead of on the inference workers, so they can move on to the next request
+encoder_pool = futures.ThreadPoolExecutor(max_workers=cfg.ENCODER_WORKERS, thread_name_prefix="encoder")
+
+
+def prepare_output(image, output_format):
+    """
+    Convert the processed image to a mode the output format can store.
+
+    Returns:
+        tuple: (converted PIL.Image, (width, height, channels))
+    """
+    if output_format in (JPEG, RAW_RGB):
+        image = image.convert("RGB")
+    elif image.mode not in ("L", "LA", "RGB", "RGBA"):
+        image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+    return image, (image.width, image.height, len(image.getbands()))
+
+
+def write_image(image, fp, output_format=PNG, quality=0, png_compress_level=None):
+    """
+    Encode an image returned by prepare_output into the file object `fp`.
+
+    Args:
+        output_format: OutputFormat value
+        quality: JPEG/WebP quality 1-100, 0 for the configured default
+        png_compress_level: zlib level 0-9, None for the configured default
+    """
+    if not 0 <= quality <= 100:
+        raise ValueError(f"quality must be between 1 and 100, got {quality}")
+
+    if output_format == RAW_RGB:
+        fp.write(image.tobytes())
+    elif output_format == JPEG:
+        image.save(fp, format="JPEG", quality=quality or cfg.JPEG_QUALITY)
+    elif output_format == WEBP:
+        image.save(fp, format="WEBP", quality=quality or cfg.WEBP_QUALITY)
+    elif output_format == PNG:
+        if png_compress_level is None:
+            png_compress_level = cfg.PNG_COMPRESS_LEVEL
+        if not 0 <= png_compress_level <= 9:
+            raise ValueError(f"png_compress_level must be between 0 and 9, got {png_compress_level}")
+        image.save(fp, format="PNG", compress_level=png_compress_level)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
+
+
+def output_options(request):
+    """Read (output_format, quality, png_compress_level) from a RelightRequest or PoseRequest."""
+    png_compress_level = request.png_compress_level if request.HasField("png_compress_level") else None
+    return request.output_format, request.quality, png_compress_level
+
+
+def encode_response(image, request, message_cls, tracer=None, **fields):
+    """Encode the processed image as `request` asks and wrap it, with its shape, in a message_cls."""
+    output_format, quality, png_compress_level = output_options(request)
+    with traced(tracer, "encode"):
+        image, (width, height, channels) = prepare_output(image, output_format)
+        buffer = io.BytesIO()
+        write_image(image, buffer, output_format, quality, png_compress_level)
+    return message_cls(
+        processed_image_data=buffer.getvalue(), width=width, height=height, channels=channels, **fields
+    )
+
+
+async def encode_response_async(image, request, message_cls, tracer=None, **fields):
+    """encode_response on the encoder pool."""
+    return await asyncio.get_running_loop().run_in_executor(
+        encoder_pool, functools.partial(encode_response, image, request, message_cls, tracer, **fields)
+    )
@@ -0,0 +1,106 @@
+import io
+import math
+
+from PIL import Image, ImageOps
+
+EXIF_ORIENTATION = 0x0112
+#EXIF orientations that turn the image by 90 or 270 degrees, swapping width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+#modes Image.reduce() works on, others are converted first
+REDUCIBLE_MODES = ("L", "RGB", "RGBA", "CMYK")
+
+
+def reduction_factor(width, height, max_pixels):
+    """Smallest integer the sides are divided by to fit `max_pixels` pixels, 1 if they fit or max_pixels is 0."""
+    if not max_pixels or width * height <= max_pixels:
+        return 1
+    factor = max(1, int(math.sqrt(width * height / max_pixels)))
+    while math.ceil(width / factor) * math.ceil(height / factor) > max_pixels:
+        factor += 1
+    return factor
+
+
+def capped_size(width, height, max_pixels):
+    """Largest size decode_image may return for a width x height upload."""
+    factor = reduction_factor(width, height, max_pixels)
+    return math.ceil(width / factor), math.ceil(height / factor)
+
+
+def _open(data):
+    """Open encoded `data`. Returns (PIL.Image, whether its EXIF orientation swaps width and height)."""
+    image = Image.open(io.BytesIO(data))
+    return image, image.getexif().get(EXIF_ORIENTATION, 1) in TRANSPOSED_ORIENTATIONS
+
+
+def decode_image(data, max_pixels=0):
+    """
+    Decode an uploaded image upright and with at most `max_pixels` pixels (0: full size).
+
+    Larger images are divided by an integer factor: JPEGs are decoded in draft mode, libjpeg
+    then only produces 1/2, 1/4 or 1/8 of the pixels and the full resolution never exists in
+    memory, what is still too large is box-reduced. Integer factors keep it cheap, a resample to
+    exactly `max_pixels` costs about as much as the decode it saves, so the image can end up with
+    down to a quarter of them. The EXIF orientation is applied to the reduced pixels.
+
+    Returns:
+        tuple: (PIL.Image, (x, y) scale from the upright upload's pixels to the decoded image's)
+    """
+    image, transposed = _open(data)
+    width, height = image.size
+    factor = reduction_factor(width, height, max_pixels)
+    if factor > 1:
+        image.draft(None, (math.ceil(width / factor), math.ceil(height / factor)))
+        image.load()
+        factor = reduction_factor(*image.size, max_pixels)
+    else:
+        image.load()
+    if factor > 1:
+        if image.mode not in REDUCIBLE_MODES:
+            image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+        image = image.reduce(factor)
+    ImageOps.exif_transpose(image, in_place=True)
+
+    if transposed:
+        width, height = height, width
+    return image, (image.width / width, image.height / height)
+
+
+def decode_mask(data, size):
+    """Decode an uploaded mask upright and at `size`, the size its image was decoded at."""
+    mask, transposed = _open(data)
+    stored_size = tuple(size)[::-1] if transposed else tuple(size)
+    if mask.size == stored_size:
+        mask.load()
+    else:
+        #draft keeps at least stored_size, its libjpeg scale (1/2, 1/4, 1/8) need not be the factor the
+        #image was divided by (e.g. 3), so what reduce() leaves over is resampled to stored_size
+        mask.draft(None, stored_size)
+        mask.load()
+        factor = min(mask.width // stored_size[0], mask.height // stored_size[1])
+        if factor > 1:
+            if mask.mode not in REDUCIBLE_MODES:
+                mask = mask.convert("L")
+            mask = mask.reduce(factor)
+        if mask.size != stored_size:
+            mask = mask.resize(stored_size, Image.BILINEAR, reducing_gap=2.0)
+    ImageOps.exif_transpose(mask, in_place=True)
+    return mask
+
+
+def decode_inputs(image_data, mask_data=None, max_pixels=0):
+    """
+    decode_image, and decode_mask for the optional mask so it stays aligned with the image.
+
+    Returns:
+        tuple: (PIL.Image, mask PIL.Image or None, (x, y) scale of the image)
+    """
+    image, scale = decode_image(image_data, max_pixels)
+    mask = decode_mask(mask_data, image.size) if mask_data else None
+    return image, mask, scale
+
+
+def scale_points(points, scale):
+    """[x, y] points in pixels of the upload (e.g. a pose skeleton) in pixels of the decoded image."""
+    if scale == (1.0, 1.0):
+        return points
+    return [[point[0] * scale[0], point[1] * scale[1], *point[2:]] for point in points]
@@ -0,0 +1,169 @@
+import asyncio
+import functools
+import itertools
+import time
+from concurrent import futures
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted to an inference queue that is already at capacity."""
+
+    def __init__(self, queue_name, retry_after_ms):
+        super().__init__(f"{queue_name} queue is full, retry after {retry_after_ms} ms")
+        self.queue_name = queue_name
+        self.retry_after_ms = retry_after_ms
+
+
+#job priorities, lower values are served first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class InferenceQueue:
+    """
+    Bounded priority queue of inference jobs drained by a fixed number of workers.
+
+    Jobs are plain callables, they run on a thread pool owned by the queue so the
+    event loop stays free to accept (or reject) new requests while a model is busy.
+    Jobs of the same priority run first-come-first-served. Every job carries an
+    estimated cost, which the queue turns into wait time estimates by learning how
+    many seconds a unit of cost takes.
+
+    Args:
+        name: Name used in logs and error messages (e.g. "relight")
+        max_size: Maximum number of jobs waiting to be picked up by a worker
+        num_workers: Number of jobs that may run at the same time
+    """
+
+    #initial guesses for the service time and the time per unit of cost, refined as jobs complete
+    DEFAULT_SERVICE_TIME_S = 10.0
+    DEFAULT_SECONDS_PER_COST = 0.2
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, name, max_size, num_workers):
+        self.name = name
+        self.max_size = max_size
+        self.num_workers = num_workers
+        self.in_flight = 0
+        self.rejected = 0
+        self.avg_service_time_s = self.DEFAULT_SERVICE_TIME_S
+        self.seconds_per_cost = self.DEFAULT_SECONDS_PER_COST
+        self.in_flight_cost = 0.0
+
+        self._queued_cost = {}  #priority -> summed cost of the jobs waiting with that priority
+        self._sequence = itertools.count()
+        self._queue = None
+        self._workers = []
+        self._stopped = False
+        self._executor = futures.ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix=f"{name}-worker")
+
+    @property
+    def depth(self):
+        """Number of jobs waiting for a worker."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def retry_after_ms(self):
+        """Estimate how long a rejected caller should wait before retrying."""
+        pending = self.depth + self.in_flight
+        return int(1000 * self.avg_service_time_s * max(pending, 1) / self.num_workers)
+
+    def estimated_wait_s(self, priority=PRIORITY_NORMAL):
+        """Estimate how long a job submitted now with `priority` waits before a worker picks it up."""
+        ahead = sum(cost for job_priority, cost in self._queued_cost.items() if job_priority <= priority)
+        #running jobs are half done on average
+        ahead += self.in_flight_cost / 2
+        return ahead * self.seconds_per_cost / self.num_workers
+
+    async def start(self):
+        """Create the queue and spawn the workers on the running event loop."""
+        self._queue = asyncio.PriorityQueue(maxsize=self.max_size)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+
+    async def stop(self):
+        """
+        Cancel the workers and wait for running jobs to finish.
+
+        The futures of jobs still waiting, of running jobs and of jobs enqueued afterwards are
+        cancelled, so nobody awaits a job that no worker will pick up.
+        """
+        self._stopped = True
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        while self._queue is not None and not self._queue.empty():
+            priority, _, future, _, cost = self._queue.get_nowait()
+            self._queued_cost[priority] -= cost
+            future.cancel()
+            self._queue.task_done()
+        self._executor.shutdown(wait=True)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Enqueue `fn(*args, **kwargs)` with normal priority and unit cost without blocking.
+
+        Returns:
+            asyncio.Future resolving to the return value of `fn`.
+            Cancelling the future before a worker picks the job up drops the job.
+
+        Raises:
+            QueueFullError: if `max_size` jobs are already waiting.
+        """
+        return self.enqueue(functools.partial(fn, *args, **kwargs))
+
+    def enqueue(self, job, priority=PRIORITY_NORMAL, cost=1.0):
+        """
+        Enqueue the callable `job` without blocking, see submit().
+
+        Args:
+            job: Callable taking no arguments
+            priority: PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW
+            cost: Estimated cost of the job (see admission.estimate_*_cost)
+        """
+        future = asyncio.get_running_loop().create_future()
+        if self._stopped:
+            future.cancel()
+            return future
+        try:
+            self._queue.put_nowait((priority, next(self._sequence), future, job, cost))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(self.name, self.retry_after_ms()) from None
+        self._queued_cost[priority] = self._queued_cost.get(priority, 0.0) + cost
+        return future
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            priority, _, future, job, cost = await self._queue.get()
+            self._queued_cost[priority] -= cost
+            try:
+                #caller went away while the job was waiting
+                if future.cancelled():
+                    continue
+
+                self.in_flight += 1
+                self.in_flight_cost += cost
+                start = time.monotonic()
+                try:
+                    result = await loop.run_in_executor(self._executor, job)
+                except asyncio.CancelledError:
+                    #stop() cancelled this worker, the job itself finishes on the executor
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    self.in_flight -= 1
+                    self.in_flight_cost -= cost
+                    elapsed = time.monotonic() - start
+                    self.avg_service_time_s += self.EWMA_ALPHA * (elapsed - self.avg_service_time_s)
+                    if cost > 0:
+                        self.seconds_per_cost += self.EWMA_ALPHA * (elapsed / cost - self.seconds_per_cost)
+            finally:
+                self._queue.task_done()
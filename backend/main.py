@@ -1,17 +1,43 @@
+import asyncio
 import grpc
 from concurrent import futures
 import time
 
 from . import relighting_pb2_grpc
 from . import pose_pb2_grpc
-from .service import RelightingService, PoseChangingService
+from . import admin_pb2_grpc
+from .admission import AdmissionController
+from .inference_queue import InferenceQueue
+from .metrics import MetricsInterceptor, SyncMetricsInterceptor, start_metrics_server
+from .ml_models import cfg
+from .service import start_worker_pool, stop_worker_pool, start_capture, stop_capture, server_stats
+from .service import RelightingService, PoseChangingService, AsyncRelightingService, AsyncPoseChangingService
+from .service import AdminService, AsyncAdminService
+from .warmup import warmup
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+COMPRESSION = {
+    "none": grpc.Compression.NoCompression,
+    "gzip": grpc.Compression.Gzip,
+    "deflate": grpc.Compression.Deflate,
+}
+
+def serve_sync():
+    stats = server_stats()
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=cfg.SERVER_SYNC_MAX_WORKERS),
+        interceptors=[SyncMetricsInterceptor(stats)],
+        compression=COMPRESSION[cfg.GRPC_COMPRESSION]
+    )
     relighting_pb2_grpc.add_RelightingServiceServicer_to_server(RelightingService(), server)
     pose_pb2_grpc.add_PoseChangingServiceServicer_to_server(PoseChangingService(), server)
-    server.add_insecure_port('[::]:50051')
-    print("Server started on port 50051")
+    admin_pb2_grpc.add_AdminServiceServicer_to_server(AdminService(stats), server)
+    if cfg.METRICS_PORT:
+        start_metrics_server(stats, cfg.METRICS_PORT)
+    server.add_insecure_port(f'[::]:{cfg.SERVER_PORT}')
+    if cfg.SERVER_UNIX_SOCKET:
+        server.add_insecure_port(f"unix:{cfg.SERVER_UNIX_SOCKET}")
+        print(f"[INFO] : Also listening on unix:{cfg.SERVER_UNIX_SOCKET}")
+    print(f"Server started on port {cfg.SERVER_PORT}")
     server.start()
     try:
         while True:
@@ -19,5 +45,62 @@ def serve():
     except KeyboardInterrupt:
         server.stop(0)
 
+async def serve_async():
+    #separate queues so a burst of one RPC cannot starve the other model
+    relight_queue = InferenceQueue("relight", cfg.RELIGHT_QUEUE_SIZE, cfg.RELIGHT_QUEUE_WORKERS)
+    pose_queue = InferenceQueue("pose", cfg.POSE_QUEUE_SIZE, cfg.POSE_QUEUE_WORKERS)
+    await relight_queue.start()
+    await pose_queue.start()
+
+    admission = AdmissionController(
+        tenant_header=cfg.ADMISSION_TENANT_HEADER,
+        priority_header=cfg.ADMISSION_PRIORITY_HEADER,
+        default_priority=cfg.ADMISSION_DEFAULT_PRIORITY,
+        tenant_max_concurrency=cfg.ADMISSION_TENANT_MAX_CONCURRENCY,
+        max_wait_s=cfg.ADMISSION_MAX_WAIT_S
+    )
+    stats = server_stats([relight_queue, pose_queue], admission)
+    server = grpc.aio.server(
+        interceptors=[MetricsInterceptor(stats)],
+        compression=COMPRESSION[cfg.GRPC_COMPRESSION]
+    )
+    relighting_pb2_grpc.add_RelightingServiceServicer_to_server(AsyncRelightingService(relight_queue, admission), server)
+    pose_pb2_grpc.add_PoseChangingServiceServicer_to_server(AsyncPoseChangingService(pose_queue, admission), server)
+    admin_pb2_grpc.add_AdminServiceServicer_to_server(AsyncAdminService(stats), server)
+    if cfg.METRICS_PORT:
+        start_metrics_server(stats, cfg.METRICS_PORT)
+    server.add_insecure_port(f'[::]:{cfg.SERVER_PORT}')
+    if cfg.SERVER_UNIX_SOCKET:
+        server.add_insecure_port(f"unix:{cfg.SERVER_UNIX_SOCKET}")
+        print(f"[INFO] : Also listening on unix:{cfg.SERVER_UNIX_SOCKET}")
+    await server.start()
+    print(f"Server started on port {cfg.SERVER_PORT} (aio)")
+    try:
+        await server.wait_for_termination()
+    finally:
+        await server.stop(0)
+        await relight_queue.stop()
+        await pose_queue.stop()
+
+def serve():
+    if cfg.SERVER_WORKER_PROCESSES:
+        start_worker_pool(cfg.SERVER_WORKER_PROCESSES)
+    try:
+        #before the port is opened, clients and readiness probes only see a warm server
+        if cfg.WARMUP_ENABLED:
+            warmup(cfg.WARMUP_RESOLUTIONS, cfg.WARMUP_POSE_STEPS)
+        if cfg.CAPTURE_SAMPLE_RATE > 0:
+            start_capture(cfg.CAPTURE_DIR, cfg.CAPTURE_SAMPLE_RATE, cfg.CAPTURE_MAX_FILE_BYTES, cfg.CAPTURE_MAX_FILES)
+        if cfg.SERVER_MODE == "sync":
+            serve_sync()
+        else:
+            try:
+                asyncio.run(serve_async())
+            except KeyboardInterrupt:
+                pass
+    finally:
+        stop_capture()
+        stop_worker_pool()
+
 if __name__ == '__main__':
-    serve()
\ No newline at end of file
+    serve()
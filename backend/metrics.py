@@ -0,0 +1,412 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grpc
+
+#inference takes seconds to minutes, so the buckets reach further than usual
+LATENCY_BUCKETS_S = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+class _RpcStats:
+    def __init__(self):
+        self.codes = {}  #status code name -> count
+        self.in_flight = 0
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS_S) + 1)  #last one is +Inf
+        self.latency_sum_s = 0.0
+
+    @property
+    def count(self):
+        return sum(self.codes.values())
+
+    def quantile(self, q):
+        """Approximate latency quantile from the histogram (upper bound of the matching bucket)."""
+        target = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS_S, self.bucket_counts):
+            seen += bucket_count
+            if seen >= target and seen:
+                return bound
+        return float("inf") if self.count else 0.0
+
+
+def is_cancellation(error):
+    """True for asyncio.CancelledError, raised into aio handlers when the client goes away."""
+    return type(error).__name__ == "CancelledError"
+
+
+def status_code_name(context, error=None):
+    """
+    Name of the status code a call ended with. Handlers that raised `error` without setting a
+    code count as CANCELLED for a cancellation and UNKNOWN otherwise, abort() sets the code first.
+    """
+    code = context.code()
+    if code is None:
+        if error is None:
+            code = grpc.StatusCode.OK
+        else:
+            code = grpc.StatusCode.CANCELLED if is_cancellation(error) else grpc.StatusCode.UNKNOWN
+    return code.name if isinstance(code, grpc.StatusCode) else str(code)
+
+
+def process_rss_bytes():
+    """Resident set size of this process, 0 where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def gpu_memory_bytes():
+    """(allocated, reserved) bytes of the torch CUDA allocator, zeros without CUDA."""
+    try:
+        import torch
+    except ImportError:
+        return 0, 0
+    if not torch.cuda.is_available():
+        return 0, 0
+    return torch.cuda.memory_allocated(), torch.cuda.memory_reserved()
+
+
+class ServerStats:
+    """
+    Request counters and latency histograms per RPC, plus a view of the server's queues,
+    admission control, loaded models and result cache.
+
+    Fed by MetricsInterceptor / SyncMetricsInterceptor, read by the metrics endpoint
+    (Prometheus text format) and the AdminService.GetStatus RPC.
+
+    Args:
+        queues: InferenceQueues to report on (empty for the sync server)
+        model_manager: ModelManager of this process
+        result_cache: ResultCache
+        worker_pool: WorkerPool, if inference runs in worker processes
+        admission: AdmissionController of the queues (None for the sync server)
+        single_flight: SingleFlight coalescing identical requests
+        quality: QualitySelector picking quality tiers (None when quality is not deadline-aware)
+        cpu_slots: CpuSlots the in-process inference runs in (None without CPU slots)
+        stages: StagedEngine the in-process relight requests run through (None without staged relighting)
+        pose_batcher: MicroBatcher merging the in-process pose inpaint calls (None in worker processes)
+    """
+
+    def __init__(self, queues=(), model_manager=None, result_cache=None, worker_pool=None, admission=None,
+                 single_flight=None, quality=None, cpu_slots=None, stages=None, pose_batcher=None):
+        self.queues = list(queues)
+        self.model_manager = model_manager
+        self.result_cache = result_cache
+        self.worker_pool = worker_pool
+        self.admission = admission
+        self.single_flight = single_flight
+        self.quality = quality
+        self.cpu_slots = cpu_slots
+        self.stages = stages
+        self.pose_batcher = pose_batcher
+        self.started_at = time.time()
+        self._rpcs = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self, rpc, context):
+        """Count one call of `rpc` and time it. The status code is read from `context` when the call ends."""
+        with self._lock:
+            stats = self._rpcs.setdefault(rpc, _RpcStats())
+            stats.in_flight += 1
+        start = time.monotonic()
+        code_name = None
+        try:
+            yield
+        except BaseException as e:
+            code_name = status_code_name(context, e)
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            if code_name is None:
+                code_name = status_code_name(context)
+            with self._lock:
+                stats.in_flight -= 1
+                stats.codes[code_name] = stats.codes.get(code_name, 0) + 1
+                stats.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS_S, elapsed)] += 1
+                stats.latency_sum_s += elapsed
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: uptime, per-RPC stats, queues, admission, models, cache, single flight, quality, CPU slots, stages,
+                  pose batching and memory
+        """
+        with self._lock:
+            rpcs = [
+                {
+                    "name": name,
+                    "requests": stats.count,
+                    "errors": stats.count - stats.codes.get("OK", 0),
+                    "in_flight": stats.in_flight,
+                    "codes": dict(stats.codes),
+                    "bucket_counts": list(stats.bucket_counts),
+                    "latency_sum_s": stats.latency_sum_s,
+                    "latency_p50_s": stats.quantile(0.5),
+                    "latency_p95_s": stats.quantile(0.95),
+                }
+                for name, stats in sorted(self._rpcs.items())
+            ]
+
+        gpu_allocated, gpu_reserved = gpu_memory_bytes()
+        return {
+            "uptime_s": time.time() - self.started_at,
+            "rpcs": rpcs,
+            "queues": [
+                {
+                    "name": queue.name,
+                    "depth": queue.depth,
+                    "max_size": queue.max_size,
+                    "in_flight": queue.in_flight,
+                    "workers": queue.num_workers,
+                    "rejected": queue.rejected,
+                    "avg_service_time_s": queue.avg_service_time_s,
+                    "estimated_wait_s": queue.estimated_wait_s(),
+                }
+                for queue in self.queues
+            ],
+            "admission": self.admission.stats() if self.admission is not None else {},
+            "worker_processes": self.worker_pool.num_workers if self.worker_pool is not None else 0,
+            "models": self.model_manager.snapshot() if self.model_manager is not None else [],
+            "cache": self.result_cache.stats() if self.result_cache is not None else {},
+            "single_flight": self.single_flight.stats() if self.single_flight is not None else {},
+            "quality": self.quality.stats() if self.quality is not None else {},
+            "cpu_slots": self.cpu_slots.stats() if self.cpu_slots is not None else {},
+            "stages": self.stages.stats() if self.stages is not None else [],
+            "pose_batching": self.pose_batcher.stats() if self.pose_batcher is not None else {},
+            "memory": {
+                "rss_bytes": process_rss_bytes(),
+                "gpu_allocated_bytes": gpu_allocated,
+                "gpu_reserved_bytes": gpu_reserved,
+                "models_bytes": self.model_manager.resident_bytes() if self.model_manager is not None else 0,
+            },
+        }
+
+    def render_prometheus(self):
+        """Render the snapshot in the Prometheus text exposition format."""
+        status = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_str = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}")
+
+        metric("aurora_uptime_seconds", "gauge", "Seconds since the server started",
+               [({}, f"{status['uptime_s']:.1f}")])
+
+        metric("aurora_rpc_requests_total", "counter", "Finished RPCs by method and status code", [
+            ({"rpc": rpc["name"], "code": code}, count)
+            for rpc in status["rpcs"] for code, count in sorted(rpc["codes"].items())
+        ])
+        metric("aurora_rpc_in_flight", "gauge", "RPCs currently being handled",
+               [({"rpc": rpc["name"]}, rpc["in_flight"]) for rpc in status["rpcs"]])
+
+        lines.append("# HELP aurora_rpc_latency_seconds RPC latency by method")
+        lines.append("# TYPE aurora_rpc_latency_seconds histogram")
+        for rpc in status["rpcs"]:
+            name = rpc["name"]
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS_S + ("+Inf",), rpc["bucket_counts"]):
+                cumulative += bucket_count
+                lines.append(f'aurora_rpc_latency_seconds_bucket{{rpc="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'aurora_rpc_latency_seconds_sum{{rpc="{name}"}} {rpc["latency_sum_s"]:.6f}')
+            lines.append(f'aurora_rpc_latency_seconds_count{{rpc="{name}"}} {rpc["requests"]}')
+
+        for field, kind, help_text in (
+            ("depth", "gauge", "Jobs waiting in the inference queue"),
+            ("in_flight", "gauge", "Jobs running on the inference queue's workers"),
+            ("max_size", "gauge", "Capacity of the inference queue"),
+            ("rejected", "counter", "Jobs rejected because the inference queue was full"),
+            ("avg_service_time_s", "gauge", "Moving average of the job service time in seconds"),
+            ("estimated_wait_s", "gauge", "Estimated wait in seconds of a normal priority job submitted now"),
+        ):
+            name = "aurora_queue_rejected_total" if field == "rejected" else f"aurora_queue_{field}"
+            metric(name, kind, help_text, [({"queue": queue["name"]}, queue[field]) for queue in status["queues"]])
+
+        admission = status["admission"]
+        if admission:
+            metric("aurora_admission_admitted_total", "counter", "Requests admitted to a queue by priority class",
+                   [({"priority": name}, count) for name, count in admission["admitted"].items()])
+            metric("aurora_admission_shed_total", "counter", "Requests shed because of the estimated queue wait",
+                   [({"priority": name}, count) for name, count in admission["shed"].items()])
+            metric("aurora_admission_tenant_rejected_total", "counter",
+                   "Requests rejected by their tenant's concurrency limit", [({}, admission["tenant_rejected"])])
+            metric("aurora_admission_active_tenants", "gauge", "Tenants with admitted requests in progress",
+                   [({}, admission["active_tenants"])])
+
+        metric("aurora_worker_processes", "gauge", "Inference worker processes (0 = in-process inference)",
+               [({}, status["worker_processes"])])
+        #an old version still draining after a reload is reported next to the new one
+        metric("aurora_model_loaded_bytes", "gauge", "Estimated size of the loaded model components",
+               [({"model": model["name"], "version": str(model["version"])}, model["size_bytes"])
+                for model in status["models"]])
+        metric("aurora_model_in_use", "gauge", "Requests currently using the model component",
+               [({"model": model["name"], "version": str(model["version"])}, model["in_use"])
+                for model in status["models"]])
+
+        cache = status["cache"]
+        if cache:
+            metric("aurora_cache_hits_total", "counter", "Result cache hits by tier", [
+                ({"tier": "memory"}, cache["hits"] - cache["disk_hits"]),
+                ({"tier": "disk"}, cache["disk_hits"]),
+            ])
+            metric("aurora_cache_misses_total", "counter", "Result cache misses", [({}, cache["misses"])])
+            metric("aurora_cache_bytes", "gauge", "Bytes held by the result cache",
+                   [({"tier": "memory"}, cache["memory_bytes"]), ({"tier": "disk"}, cache["disk_bytes"])])
+
+        single_flight = status["single_flight"]
+        if single_flight:
+            metric("aurora_single_flight_coalesced_total", "counter",
+                   "Requests that shared the computation of an identical request already in flight",
+                   [({}, single_flight["coalesced"])])
+            metric("aurora_single_flight_in_flight", "gauge", "Distinct computations in flight",
+                   [({}, single_flight["in_flight"])])
+
+        quality = status["quality"]
+        if quality:
+            metric("aurora_quality_tier_total", "counter", "Requests by the quality tier their deadline allowed",
+                   [({"tier": name}, count) for name, count in quality["chosen"].items()])
+            metric("aurora_quality_stage_cost_seconds", "gauge", "Learned cost of a stage used to pick quality tiers",
+                   [({"stage": name}, cost) for name, cost in quality["stage_costs_s"].items()])
+
+        cpu_slots = status["cpu_slots"]
+        if cpu_slots:
+            metric("aurora_cpu_slots", "gauge", "CPU inference slots", [({}, cpu_slots["slots"])])
+            metric("aurora_cpu_slots_busy", "gauge", "CPU inference slots running a request", [({}, cpu_slots["busy"])])
+            metric("aurora_cpu_slot_requests_total", "counter", "Requests run in the CPU inference slot",
+                   [({"slot": str(index)}, count) for index, count in enumerate(cpu_slots["requests"])])
+            metric("aurora_cpu_slot_wait_seconds_total", "counter", "Time requests spent waiting for a free CPU slot",
+                   [({}, cpu_slots["wait_s"])])
+
+        stages = status["stages"]
+        if stages:
+            metric("aurora_stage_workers", "gauge", "Threads of a relight stage",
+                   [({"stage": stage["stage"]}, stage["workers"]) for stage in stages])
+            metric("aurora_stage_busy", "gauge", "Threads of a relight stage running a request",
+                   [({"stage": stage["stage"]}, stage["busy"]) for stage in stages])
+            metric("aurora_stage_queue_depth", "gauge", "Requests waiting in front of a relight stage",
+                   [({"stage": stage["stage"]}, stage["depth"]) for stage in stages])
+            metric("aurora_stage_requests_total", "counter", "Requests run by a relight stage",
+                   [({"stage": stage["stage"]}, stage["completed"]) for stage in stages])
+            metric("aurora_stage_busy_seconds_total", "counter",
+                   "Time the threads of a relight stage spent running requests, over workers it is the utilization",
+                   [({"stage": stage["stage"]}, stage["busy_s"]) for stage in stages])
+
+        pose_batching = status["pose_batching"]
+        if pose_batching:
+            metric("aurora_pose_batches_total", "counter", "Batched pose inpaint calls by the number of requests merged",
+                   [({"size": str(size)}, count) for size, count in pose_batching["batch_size_histogram"].items()])
+            metric("aurora_pose_batch_requests_total", "counter", "Pose requests served by batched inpaint calls",
+                   [({}, pose_batching["requests"])])
+            metric("aurora_pose_batch_size_avg", "gauge", "Average number of requests merged into a pose inpaint call",
+                   [({}, pose_batching["avg_batch_size"])])
+
+        memory = status["memory"]
+        metric("aurora_process_resident_memory_bytes", "gauge", "Resident set size of the server process",
+               [({}, memory["rss_bytes"])])
+        metric("aurora_gpu_memory_bytes", "gauge", "Memory of the torch CUDA allocator", [
+            ({"kind": "allocated"}, memory["gpu_allocated_bytes"]),
+            ({"kind": "reserved"}, memory["gpu_reserved_bytes"]),
+        ])
+        metric("aurora_models_resident_bytes", "gauge",
+               "Estimated size of all loaded model components, modules shared between them counted once",
+               [({}, memory["models_bytes"])])
+        return "\n".join(lines) + "\n"
+
+
+def _wrap_handler(handler, rpc, stats, is_async):
+    """Return a copy of an RPC method handler whose behavior is tracked by `stats`."""
+    if handler.unary_unary:
+        inner, factory = handler.unary_unary, grpc.unary_unary_rpc_method_handler
+    elif handler.unary_stream:
+        inner, factory = handler.unary_stream, grpc.unary_stream_rpc_method_handler
+    elif handler.stream_unary:
+        inner, factory = handler.stream_unary, grpc.stream_unary_rpc_method_handler
+    else:
+        inner, factory = handler.stream_stream, grpc.stream_stream_rpc_method_handler
+    streams_responses = handler.response_streaming
+
+    if is_async and streams_responses:
+        async def behavior(request, context):
+            with stats.track(rpc, context):
+                async for response in inner(request, context):
+                    yield response
+    elif is_async:
+        async def behavior(request, context):
+            with stats.track(rpc, context):
+                return await inner(request, context)
+    elif streams_responses:
+        def behavior(request, context):
+            with stats.track(rpc, context):
+                yield from inner(request, context)
+    else:
+        def behavior(request, context):
+            with stats.track(rpc, context):
+                return inner(request, context)
+
+    return factory(
+        behavior,
+        request_deserializer=handler.request_deserializer,
+        response_serializer=handler.response_serializer
+    )
+
+
+class MetricsInterceptor(grpc.aio.ServerInterceptor):
+    """grpc.aio interceptor that records every RPC in a ServerStats."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+        rpc = handler_call_details.method.rsplit("/", 1)[-1]
+        return _wrap_handler(handler, rpc, self.stats, is_async=True)
+
+
+class SyncMetricsInterceptor(grpc.ServerInterceptor):
+    """grpc.server interceptor that records every RPC in a ServerStats."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        rpc = handler_call_details.method.rsplit("/", 1)[-1]
+        return _wrap_handler(handler, rpc, self.stats, is_async=False)
+
+
+def start_metrics_server(stats, port):
+    """Serve `stats` in the Prometheus text format on http://0.0.0.0:<port>/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = stats.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics served on port {port}")
+    return server
@@ -1,2 +1,2 @@
-from .relighting import RelightingModel
+from .relighting import RelightingModel, cfg
 from .pose_change import PoseCorrectionPipeline
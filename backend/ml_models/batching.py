@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+
+from ..cpu_slots import merge_thread_limits, restore_thread_limits, thread_limits
+
+
+class MicroBatcher:
+    """
+    Collects requests that arrive within a short window and runs them as one batched call.
+
+    Only requests submitted with the same key share a batch, so callers put every
+    argument that must be identical across the batch (step count, strength...) in the key.
+    Batches run one at a time on the batcher's own thread. A request whose cancel token
+    fires while it waits is dropped from its group, the others still run.
+
+    The submitting threads block while their batch runs, so the batcher thread runs it with
+    their affinity and torch / numba thread counts combined (see cpu_slots.merge_thread_limits).
+    A request holding a CPU slot thus has its share of the batch run on that slot's cores.
+
+    Args:
+        run_batch: Callable (key, items) -> list of results, one per item, in order
+        max_batch_size: Largest number of requests merged into one call
+        max_wait_ms: How long the oldest request of a group may wait for others to join
+    """
+
+    #how often a waiting submit() looks at its cancel token
+    CANCEL_POLL_S = 0.1
+
+    def __init__(self, run_batch, max_batch_size=4, max_wait_ms=50):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000.0
+
+        self._pending = OrderedDict()  #key -> list of (item, future, arrival time, cancel token, thread limits)
+        self._cond = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = {}  #batch size -> number of batches run with that size
+
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, key, item, cancel_token=None):
+        """
+        Queue `item` under `key` and block until its batch has run. Returns this item's result.
+
+        With a `cancel_token` the wait ends with its RequestCancelled as soon as it fires. The item
+        is then left out of its batch, or its result discarded if the batch is already running.
+        """
+        future = Future()
+        with self._cond:
+            self._pending.setdefault(key, []).append((item, future, time.monotonic(), cancel_token, thread_limits()))
+            self._cond.notify()
+        if cancel_token is None:
+            return future.result()
+
+        while True:
+            try:
+                return future.result(timeout=self.CANCEL_POLL_S)
+            except TimeoutError:
+                cancel_token.check()
+
+    def stats(self):
+        """
+        Counters for the batches run so far.
+
+        Returns:
+            dict: batches, requests, avg_batch_size and batch_size_histogram ({size: count})
+        """
+        with self._stats_lock:
+            histogram = dict(sorted(self._batch_sizes.items()))
+        batches = sum(histogram.values())
+        requests = sum(size * count for size, count in histogram.items())
+        return {
+            "batches": batches,
+            "requests": requests,
+            "avg_batch_size": requests / batches if batches else 0.0,
+            "batch_size_histogram": histogram,
+        }
+
+    def _next_batch(self):
+        """Wait until a group is full or its oldest request has waited long enough, then pop it."""
+        with self._cond:
+            while True:
+                self._drop_cancelled()
+                now = time.monotonic()
+                timeout = None
+                for key, group in self._pending.items():
+                    waited = now - group[0][2]
+                    if len(group) >= self.max_batch_size or waited >= self.max_wait_s:
+                        batch = group[:self.max_batch_size]
+                        rest = group[self.max_batch_size:]
+                        if rest:
+                            self._pending[key] = rest
+                        else:
+                            del self._pending[key]
+                        return key, batch
+
+                    remaining = self.max_wait_s - waited
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+
+                self._cond.wait(timeout)
+
+    def _drop_cancelled(self):
+        for key in list(self._pending):
+            group = [entry for entry in self._pending[key] if entry[3] is None or not entry[3].cancelled]
+            if group:
+                self._pending[key] = group
+            else:
+                del self._pending[key]
+
+    def _loop(self):
+        while True:
+            key, batch = self._next_batch()
+            items = [item for item, _, _, _, _ in batch]
+
+            own_limits = thread_limits()
+            restore_thread_limits(merge_thread_limits([limits for _, _, _, _, limits in batch]))
+            try:
+                results = self.run_batch(key, items)
+            except Exception as e:
+                for _, future, _, _, _ in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                restore_thread_limits(own_limits)
+
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+
+            for (_, future, _, _, _), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,364 @@
+import gc
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+
+from .model_zoo import zoo
+
+
+def estimate_model_bytes(obj):
+    """
+    Estimate the resident size of a model component from the torch modules it holds.
+
+    Looks at `obj` itself, diffusers `components` and plain attributes (two levels deep),
+    counting every parameter and buffer once.
+    """
+    return sum(model_tensors(obj).values())
+
+
+def model_tensors(obj, _depth=0, _seen=None, _tensors=None):
+    """
+    Parameters and buffers of a model component, found like estimate_model_bytes does.
+
+    Returns:
+        dict: (device, data pointer) -> bytes of every tensor, a tensor shared by modules counted once
+    """
+    if _seen is None:
+        _seen, _tensors = set(), {}
+    if obj is None or id(obj) in _seen:
+        return _tensors
+    _seen.add(id(obj))
+
+    if isinstance(obj, torch.nn.Module):
+        for tensor in list(obj.parameters()) + list(obj.buffers()):
+            _tensors.setdefault((tensor.device, tensor.data_ptr()), tensor.numel() * tensor.element_size())
+        return _tensors
+
+    if _depth >= 2:
+        return _tensors
+
+    children = []
+    if isinstance(getattr(obj, "components", None), dict):
+        children.extend(obj.components.values())
+    if hasattr(obj, "__dict__"):
+        children.extend(vars(obj).values())
+    for child in children:
+        model_tensors(child, _depth + 1, _seen, _tensors)
+    return _tensors
+
+
+class _Entry:
+    def __init__(self, model, size, version=1, source=None):
+        self.model = model
+        self.size = size
+        self.version = version
+        self.source = source
+        #replicas of `model` not in use, for components registered with a replicate function
+        self.spares = []
+        self.replicas = 0
+        self.users = 0
+        self.last_used = time.monotonic()
+        #replaced by a reload, freed once its last user is done
+        self.retired = False
+
+
+class ModelManager:
+    """
+    Loads model components on first use and keeps them under a memory budget.
+
+    Components are registered with a loader and only built when a request first needs them.
+    When the resident total goes over `memory_budget_bytes`, the least recently used
+    components that are not in use are evicted (they are reloaded on their next use).
+
+    Components whose objects keep per-call state (diffusers schedulers, Real-ESRGAN's current
+    image) are registered with a `replicate` function. Every concurrent user then gets its own
+    replica sharing the component's weights, replicas are reused by later requests.
+
+    Components built from the process-wide ModelZoo may share modules (a VAE, a detector), the
+    budget counts those once and evicting a component only frees what it does not share.
+
+    A loaded component can be replaced by a new version (reload) without stopping the
+    requests that use it: the new version is built and warmed up next to the old one, swapped
+    in atomically and the old one is freed once the requests still holding it are done.
+
+    Args:
+        memory_budget_bytes: Budget for all loaded components, None for unlimited
+    """
+
+    def __init__(self, memory_budget_bytes=None):
+        self.memory_budget_bytes = memory_budget_bytes
+        self._loaders = {}
+        self._entries = OrderedDict()  #name -> _Entry, least recently used first
+        self._warmups = {}
+        self._replicators = {}
+        self._sources = {}  #name -> source the component is built from, None for the loader's default
+        self._versions = {}
+        self._draining = []  #retired entries still in use
+        self._load_locks = {}
+        self._reload_locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader, warmup=None, replicate=None):
+        """
+        Register `loader()` as the way to build component `name`.
+
+        Loaders of components that can be reloaded from another checkpoint take it as their
+        only argument, `loader(source)`. `warmup(model)` runs a small request through a
+        reloaded version before it serves. `replicate(model)` makes the per-user copy of a
+        component that cannot be called concurrently, without it every user gets the model itself.
+        """
+        with self._lock:
+            self._loaders[name] = loader
+            self._warmups[name] = warmup
+            self._replicators[name] = replicate
+            self._sources[name] = None
+            self._versions[name] = 1
+            self._load_locks[name] = threading.Lock()
+            self._reload_locks[name] = threading.Lock()
+
+    @contextmanager
+    def use(self, name):
+        """
+        Context manager yielding component `name`, loading it if needed. It cannot be evicted while in use.
+
+        For a component with a replicate function this is a replica no other user holds.
+        """
+        entry = self._acquire(name)
+        try:
+            model = self._checkout(name, entry)
+        except BaseException:
+            self._release(name, entry)
+            raise
+        try:
+            yield model
+        finally:
+            with self._lock:
+                if model is not entry.model:
+                    entry.spares.append(model)
+            if self._release(name, entry):
+                #the last user of a version replaced by a reload
+                print(f"[INFO] : Freed {name} v{entry.version} ({entry.size / 2**20:.0f} MB) after it drained")
+                del entry, model
+                self._free_memory()
+
+    def _checkout(self, name, entry):
+        replicate = self._replicators[name]
+        if replicate is None:
+            return entry.model
+        with self._lock:
+            if entry.spares:
+                return entry.spares.pop()
+        replica = replicate(entry.model)
+        with self._lock:
+            entry.replicas += 1
+        return replica
+
+    def _release(self, name, entry):
+        """Drop one user of `entry`. Returns True if it was retired and this was its last user."""
+        with self._lock:
+            entry.users -= 1
+            entry.last_used = time.monotonic()
+            drained = entry.retired and not entry.users
+            if drained:
+                self._draining.remove((name, entry))
+            return drained
+
+    def resident_bytes(self):
+        """Size of everything loaded, modules shared between components (see ModelZoo) counted once."""
+        with self._lock:
+            return self._joint_size(list(self._entries.values()) + [entry for _, entry in self._draining])
+
+    @staticmethod
+    def _joint_size(entries):
+        tensors = {}
+        for entry in entries:
+            tensors.update(model_tensors(entry.model))
+        return sum(tensors.values())
+
+    def snapshot(self):
+        """
+        Returns:
+            list of dict: name, size_bytes, in_use, idle_s, version, draining and replicas of every
+            loaded component, old versions that still finish requests after a reload included
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._entries.items()) + self._draining
+            return [
+                {
+                    "name": name,
+                    "size_bytes": entry.size,
+                    "in_use": entry.users,
+                    "idle_s": 0.0 if entry.users else now - entry.last_used,
+                    "version": entry.version,
+                    "draining": entry.retired,
+                    "replicas": entry.replicas,
+                }
+                for name, entry in entries
+            ]
+
+    def evict(self, name):
+        """Drop component `name` if it is loaded and idle. Returns True if it was evicted."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry.users:
+                return False
+            del self._entries[name]
+        print(f"[INFO] : Evicted {name} ({entry.size / 2**20:.0f} MB)")
+        del entry
+        self._free_memory()
+        return True
+
+    def _acquire(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                entry.users += 1
+                self._entries.move_to_end(name)
+                return entry
+            if name not in self._loaders:
+                raise KeyError(f"Unknown model component: {name}")
+            load_lock = self._load_locks[name]
+
+        #load outside the manager lock, other components stay usable meanwhile
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(name)
+                if entry is not None:
+                    entry.users += 1
+                    self._entries.move_to_end(name)
+                    return entry
+
+            print(f"[INFO] : Loading {name}...")
+            start = time.time()
+            entry = self._build(name)
+            entry.users = 1
+            print(f"[INFO] : Loaded {name} ({entry.size / 2**20:.0f} MB) in {time.time() - start:.1f}s")
+
+            with self._lock:
+                self._entries[name] = entry
+            self._enforce_budget()
+            return entry
+
+    def _build(self, name, source=None, version=None):
+        """New _Entry of component `name` built from `source` (default: its current source and version)."""
+        with self._lock:
+            loader = self._loaders[name]
+            if version is None:
+                source, version = self._sources[name], self._versions[name]
+        model = loader(source) if source is not None else loader()
+        return _Entry(model, estimate_model_bytes(model), version, source)
+
+    def reload(self, name, source=None, fresh=True):
+        """
+        Replace component `name` with a new version while the current one keeps serving.
+
+        The new version is built from `source` (a checkpoint directory, weights file or model id,
+        whatever the component's loader takes; None rebuilds from the current source) and warmed
+        up before it atomically takes over. With `fresh` its modules and detectors are read again
+        even if the ModelZoo holds them (see ModelZoo.fresh), instead of the live objects the old
+        version and other components use. Requests that already hold the old version finish on
+        it, it is freed once the last of them is done. Later loads, e.g. after an eviction, use
+        the new source. Reloads of one component run one at a time.
+
+        Returns:
+            dict: name, version, source, load_s, warmup_s and draining (requests still on the old version)
+        """
+        with self._lock:
+            if name not in self._loaders:
+                raise KeyError(f"Unknown model component: {name}")
+            reload_lock = self._reload_locks[name]
+
+        with reload_lock:
+            with self._lock:
+                if source is None:
+                    source = self._sources[name]
+                version = self._versions[name] + 1
+                warmup = self._warmups[name]
+
+            #built next to the loaded version, which serves until the swap
+            print(f"[INFO] : Loading {name} v{version}" + (f" from {source}" if source is not None else "") + "...")
+            start = time.time()
+            if fresh:
+                with zoo.fresh():
+                    entry = self._build(name, source, version)
+            else:
+                entry = self._build(name, source, version)
+            load_s = time.time() - start
+            warmup_start = time.time()
+            if warmup is not None:
+                warmup(entry.model)
+            warmup_s = time.time() - warmup_start
+
+            #a lazy load of the old version holds the load lock until it is in place, then gets retired below
+            with self._load_locks[name], self._lock:
+                old = self._entries.pop(name, None)
+                self._entries[name] = entry
+                self._sources[name] = source
+                self._versions[name] = version
+                draining = old.users if old is not None else 0
+                if draining:
+                    old.retired = True
+                    self._draining.append((name, old))
+            print(f"[INFO] : Swapped in {name} v{version} ({entry.size / 2**20:.0f} MB), "
+                  f"loaded in {load_s:.1f}s and warmed up in {warmup_s:.1f}s")
+
+            if old is not None and not draining:
+                print(f"[INFO] : Freed {name} v{old.version} ({old.size / 2**20:.0f} MB)")
+                del old
+                self._free_memory()
+            elif draining:
+                print(f"[INFO] : {name} v{old.version} is freed once its {draining} running requests are done")
+            self._enforce_budget()
+            return {
+                "name": name,
+                "version": version,
+                "source": source,
+                "load_s": load_s,
+                "warmup_s": warmup_s,
+                "draining": draining,
+            }
+
+    def _enforce_budget(self):
+        if self.memory_budget_bytes is None:
+            return
+
+        evicted = []
+        with self._lock:
+            #evicting a component only frees the tensors no other loaded component shares,
+            #the tensors are walked once per pass and every eviction updates their holder counts
+            tensors = {name: model_tensors(entry.model) for name, entry in self._entries.items()}
+            holders, sizes = {}, {}
+            for entry_tensors in tensors.values():
+                for key, size in entry_tensors.items():
+                    holders[key] = holders.get(key, 0) + 1
+                    sizes[key] = size
+            total = sum(sizes.values())
+            for name, entry in list(self._entries.items()):
+                if total <= self.memory_budget_bytes:
+                    break
+                if entry.users or not entry.size:
+                    continue
+                del self._entries[name]
+                for key in tensors[name]:
+                    holders[key] -= 1
+                    if not holders[key]:
+                        total -= sizes[key]
+                evicted.append((name, entry.size))
+
+        for name, size in evicted:
+            print(f"[INFO] : Evicted {name} ({size / 2**20:.0f} MB) to stay under the memory budget")
+        if evicted:
+            self._free_memory()
+        if total > self.memory_budget_bytes:
+            print(f"[WARNING] : Models in use take {total / 2**20:.0f} MB, over the "
+                  f"{self.memory_budget_bytes / 2**20:.0f} MB budget")
+
+    @staticmethod
+    def _free_memory():
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
@@ -0,0 +1,139 @@
+import hashlib
+import threading
+import weakref
+from contextlib import contextmanager
+
+import torch
+
+
+#values hashed per tensor, spread evenly over it
+FINGERPRINT_SAMPLES = 64
+
+
+def weights_fingerprint(module):
+    """
+    Hash of a torch module's class and state dict: names, shapes and dtypes of all tensors and
+    FINGERPRINT_SAMPLES values of each. Hashing every byte would add a full pass over the
+    weights to every load, different trained weights (fine-tunes included) differ in the samples.
+    """
+    digest = hashlib.blake2b(type(module).__qualname__.encode(), digest_size=16)
+    for name, tensor in module.state_dict().items():
+        tensor = tensor.detach().reshape(-1)
+        digest.update(f"{name}:{tuple(tensor.shape)}:{tensor.dtype}".encode())
+        if tensor.numel():
+            index = torch.linspace(0, tensor.numel() - 1, min(tensor.numel(), FINGERPRINT_SAMPLES),
+                                   device=tensor.device).long()
+            digest.update(tensor[index].cpu().view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+
+class ModelZoo:
+    """
+    Process-wide registry of the pretrained modules and detectors the pipelines are built from.
+
+    Every object is keyed by model id, subfolder, dtype and device. A pipeline asking for a key
+    that is already loaded gets the same instance, and a newly loaded torch module whose weights
+    are identical to a loaded one (e.g. the SD-1.x VAE of two base models) is dropped in favour
+    of it. The zoo only holds weak references: an object lives as long as some loaded component
+    uses it, so the ModelManager's evictions and reloads still free memory, and the last user
+    to let go of a shared detector frees it.
+
+    Loads inside fresh() read the weights again instead, for reloads: the new objects replace
+    the zoo's entries for later users, the components still holding the old ones keep them.
+    """
+
+    def __init__(self):
+        self._objects = weakref.WeakValueDictionary()  #key -> object
+        self._by_fingerprint = weakref.WeakValueDictionary()  #(fingerprint, dtype, device) -> module
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._fresh = threading.local()
+        self.hits = 0
+        self.deduplicated = 0
+
+    @contextmanager
+    def fresh(self):
+        """Within the block, get() and pretrained() on this thread load anew and replace the entries they find."""
+        previous = getattr(self._fresh, "active", False)
+        self._fresh.active = True
+        try:
+            yield
+        finally:
+            self._fresh.active = previous
+
+    def get(self, key, load):
+        """The object stored under `key`, built with `load()` if no loaded component holds one (or in fresh())."""
+        fresh = getattr(self._fresh, "active", False)
+        with self._lock:
+            obj = self._objects.get(key)
+            if obj is not None and not fresh:
+                self.hits += 1
+                return obj
+            lock = self._locks.setdefault(key, threading.Lock())
+
+        #one load per key at a time, different keys load in parallel
+        with lock:
+            with self._lock:
+                obj = self._objects.get(key)
+                if obj is not None and not fresh:
+                    self.hits += 1
+                    return obj
+            obj = load()
+            with self._lock:
+                self._objects[key] = obj
+            return obj
+
+    def pretrained(self, cls, model_id, subfolder=None, dtype=None, device=None, **kwargs):
+        """
+        `cls.from_pretrained(model_id, subfolder=..., torch_dtype=dtype, **kwargs)` moved to `device`,
+        shared with every other user of the same model, or of identical weights.
+        """
+        key = (cls.__name__, model_id, subfolder, str(dtype), str(device))
+
+        def load():
+            options = dict(kwargs)
+            if subfolder is not None:
+                options["subfolder"] = subfolder
+            if dtype is not None:
+                options["torch_dtype"] = dtype
+            module = cls.from_pretrained(model_id, **options)
+            return self._deduplicate(key, module, device)
+
+        return self.get(key, load)
+
+    def _deduplicate(self, key, module, device):
+        #hashed while the weights are still on the CPU, before they take device memory
+        fingerprint = weights_fingerprint(module)
+        parameter = next(module.parameters(), None)
+        identity = (fingerprint, str(parameter.dtype if parameter is not None else None), str(device))
+        if getattr(self._fresh, "active", False):
+            if device is not None:
+                module = module.to(device)
+            with self._lock:
+                self._by_fingerprint[identity] = module
+            return module
+        with self._lock:
+            existing = self._by_fingerprint.get(identity)
+            if existing is not None:
+                self.deduplicated += 1
+                print(f"[INFO] : {key[1]}/{key[2] or ''} has the same weights as an already loaded "
+                      f"{type(existing).__name__}, sharing it")
+                return existing
+        if device is not None:
+            module = module.to(device)
+        with self._lock:
+            #a concurrent load of other weights with the same fingerprint may have won the race
+            module = self._by_fingerprint.setdefault(identity, module)
+        return module
+
+    def stats(self):
+        """
+        Returns:
+            dict: objects alive, lookups served by a loaded object and loads deduplicated by their weights
+        """
+        with self._lock:
+            return {"objects": len(self._objects), "hits": self.hits, "deduplicated": self.deduplicated}
+
+
+#the one zoo of this process, RelightingModel and PoseCorrectionPipeline build their components from it
+zoo = ModelZoo()
@@ -4,15 +4,26 @@ import cv2
 import torch
 import numpy as np
 import math
+import random
 import time
+import threading
 import requests
 from PIL import Image
 from io import BytesIO
 
 from mobile_sam import sam_model_registry, SamPredictor
-from diffusers import StableDiffusionControlNetInpaintPipeline, ControlNetModel, UniPCMultistepScheduler
+from diffusers import StableDiffusionControlNetInpaintPipeline, ControlNetModel, UniPCMultistepScheduler, AutoencoderKL
 import mediapipe as mp
 
+from .batching import MicroBatcher
+from .model_manager import ModelManager
+from .model_zoo import zoo
+from .replicas import replicate_diffusion_pipeline
+
+#Stable Diffusion inpainting checkpoint under the ControlNet, ReloadModel can swap in another
+INPAINT_BASE_MODEL_ID = "Lykon/dreamshaper-8-inpainting"
+NEGATIVE_PROMPT = "clothing, fabric, blue cloth, sleeve, deformed, extra limb, grey blob, cartoon, warped hand, blur, noise"
+
 class GeometryHelper:
     @staticmethod
     def get_angle(p1, p2):
@@ -26,21 +37,25 @@ class GeometryHelper:
         return np.array(end[:2]) + v * factor
 
 class HolisticHelper:
+    colors = [[255, 0, 85], [255, 0, 0], [255, 85, 0], [255, 170, 0], [255, 255, 0],
+              [170, 255, 0], [85, 255, 0], [0, 255, 0], [0, 255, 85], [0, 255, 170],
+              [0, 255, 255], [0, 170, 255], [0, 85, 255], [0, 0, 255], [255, 0, 170],
+              [170, 0, 255], [255, 0, 255], [85, 0, 255]]
+
     def __init__(self):
+        # MediaPipe keeps per-image state, every user of a (zoo shared) helper holds its lock
+        self.lock = threading.Lock()
         self.mp_holistic = mp.solutions.holistic
         self.holistic = self.mp_holistic.Holistic(
             static_image_mode=True, model_complexity=2, enable_segmentation=False
         )
-        self.colors = [[255, 0, 85], [255, 0, 0], [255, 85, 0], [255, 170, 0], [255, 255, 0],
-                       [170, 255, 0], [85, 255, 0], [0, 255, 0], [0, 255, 85], [0, 255, 170],
-                       [0, 255, 255], [0, 170, 255], [0, 85, 255], [0, 0, 255], [255, 0, 170],
-                       [170, 0, 255], [255, 0, 255], [85, 0, 255]]
 
     def process_image(self, image_pil):
         image_np = np.array(image_pil)
         return self.holistic.process(image_np), image_np.shape
 
-    def get_coco_keypoints(self, results, shape):
+    @staticmethod
+    def get_coco_keypoints(results, shape):
         H, W, _ = shape
         kps = np.zeros((17, 3))
         if not results.pose_landmarks: return kps
@@ -54,7 +69,8 @@ class HolisticHelper:
         map_pt(23, 11); map_pt(24, 12); map_pt(25, 13); map_pt(26, 14); map_pt(27, 15); map_pt(28, 16)
         return kps
 
-    def draw_skeleton(self, keypoints, shape):
+    @classmethod
+    def draw_skeleton(cls, keypoints, shape):
         H, W, _ = shape
         canvas = np.zeros((H, W, 3), dtype=np.uint8)
         
@@ -71,69 +87,164 @@ class HolisticHelper:
 
         for i, (s, e) in enumerate(pairs):
             if op_kps[s][2] > 0.3 and op_kps[e][2] > 0.3:
-                cv2.line(canvas, (int(op_kps[s][0]), int(op_kps[s][1])), (int(op_kps[e][0]), int(op_kps[e][1])), self.colors[i%18], 3, cv2.LINE_AA)
+                cv2.line(canvas, (int(op_kps[s][0]), int(op_kps[s][1])), (int(op_kps[e][0]), int(op_kps[e][1])), cls.colors[i%18], 3, cv2.LINE_AA)
         
         for i, kp in enumerate(op_kps):
-            if kp[2] > 0.3: cv2.circle(canvas, (int(kp[0]), int(kp[1])), 4, self.colors[i%18], -1)
+            if kp[2] > 0.3: cv2.circle(canvas, (int(kp[0]), int(kp[1])), 4, cls.colors[i%18], -1)
         return canvas
 
 class PoseCorrectionPipeline:
-    def __init__(self, device='cuda'):
+    def __init__(self, device='cuda', max_batch_size=1, max_batch_wait_ms=50, models=None, cpu_offload=True):
+        """
+        MediaPipe Holistic, MobileSAM and the ControlNet inpaint pipeline are loaded on first use.
+
+        Args:
+            device: Preferred device, falls back to CPU when CUDA is unavailable
+            max_batch_size: Largest number of concurrent requests merged into one
+                            ControlNet inpaint call (1 disables micro-batching)
+            max_batch_wait_ms: How long a request may wait for others to join its batch
+            models: ModelManager the components are registered with (default: a private one)
+            cpu_offload: Model CPU offload of the inpaint pipeline on CUDA, saves VRAM but keeps its
+                         VAE and ControlNet private instead of shared through the model zoo
+        """
         self.device = device if torch.cuda.is_available() else 'cpu'
         print(f"Initializing PoseCorrectionPipeline on {self.device}...")
-        
+
+        self.models = models if models is not None else ModelManager()
+        self.cpu_offload = cpu_offload and self.device == 'cuda'
+        self.models.register("holistic", lambda: zoo.get(("mediapipe-holistic", 2), HolisticHelper))
+        #a SamPredictor keeps the embedding of the image it was last given, replicas share the network
+        self.models.register("mobile_sam", self._load_sam, replicate=lambda predictor: SamPredictor(predictor.model))
+        #a reload (admin ReloadModel) runs the warmup on the new version before it takes over
+        self.models.register("controlnet_inpaint", self._load_inpaint_pipe, self._warmup_inpaint_pipe,
+                             replicate_diffusion_pipeline)
+
+        # Merge concurrent requests with matching settings into one diffusion call,
+        # with max_batch_size=1 this still serializes calls into the shared pipe
+        self.batcher = MicroBatcher(self._run_inpaint_batch, max_batch_size, max_batch_wait_ms)
+
+    def _load_sam(self):
+        return SamPredictor(zoo.get(("mobile_sam", "vit_t", "mobile_sam.pt", self.device), self._build_sam))
+
+    def _build_sam(self):
         # Ensure MobileSAM Weights exist
         self._check_weights()
-        
-        # Load Helpers
-        self.mp_helper = HolisticHelper()
-        
-        # Load MobileSAM
+
         print("Loading MobileSAM...")
-        self.sam = sam_model_registry["vit_t"](checkpoint="mobile_sam.pt")
-        self.sam.to(device=self.device)
-        self.sam.eval()
-        self.sam_predictor = SamPredictor(self.sam)
-        
-        # Load Diffusers/ControlNet
-        print("Loading ControlNet & Stable Diffusion...")
-        self.controlnet = ControlNetModel.from_pretrained(
-            "lllyasviel/control_v11p_sd15_openpose", 
-            torch_dtype=torch.float16 if self.device == 'cuda' else torch.float32
-        )
+        sam = sam_model_registry["vit_t"](checkpoint="mobile_sam.pt")
+        sam.to(device=self.device)
+        sam.eval()
+        return sam
 
-        self.pipe = StableDiffusionControlNetInpaintPipeline.from_pretrained(
-            "Lykon/dreamshaper-8-inpainting", 
-            controlnet=self.controlnet, 
-            torch_dtype=torch.float16 if self.device == 'cuda' else torch.float32, 
-            safety_checker=None
+    def _load_inpaint_pipe(self, base_model_id=INPAINT_BASE_MODEL_ID):
+        print("Loading ControlNet & Stable Diffusion...")
+        dtype = torch.float16 if self.device == 'cuda' else torch.float32
+        shared = {}
+        if self.cpu_offload:
+            # offload hooks move whole modules between devices, they cannot be shared with other pipelines
+            controlnet = ControlNetModel.from_pretrained("lllyasviel/control_v11p_sd15_openpose", torch_dtype=dtype)
+        else:
+            controlnet = zoo.pretrained(ControlNetModel, "lllyasviel/control_v11p_sd15_openpose", None, dtype, self.device)
+            # the SD-1.x VAE, deduplicated against the relighting pipeline's if the weights match
+            shared["vae"] = zoo.pretrained(AutoencoderKL, base_model_id, "vae", dtype, self.device)
+
+        pipe = StableDiffusionControlNetInpaintPipeline.from_pretrained(
+            base_model_id, 
+            controlnet=controlnet, 
+            torch_dtype=dtype, 
+            safety_checker=None,
+            **shared
         ).to(self.device)
-        self.pipe.scheduler = UniPCMultistepScheduler.from_config(self.pipe.scheduler.config)
+        pipe.scheduler = UniPCMultistepScheduler.from_config(pipe.scheduler.config)
         
         # Enable optimizations
-        if self.device == 'cuda':
-            self.pipe.enable_model_cpu_offload()
-            
-        print("Models Loaded Successfully.")
+        if self.cpu_offload:
+            pipe.enable_model_cpu_offload()
+        return pipe
+
+    def _warmup_inpaint_pipe(self, pipe):
+        """Inpaint a synthetic 512x512 square with a new pipeline, two steps, outside the micro-batcher."""
+        image = Image.new("RGB", (512, 512), (128, 128, 128))
+        mask = Image.new("L", (512, 512), 0)
+        mask.paste(255, (192, 192, 320, 320))
+        item = {"prompt": "a person", "image": image, "mask_image": mask, "control_image": Image.new("RGB", (512, 512))}
+        self._call_inpaint_pipe(pipe, [item], 2, 1.0, 1.0)
 
     def _check_weights(self):
         if not os.path.exists("mobile_sam.pt"):
             print("MobileSAM weights not found...")
 
     def _get_person_mask(self, image_np, keypoints):
-        self.sam_predictor.set_image(image_np)
         input_points = np.array([
             keypoints[0][:2], keypoints[5][:2], keypoints[6][:2],
             keypoints[11][:2], keypoints[12][:2]
         ])
         input_labels = np.array([1, 1, 1, 1, 1])
-        masks, _, _ = self.sam_predictor.predict(
-            point_coords=input_points, 
-            point_labels=input_labels, 
-            multimask_output=False
-        )
+        with self.models.use("mobile_sam") as sam_predictor:
+            sam_predictor.set_image(image_np)
+            masks, _, _ = sam_predictor.predict(
+                point_coords=input_points, 
+                point_labels=input_labels, 
+                multimask_output=False
+            )
         return masks[0].astype(np.uint8) * 255
 
+    def _run_inpaint_batch(self, key, items):
+        """Run several inpaint jobs sharing (steps, strength, conditioning) as one pipeline call."""
+        number_of_steps, strength, controlnet_conditioning = key
+        with self.models.use("controlnet_inpaint") as pipe:
+            return self._call_inpaint_pipe(pipe, items, number_of_steps, strength, controlnet_conditioning)
+
+    def _call_inpaint_pipe(self, pipe, items, number_of_steps, strength, controlnet_conditioning):
+        step_callbacks = [item.get("step_callback") for item in items]
+        cancel_tokens = [item.get("cancel_token") for item in items]
+        seeds = [item.get("seed") for item in items]
+
+        #unseeded batches draw from the replica's own RNG
+        generator = getattr(pipe, "generator", None)
+        if any(seed is not None for seed in seeds):
+            #one generator per image, unseeded items that share a batch with seeded ones get a random seed
+            generator = [
+                torch.Generator(device="cpu").manual_seed(seed if seed is not None else random.randrange(2**63))
+                for seed in seeds
+            ]
+
+        def is_cancelled(idx):
+            return cancel_tokens[idx] is not None and cancel_tokens[idx].cancelled
+
+        def on_step_end(pipe, i, t, callback_kwargs):
+            #the batch keeps running for whoever is still waiting, only stop once everybody left
+            if all(is_cancelled(idx) for idx in range(len(items))):
+                cancel_tokens[0].check()
+
+            #latents are [batch, 4, h, w], hand each caller its own slice
+            latents = callback_kwargs["latents"]
+            for idx, step_callback in enumerate(step_callbacks):
+                if step_callback is not None and not is_cancelled(idx):
+                    step_callback(i + 1, pipe.num_timesteps, latents[idx:idx + 1])
+            return callback_kwargs
+
+        return pipe(
+            prompt=[item["prompt"] for item in items],
+            negative_prompt=[NEGATIVE_PROMPT] * len(items),
+            image=[item["image"] for item in items],
+            mask_image=[item["mask_image"] for item in items],
+            control_image=[item["control_image"] for item in items],
+            num_inference_steps=number_of_steps,
+            strength=strength,
+            controlnet_conditioning_scale=controlnet_conditioning,
+            generator=generator,
+            callback_on_step_end=on_step_end if any(step_callbacks) or any(cancel_tokens) else None
+        ).images
+
+    def _inpaint(self, prompt, image, mask_image, control_image, number_of_steps, strength, controlnet_conditioning,
+                 step_callback=None, seed=None, cancel_token=None):
+        """Run one inpaint job through the micro-batcher and return its image."""
+        key = (number_of_steps, strength, controlnet_conditioning)
+        item = {"prompt": prompt, "image": image, "mask_image": mask_image, "control_image": control_image,
+                "step_callback": step_callback, "seed": seed, "cancel_token": cancel_token}
+        return self.batcher.submit(key, item, cancel_token)
+
     def _make_square(self, img, target_size=512):
         width, height = img.size
         max_dim = max(width, height)
@@ -271,12 +382,13 @@ class PoseCorrectionPipeline:
         
         return x_new, y_new
 
-    def process_request(self, image_input, offset_config, number_of_steps = 30, strength = 0.85, controlnet_conditioning = 1.5):
+    def process_request(self, image_input, offset_config, number_of_steps = 30, strength = 0.85, controlnet_conditioning = 1.5,
+                        stage_callback=None, step_callback=None, seed=None, tracer=None, cancel_token=None):
         """
         Main entry point for backend.
         
         Args:
-            image_input: str (path) or PIL.Image
+            image_input: Encoded image bytes or PIL.Image
             offset_config: List containing exactly 7 elements:
                 0. RIGHT_WRIST (x, y)
                 1. RIGHT_ELBOW (x, y)
@@ -288,10 +400,34 @@ class PoseCorrectionPipeline:
                 7. LEFT KNEE
                 8. RIGHT_ANKLE
                 9. LEFT_ANKLE
+            stage_callback: Optional callable(stage_name), called when a new stage starts
+            step_callback: Optional callable(step, total_steps, latents), called after every denoising step
+            seed: Random seed for the inpainting (optional)
+            tracer: Optional Tracer, every stage is recorded as a span
+            cancel_token: Optional CancelToken, checked between stages and denoising steps
         
         Returns:
             PIL.Image of the result
         """
+        try:
+            return self._process_request(image_input, offset_config, number_of_steps, strength, controlnet_conditioning,
+                                         stage_callback, step_callback, seed, tracer, cancel_token)
+        finally:
+            #a cancelled or failed request ends its open stage too, or its span would be lost
+            if tracer is not None:
+                tracer.stage(None)
+
+    def _process_request(self, image_input, offset_config, number_of_steps, strength, controlnet_conditioning,
+                         stage_callback, step_callback, seed, tracer, cancel_token):
+        """process_request() without closing the stage it ends in."""
+        def enter_stage(name):
+            if cancel_token is not None:
+                cancel_token.check()
+            if stage_callback is not None:
+                stage_callback(name)
+            if tracer is not None:
+                tracer.stage(name)
+
         HIP_SCALE = 1.0
         # Unpack Configuration
         try:
@@ -312,9 +448,11 @@ class PoseCorrectionPipeline:
         if isinstance(image_input, (bytes, bytearray)):
             # Received raw PNG/JPG bytes
             raw_image = Image.open(BytesIO(image_input)).convert("RGB")
-
+        elif isinstance(image_input, Image.Image):
+            # Already decoded, e.g. handed over from a worker process
+            raw_image = image_input.convert("RGB")
         else:
-            raise TypeError("image_input must be bytes")
+            raise TypeError("image_input must be bytes or PIL.Image")
         
         orig_w, orig_h = raw_image.size
 
@@ -334,8 +472,10 @@ class PoseCorrectionPipeline:
         src_np = np.array(original_image)
         
         # --- Pose Detection ---
-        mp_results, shape = self.mp_helper.process_image(original_image)
-        kps_old = self.mp_helper.get_coco_keypoints(mp_results, shape)
+        enter_stage("pose_detection")
+        with self.models.use("holistic") as mp_helper, mp_helper.lock:
+            mp_results, shape = mp_helper.process_image(original_image)
+            kps_old = mp_helper.get_coco_keypoints(mp_results, shape)
         
 
         def axis_zero(diff):
@@ -388,6 +528,7 @@ class PoseCorrectionPipeline:
         LEFT_ANKLE_OFFSET = (axis_zero(dx), axis_zero(dy))
 
         # --- Segmentation ---
+        enter_stage("segmentation")
         person_mask = self._get_person_mask(src_np, kps_old)
         
         # --- Modify Skeleton ---
@@ -448,7 +589,8 @@ class PoseCorrectionPipeline:
             kps_new[12] = mid + (R_hip - mid) * HIP_SCALE
 
         # Draw New Skeleton
-        viz_skel_new = self.mp_helper.draw_skeleton(kps_new, shape)
+        #only draws, the checked out Holistic model is not needed for it
+        viz_skel_new = HolisticHelper.draw_skeleton(kps_new, shape)
         
         # Inject Synthetic Hands
         if redraw_right_hand:
@@ -619,6 +761,7 @@ class PoseCorrectionPipeline:
         final_inpaint_mask = cv2.dilate(final_inpaint_mask, np.ones((10,10), np.uint8), iterations=2)
 
         # --- Generation ---
+        enter_stage("diffusion")
         control_map_img = Image.fromarray(viz_skel_new)
         # Fix BGR to RGB for control image
         r, g, b = control_map_img.split()
@@ -628,18 +771,21 @@ class PoseCorrectionPipeline:
         if HIP_SCALE < 1.0:
             prompt_str += ", flat stomach, slim waist"
 
-        generated_raw = self.pipe(
+        generated_raw = self._inpaint(
             prompt=prompt_str,
-            negative_prompt="clothing, fabric, blue cloth, sleeve, deformed, extra limb, grey blob, cartoon, warped hand, blur, noise",
             image=Image.fromarray(input_ai_composition),
             mask_image=Image.fromarray(final_inpaint_mask),
             control_image=control_map_img,
-            num_inference_steps=number_of_steps,
+            number_of_steps=number_of_steps,
             strength=strength,
-            controlnet_conditioning_scale=controlnet_conditioning
-        ).images[0]
+            controlnet_conditioning=controlnet_conditioning,
+            step_callback=step_callback,
+            seed=seed,
+            cancel_token=cancel_token
+        )
 
         # Composite Result
+        enter_stage("compositing")
         gen_np = np.array(generated_raw)
         mask_blur = cv2.GaussianBlur(final_inpaint_mask, (21, 21), 0)
         alpha = mask_blur.astype(float) / 255.0
@@ -0,0 +1,43 @@
+import io
+import numpy as np
+from PIL import Image
+
+#linear approximation of the SD 1.x VAE decoder, maps the 4 latent channels to RGB.
+#good enough for a progress preview and far cheaper than a real VAE decode
+LATENT_RGB_FACTORS = np.array([
+    [ 0.3512,  0.2297,  0.3227],
+    [ 0.3250,  0.4974,  0.2350],
+    [-0.2829,  0.1762,  0.2721],
+    [-0.2120, -0.2616, -0.7177],
+], dtype=np.float32)
+
+
+def latents_to_preview(latents, size=128):
+    """
+    Approximate the image a latent tensor decodes to.
+
+    Args:
+        latents: Tensor or numpy array of shape [1, 4, h, w] (or [4, h, w]) in SD 1.x latent space
+        size: Side length of the (square) preview in pixels
+
+    Returns:
+        PIL.Image: RGB preview
+    """
+    if hasattr(latents, "detach"):
+        lat = latents.detach().float().cpu().numpy()
+    else:
+        lat = np.asarray(latents, dtype=np.float32)
+    if lat.ndim == 4:
+        lat = lat[0]
+
+    rgb = np.einsum("chw,cr->hwr", lat, LATENT_RGB_FACTORS)
+    rgb = np.clip((rgb + 1.0) / 2.0, 0.0, 1.0)
+    preview = Image.fromarray((rgb * 255).astype(np.uint8))
+    return preview.resize((size, size), Image.Resampling.BILINEAR)
+
+
+def encode_preview(image, quality=70):
+    """Encode a preview image as JPEG bytes."""
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
@@ -1,4 +1,6 @@
 import sys
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
 import numpy as np
 from PIL import Image
@@ -8,25 +10,100 @@ from transformers import pipeline as hf_pipeline
 relighting_path = Path(__file__).parent / "relighting"
 sys.path.insert(0, str(relighting_path))
 
-from src.runner.relight_runner import init_models, relight_object
+from config import cfg
+from src.models.neural_gaffer import build_pipeline
+from src.runner.relight_runner import (relight_object, prepare_relight, diffuse_relight, finish_relight,
+                                      new_env_map_path, remove_env_map)
+import upscaler
+
+from .model_manager import ModelManager
+from .model_zoo import zoo
+from .replicas import replicate_diffusion_pipeline, replicate_upsampler
+
+
+def build_upsampler(model_path=None):
+    upsampler = upscaler.build_upsampler(model_path)
+    if upsampler is None:
+        print("[WARNING] : Real-ESRGAN upsampler could not be loaded, will fallback to LANCZOS")
+    return upsampler
+
+
+DEPTH_MODELS = {
+    "large": "depth-anything/Depth-Anything-V2-large-hf",
+    "small": "depth-anything/Depth-Anything-V2-Small-hf",
+}
+
+
+def build_depth_estimator(size="large"):
+    #shared through the zoo with any other pipeline estimating depth with the same model
+    return zoo.get(
+        ("depth-estimation", DEPTH_MODELS[size], "cuda:0"),
+        lambda: hf_pipeline("depth-estimation", model=DEPTH_MODELS[size], device=0)
+    )
+
+
+def _warmup_inputs(size=256):
+    """Synthetic image and centered object mask for warming up reloaded components."""
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8))
+    mask = np.zeros((size, size), dtype=bool)
+    mask[size // 4:3 * size // 4, size // 4:3 * size // 4] = True
+    return image, mask
 
 
 class RelightingModel:
-    def __init__(self):
-        """Initialize the relighting pipeline."""
+    def __init__(self, models=None):
+        """
+        Initialize the relighting pipeline.
+
+        The Neural Gaffer pipeline, Real-ESRGAN and Depth-Anything (large, and small for
+        degraded requests) are loaded on first use.
+
+        Args:
+            models: ModelManager the components are registered with (default: a private one)
+        """
         print("[INFO] : Initializing Relighting Model...")
-        self.pipeline, self.upsampler = init_models()
-        if self.pipeline is None:
-            raise RuntimeError("Failed to initialize relighting pipeline")
-        
-        #depth estimator model
-        self.depth_estimator = hf_pipeline("depth-estimation", model="depth-anything/Depth-Anything-V2-large-hf", device=0)
+        self.models = models if models is not None else ModelManager()
+        #a reload (admin ReloadModel) runs the warmup on the new version before it takes over,
+        #concurrent requests get replicas with their own scheduler / Real-ESRGAN buffers
+        self.models.register("neural_gaffer", partial(build_pipeline, zoo=zoo), self._warmup_pipeline,
+                             replicate_diffusion_pipeline)
+        self.models.register("realesrgan", build_upsampler, self._warmup_upsampler, replicate_upsampler)
+        self.models.register("depth_anything", build_depth_estimator, self._warmup_depth_estimator)
+        self.models.register("depth_anything_small", lambda: build_depth_estimator("small"),
+                             self._warmup_depth_estimator)
+
+    def _warmup_pipeline(self, pipeline):
+        """Relight a small synthetic image with a new Neural Gaffer pipeline, a few steps and no Real-ESRGAN."""
+        image, mask = _warmup_inputs()
+        with self.models.use("depth_anything_small") as depth_estimator:
+            relight_object(
+                pipe=pipeline, depth_estimator=depth_estimator, upsampler=None,
+                image_path=image, mask=mask, hdri_path=None, seed=0,
+                num_inference_steps=2, use_realesrgan=False
+            )
+
+    def _warmup_upsampler(self, upsampler):
+        if upsampler is None:
+            raise RuntimeError("Real-ESRGAN weights could not be loaded")
+        image, _ = _warmup_inputs()
+        upsampler.enhance(np.array(image), outscale=2)
+
+    def _warmup_depth_estimator(self, depth_estimator):
+        image, _ = _warmup_inputs()
+        depth_estimator(image)
 
     def predict(self, image, mask, hdri_path=None, lights_config=None, 
                 rot_angle=0.0, guidance_scale=3.0, seed=None, 
-                num_inference_steps=50, shadow_reach=0.4, debug=False):
+                num_inference_steps=50, shadow_reach=0.4, debug=False,
+                stage_callback=None, step_callback=None, tracer=None, cancel_token=None,
+                use_realesrgan=True, depth_model="large", engine=None, decode=None):
         """
         Perform relighting on an object in an image.
+
+        The request runs in three steps: decoding and the env map (CPU), the diffusion, and
+        upscaling, depth and compositing. Each step only holds the models it uses, with an
+        `engine` they run on its stage pools, overlapping with the steps of other requests.
         
         Args:
             image: PIL Image object or path to image file
@@ -39,29 +116,49 @@ class RelightingModel:
             num_inference_steps: Number of diffusion steps (default: 50)
             shadow_reach: Controls shadow distance 0.0-1.0 (default: 0.4)
             debug: Enable debug output (default: False)
+            stage_callback: Optional callable(stage_name), called when a new stage starts
+            step_callback: Optional callable(step, total_steps, latents), called after every denoising step
+            tracer: Optional Tracer recording the time spent in every stage
+            cancel_token: Optional CancelToken, checked between stages and denoising steps
+            use_realesrgan: Upscale with Real-ESRGAN, LANCZOS otherwise (default: True)
+            depth_model: Depth-Anything size for the shadows, "large" or "small" (default: "large")
+            engine: Optional StagedEngine with a prepare, a diffusion and a finish stage
+            decode: Optional callable returning (image, mask), called in the first step instead of
+                    passing `image`/`mask`, so an upload is decoded on the engine's prepare stage
             
         Returns:
             tuple: (relit_image: PIL Image, mask: numpy array, metadata: dict)
         """
-        #convert mask to numpy array if its a PIL Image
-        if isinstance(mask, Image.Image):
-            mask = np.array(mask.convert("L")) > 127
-        
-        #call the function
-        relit_image, mask, meta = relight_object(
-            pipe=self.pipeline,
-            depth_estimator=self.depth_estimator,
-            upsampler=self.upsampler,
-            image_path=image,
-            mask=mask,
-            hdri_path=hdri_path,
-            rot_angle=rot_angle,
-            guidance_scale=guidance_scale,
-            seed=seed,
-            num_inference_steps=num_inference_steps,
-            shadow_reach=shadow_reach,
-            debug=debug,
-            lights_config=lights_config
-        )
+        #don't load models for a request that is already gone
+        if cancel_token is not None:
+            cancel_token.check()
         
-        return relit_image, mask, meta
+        depth_component = "depth_anything" if depth_model == "large" else "depth_anything_small"
+        stage = {"stage_callback": stage_callback, "tracer": tracer, "cancel_token": cancel_token}
+        env_map_path = new_env_map_path()
+
+        def prepare():
+            source, source_mask = decode() if decode is not None else (image, mask)
+            return prepare_relight(source, source_mask, env_map_path, rot_angle, lights_config, **stage)
+
+        def diffuse(job):
+            with self.models.use("neural_gaffer") as pipeline:
+                return diffuse_relight(pipeline, job, guidance_scale, seed, num_inference_steps, debug,
+                                       step_callback=step_callback, **stage)
+
+        def finish(job):
+            #Real-ESRGAN is not even loaded for requests that do without it
+            with (self.models.use("realesrgan") if use_realesrgan else nullcontext()) as upsampler, \
+                    self.models.use(depth_component) as depth_estimator:
+                relit_image = finish_relight(depth_estimator, upsampler, job, shadow_reach, debug,
+                                             use_realesrgan=use_realesrgan, **stage)
+            return relit_image, job["mask"], job["meta"]
+
+        #the env map is read again while compositing, it goes once the request is done or failed
+        if engine is not None:
+            return engine.run((prepare, diffuse, finish), cancel_token,
+                              on_done=lambda: remove_env_map(env_map_path, debug))
+        try:
+            return finish(diffuse(prepare()))
+        finally:
+            remove_env_map(env_map_path, debug)
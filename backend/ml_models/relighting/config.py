@@ -1,3 +1,4 @@
+import os
 import yaml
 import torch
 from pathlib import Path
@@ -52,8 +53,131 @@ class Config:
         upsampler_cfg = cfg.get("upsampler", {})
         self.UPSAMPLER_USE_TILING = upsampler_cfg.get("use_tiling", False)
 
+        #model manager config
+        models_cfg = cfg.get("models", {})
+        memory_budget_gb = models_cfg.get("memory_budget_gb", 0)
+        self.MEMORY_BUDGET_BYTES = int(memory_budget_gb * 1024**3) if memory_budget_gb else None
+        self.STUB_MODELS = models_cfg.get("stub", False)
+        self.STUB_STEP_MS = models_cfg.get("stub_step_ms", 50)
+        self.POSE_CPU_OFFLOAD = models_cfg.get("pose_cpu_offload", False)
+
+        #gRPC server config
+        server_cfg = cfg.get("server", {})
+        self.SERVER_PORT = server_cfg.get("port", 50051)
+        self.SERVER_MODE = server_cfg.get("mode", "aio")
+        self.SERVER_SYNC_MAX_WORKERS = server_cfg.get("sync_max_workers", 10)
+        unix_socket = server_cfg.get("unix_socket") or None
+        if unix_socket and not Path(unix_socket).is_absolute():
+            unix_socket = str(config_dir / unix_socket)
+        self.SERVER_UNIX_SOCKET = unix_socket
+        self.SERVER_WORKER_PROCESSES = server_cfg.get("worker_processes", 0)
+
+        relight_queue_cfg = server_cfg.get("relight_queue", {})
+        self.RELIGHT_QUEUE_SIZE = relight_queue_cfg.get("max_size", 8)
+        self.RELIGHT_QUEUE_WORKERS = relight_queue_cfg.get("num_workers", 1)
+
+        pose_queue_cfg = server_cfg.get("pose_queue", {})
+        self.POSE_QUEUE_SIZE = pose_queue_cfg.get("max_size", 8)
+        self.POSE_QUEUE_WORKERS = pose_queue_cfg.get("num_workers", 1)
+
+        #CPU inference slots config
+        cpu_slots_cfg = cfg.get("cpu_slots", {})
+        self.CPU_SLOTS = len(cpu_slots_cfg["cores"]) if cpu_slots_cfg.get("cores") else cpu_slots_cfg.get("slots", 0)
+        self.CPU_SLOTS_RESERVED_CORES = cpu_slots_cfg.get("reserved_cores", 1)
+        self.CPU_SLOTS_CORES = cpu_slots_cfg.get("cores") or None
+
+        #staged relighting config
+        staged_relight_cfg = cfg.get("staged_relight", {})
+        self.STAGED_RELIGHT = staged_relight_cfg.get("enabled", False)
+        self.STAGED_PREPARE_WORKERS = staged_relight_cfg.get("prepare_workers", 2)
+        self.STAGED_DIFFUSION_WORKERS = staged_relight_cfg.get("diffusion_workers", 1)
+        self.STAGED_FINISH_WORKERS = staged_relight_cfg.get("finish_workers", 2)
+        self.STAGED_QUEUE_SIZE = staged_relight_cfg.get("queue_size", 2)
+
+        #pose micro-batching config
+        pose_batching_cfg = cfg.get("pose_batching", {})
+        self.POSE_MAX_BATCH_SIZE = pose_batching_cfg.get("max_batch_size", 1)
+        self.POSE_MAX_BATCH_WAIT_MS = pose_batching_cfg.get("max_wait_ms", 50)
+
+        #streaming RPC config
+        streaming_cfg = cfg.get("streaming", {})
+        self.PREVIEW_EVERY_N_STEPS = streaming_cfg.get("preview_every_n_steps", 5)
+        self.PREVIEW_SIZE = streaming_cfg.get("preview_size", 128)
+        self.CHUNK_SIZE = streaming_cfg.get("chunk_size_kb", 64) * 1024
+        self.MAX_UPLOAD_BYTES = streaming_cfg.get("max_upload_mb", 64) * 1024 * 1024
+
+        #upload decoding config
+        decoding_cfg = cfg.get("decoding", {})
+        self.MAX_INPUT_PIXELS = decoding_cfg.get("max_input_pixels", 4194304)
+
+        #response encoding config
+        encoding_cfg = cfg.get("encoding", {})
+        self.PNG_COMPRESS_LEVEL = encoding_cfg.get("png_compress_level", 6)
+        self.JPEG_QUALITY = encoding_cfg.get("jpeg_quality", 90)
+        self.WEBP_QUALITY = encoding_cfg.get("webp_quality", 90)
+        self.ENCODER_WORKERS = encoding_cfg.get("encoder_workers", 2)
+        self.GRPC_COMPRESSION = encoding_cfg.get("grpc_compression", "none")
+
+        #result cache config
+        result_cache_cfg = cfg.get("result_cache", {})
+        self.RESULT_CACHE_BYTES = result_cache_cfg.get("memory_mb", 512) * 1024 * 1024
+        result_cache_dir = result_cache_cfg.get("disk_dir") or None
+        if result_cache_dir and not Path(result_cache_dir).is_absolute():
+            result_cache_dir = str(config_dir / result_cache_dir)
+        self.RESULT_CACHE_DIR = result_cache_dir
+        self.RESULT_CACHE_DISK_BYTES = result_cache_cfg.get("disk_mb", 4096) * 1024 * 1024
+
+        #metrics endpoint config
+        self.METRICS_PORT = cfg.get("metrics", {}).get("port", 9102)
+
+        #admission control config
+        admission_cfg = cfg.get("admission", {})
+        self.ADMISSION_TENANT_HEADER = admission_cfg.get("tenant_header", "x-tenant-id")
+        self.ADMISSION_PRIORITY_HEADER = admission_cfg.get("priority_header", "x-priority")
+        self.ADMISSION_DEFAULT_PRIORITY = admission_cfg.get("default_priority", "normal")
+        self.ADMISSION_TENANT_MAX_CONCURRENCY = admission_cfg.get("tenant_max_concurrency", 0)
+        self.ADMISSION_MAX_WAIT_S = admission_cfg.get("max_wait_s") or {}
+
+        #tracing config
+        tracing_cfg = cfg.get("tracing", {})
+        self.TRACING_ENABLED = tracing_cfg.get("enabled", True)
+        trace_dir = tracing_cfg.get("chrome_trace_dir") or None
+        if trace_dir and not Path(trace_dir).is_absolute():
+            trace_dir = str(config_dir / trace_dir)
+        self.TRACE_DIR = trace_dir
+        self.TRACING_SYNC_CUDA = tracing_cfg.get("sync_cuda", False)
+
+        #startup warmup config
+        warmup_cfg = cfg.get("warmup", {})
+        self.WARMUP_ENABLED = warmup_cfg.get("enabled", False)
+        self.WARMUP_RESOLUTIONS = [tuple(size) for size in warmup_cfg.get("resolutions", [[512, 512]])]
+        self.WARMUP_POSE_STEPS = warmup_cfg.get("pose_steps", 4)
+        jit_cache_dir = warmup_cfg.get("jit_cache_dir") or None
+        if jit_cache_dir and not Path(jit_cache_dir).is_absolute():
+            jit_cache_dir = str(config_dir / jit_cache_dir)
+        self.JIT_CACHE_DIR = jit_cache_dir
+
+        #deadline-aware quality config
+        quality_cfg = cfg.get("quality", {})
+        self.QUALITY_DEADLINE_AWARE = quality_cfg.get("deadline_aware", False)
+        self.QUALITY_HEADROOM = quality_cfg.get("headroom", 0.8)
+
+        #traffic capture config
+        capture_cfg = cfg.get("capture", {})
+        self.CAPTURE_SAMPLE_RATE = capture_cfg.get("sample_rate", 0.0)
+        capture_dir = capture_cfg.get("dir", "./captures")
+        if not Path(capture_dir).is_absolute():
+            capture_dir = str(config_dir / capture_dir)
+        self.CAPTURE_DIR = capture_dir
+        self.CAPTURE_MAX_FILE_BYTES = capture_cfg.get("max_file_mb", 256) * 1024 * 1024
+        self.CAPTURE_MAX_FILES = capture_cfg.get("max_files", 20)
+
     def __repr__(self):
         return f"<Config DEVICE={self.DEVICE}, DTYPE={self.DTYPE}, TARGET_RES={self.TARGET_RES}>"
 
 
 cfg = Config()
+
+#numba reads its cache location when it is first imported, spawned worker processes inherit it
+if cfg.JIT_CACHE_DIR:
+    os.environ.setdefault("NUMBA_CACHE_DIR", cfg.JIT_CACHE_DIR)
@@ -34,24 +34,32 @@ def load_neural_gaffer_unet_weights(unet, checkpoint_folder: str):
     return unet
 
 
-def build_pipeline():
+def build_pipeline(checkpoint_dir=None, zoo=None):
     """
     Constructs a RelightPipeline from base model IDs and
-    load Neural Gaffer UNet weights from `cfg.GAFFER_CKPT_DIR`.
+    load Neural Gaffer UNet weights from `checkpoint_dir` (default: `cfg.GAFFER_CKPT_DIR`).
+    With a `zoo` (ModelZoo) the VAE and CLIP image encoder are shared with the other
+    pipelines and versions using the same weights, the UNet is always a private copy.
 
     Returns a ready-to-use `RelightPipeline` on `cfg.DEVICE`.
     """
     BASE_MODEL_ID = cfg.BASE_MODEL_ID
     DTYPE = cfg.DTYPE
     DEVICE = cfg.DEVICE
-    GAFFER_CKPT_DIR = cfg.GAFFER_CKPT_DIR
+    GAFFER_CKPT_DIR = checkpoint_dir or cfg.GAFFER_CKPT_DIR
+
+    def pretrained(cls, subfolder):
+        if zoo is None:
+            return cls.from_pretrained(BASE_MODEL_ID, subfolder=subfolder, torch_dtype=DTYPE)
+        return zoo.pretrained(cls, BASE_MODEL_ID, subfolder, DTYPE, DEVICE)
 
     print(f"[INFO] : Loading base models for Relight Pipeline from {BASE_MODEL_ID}.")
-    vae = AutoencoderKL.from_pretrained(BASE_MODEL_ID, subfolder="vae", torch_dtype=DTYPE)
+    vae = pretrained(AutoencoderKL, "vae")
+    #conv_in is replaced below, the UNet cannot come from the zoo
     unet = UNet2DConditionModel.from_pretrained(BASE_MODEL_ID, subfolder="unet", torch_dtype=DTYPE)
     sched = DDIMScheduler.from_pretrained(BASE_MODEL_ID, subfolder="scheduler")
     feat = CLIPImageProcessor.from_pretrained(BASE_MODEL_ID, subfolder="feature_extractor")
-    clip = CLIPVisionModelWithProjection.from_pretrained(BASE_MODEL_ID, subfolder="image_encoder", torch_dtype=DTYPE)
+    clip = pretrained(CLIPVisionModelWithProjection, "image_encoder")
 
     #modifying conv_in to accept 16 channels as in neural gaffer architecture
     old_conv = unet.conv_in
@@ -1,4 +1,5 @@
 import numpy as np
+from contextlib import nullcontext
 from diffusers import DiffusionPipeline
 import torch
 import kornia
@@ -57,35 +58,55 @@ class RelightPipeline(DiffusionPipeline):
         second_target_envir_map: torch.Tensor,
         num_inference_steps: int = 50,
         guidance_scale: float = 3.0,
-        generator=None
+        generator=None,
+        step_callback=None,
+        tracer=None,
+        cancel_token=None
     ):
+        """
+        Relight the masked object.
+
+        `step_callback(step, total_steps, latents)` is called after every denoising step,
+        e.g. to stream previews of the current latents. An optional `tracer` records the
+        encode, denoise and decode stages. An optional `cancel_token` is checked before every
+        stage and every denoising step, aborting with its RequestCancelled.
+        """
         device = self.device
         dtype  = self.vae.dtype
 
+        def span(name):
+            if cancel_token is not None:
+                cancel_token.check()
+            return tracer.span(name) if tracer is not None else nullcontext()
+
 #-------PREPROCESSING---------
-        proc_img, meta = preprocess_object(image, mask, target_res=cfg.TARGET_RES, bg_value=cfg.BG_COLOR)
-        img_np = np.array(proc_img).astype(np.float32) / 255.0
-        img_t = torch.from_numpy(img_np).permute(2, 0, 1).unsqueeze(0)  # [1,3,H,W]
-        img_t = (img_t * 2.0 - 1.0).to(device, dtype=dtype)
+        with span("preprocess"):
+            proc_img, meta = preprocess_object(image, mask, target_res=cfg.TARGET_RES, bg_value=cfg.BG_COLOR)
+            img_np = np.array(proc_img).astype(np.float32) / 255.0
+            img_t = torch.from_numpy(img_np).permute(2, 0, 1).unsqueeze(0)  # [1,3,H,W]
+            img_t = (img_t * 2.0 - 1.0).to(device, dtype=dtype)
 
         #encode input image to latents
-        img_latent = self.vae.encode(img_t).latent_dist.mode()
+        with span("vae_encode"):
+            img_latent = self.vae.encode(img_t).latent_dist.mode()
 
 #-------CLIP image EMBEDDING-----------
 
         #convert processed image to tensor format for CLIP preprocessing
-        img_for_clip = img_t
-        x_clip = self.CLIP_preprocess(img_for_clip)
-        image_embeds = self.image_encoder(x_clip).image_embeds   #[1,768]
-        image_embeds = image_embeds.unsqueeze(1)                # [1,1,768]
+        with span("clip_encode"):
+            img_for_clip = img_t
+            x_clip = self.CLIP_preprocess(img_for_clip)
+            image_embeds = self.image_encoder(x_clip).image_embeds   #[1,768]
+            image_embeds = image_embeds.unsqueeze(1)                # [1,1,768]
 
 #-------HDRI processing--------
         #encoding the maps
-        first_target_envir_map = first_target_envir_map.to(device, dtype=dtype)
-        first_envir_latent = self.vae.encode(first_target_envir_map).latent_dist.mode()
+        with span("vae_encode_env_maps"):
+            first_target_envir_map = first_target_envir_map.to(device, dtype=dtype)
+            first_envir_latent = self.vae.encode(first_target_envir_map).latent_dist.mode()
 
-        second_target_envir_map = second_target_envir_map.to(device, dtype=dtype)
-        second_envir_latent = self.vae.encode(second_target_envir_map).latent_dist.mode()
+            second_target_envir_map = second_target_envir_map.to(device, dtype=dtype)
+            second_envir_latent = self.vae.encode(second_target_envir_map).latent_dist.mode()
 
 #-------CFG--------
         do_cfg = guidance_scale > 1.0
@@ -113,8 +134,11 @@ class RelightPipeline(DiffusionPipeline):
 
 #-------Denoising loop with 16-channel concatenation----------
         num_warmup_steps = len(timesteps) - num_inference_steps * self.scheduler.order
-        with self.progress_bar(total=num_inference_steps) as progress_bar:
+        with span("denoise"), self.progress_bar(total=num_inference_steps) as progress_bar:
             for i, t in enumerate(timesteps):
+                if cancel_token is not None:
+                    cancel_token.check()
+
                 #expanding latents
                 latent_model_input = torch.cat([latents] * 2) if do_cfg else latents
 
@@ -145,12 +169,16 @@ class RelightPipeline(DiffusionPipeline):
 
                 latents = self.scheduler.step(noise_pred, t, latents, return_dict=False)[0]
 
+                if step_callback is not None:
+                    step_callback(i + 1, len(timesteps), latents)
+
                 if i == len(timesteps) - 1 or ((i + 1) > num_warmup_steps and (i + 1) % self.scheduler.order == 0):
                     progress_bar.update()
 
 #-------Decoding step------------
-        latents = 1 / self.vae.config.scaling_factor * latents
-        image = self.vae.decode(latents, return_dict=False)[0]
-        image = (image / 2 + 0.5).clamp(0, 1)
-        image = image.cpu().permute(0, 2, 3, 1).float().numpy()
+        with span("vae_decode"):
+            latents = 1 / self.vae.config.scaling_factor * latents
+            image = self.vae.decode(latents, return_dict=False)[0]
+            image = (image / 2 + 0.5).clamp(0, 1)
+            image = image.cpu().permute(0, 2, 3, 1).float().numpy()
         return self.numpy_to_pil(image)[0], meta
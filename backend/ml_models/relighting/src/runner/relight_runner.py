@@ -3,6 +3,7 @@ import torch
 import numpy as np
 import os
 import uuid
+from contextlib import nullcontext
 from PIL import Image
 from typing import Optional, Dict, List
 from config import cfg
@@ -11,95 +12,184 @@ from src.utils.image_ops import read_hdri_map, composite_relit, generate_env_map
 import upscaler
 
 
-def relight_object(pipe, depth_estimator, upsampler, image_path, mask, hdri_path,
-                  rot_angle=0.0, guidance_scale=3.0, seed=None, num_inference_steps=50,
-                  shadow_reach=0.4, debug=False,
-                  lights_config: Optional[List[Dict]] = None,
-                  upscale_factor=2, use_realesrgan=True):
-    """Wrapper to produce a relit image given a mask and a HDRI.
+def _stage_helpers(stage_callback, tracer, cancel_token):
+    """enter_stage(name) and span(name) of one request's stages."""
+    def enter_stage(name):
+        if cancel_token is not None:
+            cancel_token.check()
+        if stage_callback is not None:
+            stage_callback(name)
+
+    def span(name):
+        return tracer.span(name) if tracer is not None else nullcontext()
+
+    return enter_stage, span
+
+
+def new_env_map_path():
+    """Unique path for a request's generated environment map, in the temp directory."""
+    temp_dir = "./generated_env_maps"
+    os.makedirs(temp_dir, exist_ok=True)
+    return os.path.join(temp_dir, f"env_map_{uuid.uuid4()}.exr")
+
+
+def remove_env_map(hdri_path, debug=False):
+    """Delete a generated env map, if it was written."""
+    try:
+        if os.path.exists(hdri_path):
+            os.remove(hdri_path)
+            if debug:
+                print(f"[INFO] : Cleaned up env map: {hdri_path}")
+    except Exception as e:
+        print(f"[WARNING] : Failed to delete env map {hdri_path}: {e}")
+
+
+def prepare_relight(image_path, mask, env_map_path, rot_angle=0.0,
+                    lights_config: Optional[List[Dict]] = None,
+                    stage_callback=None, tracer=None, cancel_token=None):
+    """First stage of relight_object, CPU only: load the image, generate the env map and read it back.
 
-    Saves `relit_output.png` and returns (PIL.Image, mask, meta).
-    
     Args:
-        pipe: The relighting pipeline
-        depth_estimator: Pre-loaded depth estimation model
         image_path : Image, can be path or Image.image instance
-        mask: Binary mask for the object
-        hdri_path: Path to HDRI environment map
-        shadow_reach: Controls how far shadows extend (0.0-1.0)
-        lights_config: Optional list of light configurations for custom env map generation
-        upscale_factor: Upscaling factor (default: 2, for CLI use only)
-        use_realesrgan: Use Real-ESRGAN (default: True, for CLI use only)
+        mask: Binary mask for the object, numpy array or Image.image instance
+        env_map_path: Where the generated env map is written (see new_env_map_path), the caller removes it
+
+    Returns:
+        dict: the request's state for diffuse_relight and finish_relight
     """
+    enter_stage, span = _stage_helpers(stage_callback, tracer, cancel_token)
+
     #loading image
     if isinstance(image_path, str):
         original_pil = Image.open(image_path).convert("RGB")
     else:
         original_pil = image_path.convert("RGB")
+    if isinstance(mask, Image.Image):
+        mask = np.array(mask.convert("L")) > 127
 
     #generating custom environment map with unique filename in temp directory
-    temp_dir = "./generated_env_maps"
-    os.makedirs(temp_dir, exist_ok=True)
-    unique_id = str(uuid.uuid4())
-    env_map_path = os.path.join(temp_dir, f"env_map_{unique_id}.exr")
-    hdri_path = generate_env_map_from_image(
-        pil_img=original_pil,
-        pil_mask=Image.fromarray((mask * 255).astype(np.uint8)),
-        lights_config=lights_config,
-        output_path=env_map_path
-    )
+    enter_stage("env_map")
+    with span("env_map"):
+        hdri_path = generate_env_map_from_image(
+            pil_img=original_pil,
+            pil_mask=Image.fromarray((mask * 255).astype(np.uint8)),
+            lights_config=lights_config,
+            output_path=env_map_path
+        )
 
     #read HDRI map
-    first_target_envir_map, second_target_envir_map = read_hdri_map(
-        hdri_path, target_res=(cfg.TARGET_RES, cfg.TARGET_RES), rot_angle=rot_angle
-    )
+    with span("read_hdri_map"):
+        first_target_envir_map, second_target_envir_map = read_hdri_map(
+            hdri_path, target_res=(cfg.TARGET_RES, cfg.TARGET_RES), rot_angle=rot_angle
+        )
+
+    return {
+        "original_pil": original_pil,
+        "mask": mask,
+        "hdri_path": hdri_path,
+        "rot_angle": rot_angle,
+        "envir_maps": (first_target_envir_map, second_target_envir_map),
+    }
+
+
+def diffuse_relight(pipe, job, guidance_scale=3.0, seed=None, num_inference_steps=50, debug=False,
+                    stage_callback=None, step_callback=None, tracer=None, cancel_token=None):
+    """Second stage of relight_object: the Neural Gaffer diffusion. Adds "result" and "meta" to `job`."""
+    enter_stage, span = _stage_helpers(stage_callback, tracer, cancel_token)
+    first_target_envir_map, second_target_envir_map = job["envir_maps"]
+
+    #a pipeline replica brings its own RNG for unseeded requests
+    generator = getattr(pipe, "generator", None) or torch.Generator(device=cfg.DEVICE)
 
-    generator = torch.Generator(device=cfg.DEVICE)
-    
     if seed is not None:
         generator = torch.Generator(device=cfg.DEVICE).manual_seed(seed)
 
+    enter_stage("diffusion")
     start = time.time()
-    result, meta = pipe(
-        image=original_pil,
-        mask=mask,
-        first_target_envir_map=first_target_envir_map,
-        second_target_envir_map=second_target_envir_map,
-        num_inference_steps=num_inference_steps,
-        guidance_scale=guidance_scale,
-        generator=generator,
-    )
+    with span("diffusion"):
+        job["result"], job["meta"] = pipe(
+            image=job["original_pil"],
+            mask=job["mask"],
+            first_target_envir_map=first_target_envir_map,
+            second_target_envir_map=second_target_envir_map,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            generator=generator,
+            step_callback=step_callback,
+            tracer=tracer,
+            cancel_token=cancel_token,
+        )
     end = time.time()
     if debug:
         print("Diffusion took : ", end - start)
-        
+    return job
+
+
+def finish_relight(depth_estimator, upsampler, job, shadow_reach=0.4, debug=False, upscale_factor=2,
+                   use_realesrgan=True, stage_callback=None, tracer=None, cancel_token=None):
+    """Last stage of relight_object: upscaling, depth, shadows and compositing. Returns the relit PIL.Image."""
+    enter_stage, span = _stage_helpers(stage_callback, tracer, cancel_token)
+
     #call final composition function
-    final_result = composite_relit(
-        depth_estimator=depth_estimator,
-        upsampler=upsampler,
-        original_pil=original_pil,
-        relit_pil=result,
-        mask=mask,
-        meta=meta,
-        hdri_path=hdri_path,
-        rot_angle=rot_angle,
-        shadow_reach=shadow_reach,
-        debug=debug,
-        upscale_factor=upscale_factor,
-        use_realesrgan=use_realesrgan
-    )
+    enter_stage("compositing")
+    with span("compositing"):
+        return composite_relit(
+            depth_estimator=depth_estimator,
+            upsampler=upsampler,
+            original_pil=job["original_pil"],
+            relit_pil=job["result"],
+            mask=job["mask"],
+            meta=job["meta"],
+            hdri_path=job["hdri_path"],
+            rot_angle=job["rot_angle"],
+            shadow_reach=shadow_reach,
+            debug=debug,
+            upscale_factor=upscale_factor,
+            use_realesrgan=use_realesrgan,
+            tracer=tracer,
+            cancel_token=cancel_token
+        )
+
+
+def relight_object(pipe, depth_estimator, upsampler, image_path, mask, hdri_path,
+                  rot_angle=0.0, guidance_scale=3.0, seed=None, num_inference_steps=50,
+                  shadow_reach=0.4, debug=False,
+                  lights_config: Optional[List[Dict]] = None,
+                  upscale_factor=2, use_realesrgan=True,
+                  stage_callback=None, step_callback=None, tracer=None, cancel_token=None):
+    """Wrapper to produce a relit image given a mask and a HDRI.
+
+    Runs prepare_relight, diffuse_relight and finish_relight in a row, a StagedEngine runs
+    them for different requests at the same time instead. Returns (PIL.Image, mask, meta).
     
-    #cleanup: delete the generated env map
+    Args:
+        pipe: The relighting pipeline
+        depth_estimator: Pre-loaded depth estimation model
+        image_path : Image, can be path or Image.image instance
+        mask: Binary mask for the object
+        hdri_path: Path to HDRI environment map
+        shadow_reach: Controls how far shadows extend (0.0-1.0)
+        lights_config: Optional list of light configurations for custom env map generation
+        upscale_factor: Upscaling factor (default: 2, for CLI use only)
+        use_realesrgan: Use Real-ESRGAN (default: True, for CLI use only)
+        stage_callback: Optional callable(stage_name), called when a new stage starts
+        step_callback: Optional callable(step, total_steps, latents), called after every denoising step
+        tracer: Optional Tracer recording the wall/CPU time of every stage
+        cancel_token: Optional CancelToken, checked between stages and denoising steps
+    """
+    stage = {"stage_callback": stage_callback, "tracer": tracer, "cancel_token": cancel_token}
+    env_map_path = new_env_map_path()
     try:
-        if os.path.exists(hdri_path):
-            os.remove(hdri_path)
-            if debug:
-                print(f"[INFO] : Cleaned up env map: {hdri_path}")
-    except Exception as e:
-        print(f"[WARNING] : Failed to delete env map {hdri_path}: {e}")
-    
-    return final_result, mask, meta
+        job = prepare_relight(image_path, mask, env_map_path, rot_angle, lights_config, **stage)
+        job = diffuse_relight(pipe, job, guidance_scale, seed, num_inference_steps, debug,
+                              step_callback=step_callback, **stage)
+        final_result = finish_relight(depth_estimator, upsampler, job, shadow_reach, debug, upscale_factor,
+                                      use_realesrgan, **stage)
+    finally:
+        #cleanup: delete the generated env map, also when a stage failed or the request was cancelled
+        remove_env_map(env_map_path, debug)
 
+    return final_result, job["mask"], job["meta"]
 
 
 def init_models():
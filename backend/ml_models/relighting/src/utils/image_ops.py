@@ -4,6 +4,7 @@ import os
 os.environ["OPENCV_IO_ENABLE_OPENEXR"] = "1"
 import numpy as np
 import cv2
+from contextlib import nullcontext
 from PIL import Image
 import torch
 import imageio
@@ -170,7 +171,7 @@ def estimate_light_source_strength(env_torch):
     return shadow_strength
 
 
-def composite_relit(depth_estimator, upsampler, original_pil, relit_pil, mask, meta, hdri_path, rot_angle, shadow_reach=0.4, debug=False, upscale_factor=2, use_realesrgan=True):
+def composite_relit(depth_estimator, upsampler, original_pil, relit_pil, mask, meta, hdri_path, rot_angle, shadow_reach=0.4, debug=False, upscale_factor=2, use_realesrgan=True, tracer=None, cancel_token=None):
     """
     Composites the relit object back into the original scene with automatic 2x upscaling.
     
@@ -188,10 +189,16 @@ def composite_relit(depth_estimator, upsampler, original_pil, relit_pil, mask, m
         debug (bool, optional): If True, displays visualization of shadow layers. Default: False.
         upscale_factor (int): Upscaling factor (default: 2, automatically applied)
         use_realesrgan (bool): Use Real-ESRGAN for upscaling (default: True)
+        tracer (Tracer, optional): Records the upscale, depth, light and shadow stages.
+        cancel_token (CancelToken, optional): Checked before each of those stages.
     
     Returns:
         Image.Image: Final composited image with relit object and shadows on original background.
     """
+    def span(name):
+        if cancel_token is not None:
+            cancel_token.check()
+        return tracer.span(name) if tracer is not None else nullcontext()
 
     #setup
     h_orig, w_orig = meta["orig_h"], meta["orig_w"]
@@ -200,21 +207,22 @@ def composite_relit(depth_estimator, upsampler, original_pil, relit_pil, mask, m
 
     original_np = np.array(original_pil)
     
-    if upscale_factor > 1:
-        if use_realesrgan and upsampler is not None:
-            try:
-                relit_np = np.array(relit_pil)
-                upscaled_np, _ = upsampler.enhance(relit_np, outscale=upscale_factor)
-                relit_pil = Image.fromarray(upscaled_np)
-            except Exception as e:
-                print(f"[WARNING]: Real-ESRGAN failed: {e}, using LANCZOS")
+    with span("upscale"):
+        if upscale_factor > 1:
+            if use_realesrgan and upsampler is not None:
+                try:
+                    relit_np = np.array(relit_pil)
+                    upscaled_np, _ = upsampler.enhance(relit_np, outscale=upscale_factor)
+                    relit_pil = Image.fromarray(upscaled_np)
+                except Exception as e:
+                    print(f"[WARNING]: Real-ESRGAN failed: {e}, using LANCZOS")
+                    new_size = (relit_pil.width * upscale_factor, relit_pil.height * upscale_factor)
+                    relit_pil = relit_pil.resize(new_size, Image.Resampling.LANCZOS)
+            else:
                 new_size = (relit_pil.width * upscale_factor, relit_pil.height * upscale_factor)
                 relit_pil = relit_pil.resize(new_size, Image.Resampling.LANCZOS)
-        else:
-            new_size = (relit_pil.width * upscale_factor, relit_pil.height * upscale_factor)
-            relit_pil = relit_pil.resize(new_size, Image.Resampling.LANCZOS)
-            if upsampler is None:
-                print(f"[WARNING]: Using LANCZOS for {upscale_factor}x upscaling")
+                if use_realesrgan and upsampler is None:
+                    print(f"[WARNING]: Using LANCZOS for {upscale_factor}x upscaling")
     
     relit_np = np.array(relit_pil).astype(np.float32) / 255.0
     
@@ -241,18 +249,20 @@ def composite_relit(depth_estimator, upsampler, original_pil, relit_pil, mask, m
     mask_bin = (mask_full > 0.5).astype(np.uint8)
 
     #estimating depth and light
-    bg_depth_pil = depth_estimator(original_pil)["depth"]
-    bg_depth = np.array(bg_depth_pil.resize((w_orig, h_orig))).astype(np.float32) / 255.0
-    obj_depth = np.clip(bg_depth - (mask_bin * 0.02), 0.0, 1.0)
-
-    first_target_envir_map, second_target_envir_map = read_hdri_map(
-        hdri_path, target_res=(cfg.TARGET_RES, cfg.TARGET_RES), rot_angle=rot_angle
-    )
-    az, alt = get_light_direction_from_hdr(second_target_envir_map)
-    az = -az
-
-    #shadow strength
-    light_source_strength = estimate_light_source_strength(second_target_envir_map)
+    with span("depth_estimation"):
+        bg_depth_pil = depth_estimator(original_pil)["depth"]
+        bg_depth = np.array(bg_depth_pil.resize((w_orig, h_orig))).astype(np.float32) / 255.0
+        obj_depth = np.clip(bg_depth - (mask_bin * 0.02), 0.0, 1.0)
+
+    with span("light_estimation"):
+        first_target_envir_map, second_target_envir_map = read_hdri_map(
+            hdri_path, target_res=(cfg.TARGET_RES, cfg.TARGET_RES), rot_angle=rot_angle
+        )
+        az, alt = get_light_direction_from_hdr(second_target_envir_map)
+        az = -az
+
+        #shadow strength
+        light_source_strength = estimate_light_source_strength(second_target_envir_map)
     light_source_strength *= max(0.0, 1.0 - (alt / 85.0))
 
     if light_source_strength < 0.05: light_source_strength = 0.05 #to keep the image from being completely dark
@@ -261,7 +271,8 @@ def composite_relit(depth_estimator, upsampler, original_pil, relit_pil, mask, m
     bg_height = 1.0 - bg_depth
     obj_height = 1.0 - obj_depth
 
-    raw_shadow = raymarch_shadows(bg_height, obj_height, mask_bin, az, alt)
+    with span("raymarch_shadows"):
+        raw_shadow = raymarch_shadows(bg_height, obj_height, mask_bin, az, alt)
 
     #fade the shadows with distance
     inv_mask = (1.0 - mask_bin).astype(np.uint8)
@@ -538,7 +549,7 @@ def generate_env_map_from_image(pil_img, pil_mask, lights_config=None, metadata_
     return output_path
 
 
-@njit(fastmath=True)
+@njit(fastmath=True, cache=True)
 def raymarch_shadows(bg_depth, obj_depth, obj_mask, az_deg, alt_deg):
     """
     Raymarcher shadow generation logic.
@@ -10,8 +10,7 @@ _upsampler = None
 
 def init_upsampler():
     """
-    Initialize the Real-ESRGAN upsampler.
-    Tiling can be enabled via config.yaml for low VRAM systems.
+    Initialize the Real-ESRGAN upsampler once and reuse it on later calls.
 
     Returns:
         RealESRGANer: Initialized upsampler instance
@@ -19,8 +18,20 @@ def init_upsampler():
     
     global _upsampler
     
-    if _upsampler is not None:
-        return _upsampler
+    if _upsampler is None:
+        _upsampler = build_upsampler()
+    
+    return _upsampler
+
+
+def build_upsampler(model_path=None):
+    """
+    Build a new Real-ESRGAN upsampler from the weights at `model_path` (default: the bundled RealESRGAN_x2plus.pth).
+    Tiling can be enabled via config.yaml for low VRAM systems.
+
+    Returns:
+        RealESRGANer: Initialized upsampler instance, or None if it could not be loaded
+    """
     
     #load the model (RealESRGAN-x2plus)
     model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2)
@@ -28,7 +39,8 @@ def init_upsampler():
     
     #tiling config
     tile = 256 if config.UPSAMPLER_USE_TILING else 0
-    model_path = os.path.join(os.path.dirname(__file__), 'realesrgan', 'weights', 'RealESRGAN_x2plus.pth')
+    if model_path is None:
+        model_path = os.path.join(os.path.dirname(__file__), 'realesrgan', 'weights', 'RealESRGAN_x2plus.pth')
     
     if not os.path.isfile(model_path):
         print(f"Model weights were not found at {model_path}")
@@ -38,7 +50,7 @@ def init_upsampler():
     
     #initialize upsampler
     try:
-        _upsampler = RealESRGANer(
+        upsampler = RealESRGANer(
             scale=netscale,
             model_path=model_path,
             model=model,
@@ -52,4 +64,4 @@ def init_upsampler():
         print(f"Failed to initialize RealESRGAN: {e}")
         return None
     
-    return _upsampler
+    return upsampler
@@ -0,0 +1,24 @@
+import copy
+import random
+
+import torch
+
+
+def replicate_diffusion_pipeline(pipe):
+    """
+    Lightweight copy of a diffusers pipeline for one request at a time.
+
+    The replica shares the UNet, VAE, CLIP and ControlNet modules (and their weights) with
+    `pipe` but gets a scheduler of its own, `__call__` keeps its timesteps and step index on
+    the scheduler and the pipeline, so concurrent calls on one pipeline corrupt each other.
+    `replica.generator` is the replica's own RNG for requests without a seed.
+    """
+    replica = copy.copy(pipe)
+    replica.scheduler = type(pipe.scheduler).from_config(pipe.scheduler.config)
+    replica.generator = torch.Generator(device="cpu").manual_seed(random.randrange(2**63))
+    return replica
+
+
+def replicate_upsampler(upsampler):
+    """Copy of a RealESRGANer sharing its network, the image being upscaled is kept in `self.img`/`self.output`."""
+    return copy.copy(upsampler) if upsampler is not None else None
@@ -0,0 +1,125 @@
+import io
+import time
+from contextlib import nullcontext
+
+import numpy as np
+import torch
+from PIL import Image, ImageEnhance
+
+#latents the real pipelines hand to step callbacks, [batch, 4, 64, 64] for 512x512 images
+STUB_LATENT_SHAPE = (1, 4, 64, 64)
+
+
+class _StubPipeline:
+    """
+    Shared behaviour of the stub models: stages, denoising steps that only sleep, progress
+    callbacks, tracing and cancellation work like in the real pipelines.
+    """
+
+    def __init__(self, step_ms):
+        self.step_s = step_ms / 1000.0
+
+    def _run(self, stages, num_steps, stage_callback, step_callback, tracer, cancel_token, compositing=()):
+        """`compositing` lists (span name, seconds) of the work done in the compositing stage."""
+        def enter_stage(name):
+            if cancel_token is not None:
+                cancel_token.check()
+            if stage_callback is not None:
+                stage_callback(name)
+
+        def span(name):
+            return tracer.span(name) if tracer is not None else nullcontext()
+
+        for name in stages:
+            enter_stage(name)
+            with span(name):
+                if name == "compositing":
+                    for part, seconds in compositing:
+                        with span(part):
+                            time.sleep(seconds)
+                if name != "diffusion":
+                    continue
+                for step in range(num_steps):
+                    if cancel_token is not None:
+                        cancel_token.check()
+                    time.sleep(self.step_s)
+                    if step_callback is not None:
+                        latents = torch.randn(STUB_LATENT_SHAPE)
+                        step_callback(step + 1, num_steps, latents)
+
+
+class StubRelightingModel(_StubPipeline):
+    """
+    Drop-in for RelightingModel without weights or a GPU, for benchmarking the server.
+
+    Sleeps `step_ms` per denoising step, plus the time of a few steps for Real-ESRGAN and the
+    depth model, and returns the input brightened and upscaled 2x like the real pipeline.
+    """
+
+    #compositing costs in denoising steps
+    REALESRGAN_STEPS = 6
+    DEPTH_STEPS = {"large": 4, "small": 1}
+
+    def __init__(self, models=None, step_ms=50):
+        super().__init__(step_ms)
+        print("[INFO] : Using stub relighting model")
+
+    def predict(self, image, mask, hdri_path=None, lights_config=None,
+                rot_angle=0.0, guidance_scale=3.0, seed=None,
+                num_inference_steps=50, shadow_reach=0.4, debug=False,
+                stage_callback=None, step_callback=None, tracer=None, cancel_token=None,
+                use_realesrgan=True, depth_model="large", engine=None, decode=None):
+        compositing = (
+            ("upscale", self.step_s * (self.REALESRGAN_STEPS if use_realesrgan else 0)),
+            ("depth_estimation", self.step_s * self.DEPTH_STEPS[depth_model]),
+        )
+        callbacks = (stage_callback, step_callback, tracer, cancel_token)
+
+        #the same three steps as RelightingModel.predict, so a StagedEngine overlaps them the same way
+        def prepare():
+            source, source_mask = decode() if decode is not None else (image, mask)
+            if isinstance(source_mask, Image.Image):
+                source_mask = np.array(source_mask.convert("L")) > 127
+            self._run(("env_map",), num_inference_steps, *callbacks)
+            return source.convert("RGB"), source_mask
+
+        def diffuse(job):
+            self._run(("diffusion",), num_inference_steps, *callbacks)
+            return job
+
+        def finish(job):
+            source, source_mask = job
+            self._run(("compositing",), num_inference_steps, *callbacks, compositing)
+            relit = ImageEnhance.Brightness(source).enhance(1.0 + 0.1 * len(lights_config or ()))
+            relit = relit.resize((source.width * 2, source.height * 2), Image.BILINEAR)
+            return relit, source_mask, {}
+
+        if engine is not None:
+            return engine.run((prepare, diffuse, finish), cancel_token)
+        return finish(diffuse(prepare()))
+
+
+class StubPoseCorrectionPipeline(_StubPipeline):
+    """
+    Drop-in for PoseCorrectionPipeline without weights or a GPU, for benchmarking the server.
+
+    Sleeps `step_ms` per inpainting step (steps * strength, like img2img) and returns the input.
+    """
+
+    def __init__(self, device='cuda', max_batch_size=1, max_batch_wait_ms=50, models=None, step_ms=50):
+        super().__init__(step_ms)
+        print("[INFO] : Using stub pose correction pipeline")
+
+    def process_request(self, image_input, offset_config, number_of_steps=30, strength=0.85,
+                        controlnet_conditioning=1.5, stage_callback=None, step_callback=None,
+                        seed=None, tracer=None, cancel_token=None):
+        if len(offset_config) < 10:
+            raise ValueError("Invalid offset_config format. Expected list of length 10.")
+        num_steps = max(int(number_of_steps * min(strength, 1.0)), 1)
+        self._run(
+            ("pose_detection", "segmentation", "diffusion", "compositing"), num_steps,
+            stage_callback, step_callback, tracer, cancel_token
+        )
+        if isinstance(image_input, (bytes, bytearray)):
+            image_input = Image.open(io.BytesIO(image_input))
+        return image_input.convert("RGB")
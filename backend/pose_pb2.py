@@ -24,17 +24,33 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\npose.proto\x12\x04pose\"\x82\x01\n\x0bPoseRequest\x12\x12\n\nimage_data\x18\x01 \x01(\x0c\x12\x19\n\x11new_skeleton_data\x18\x02 \x01(\x0c\x12\x11\n\tnum_steps\x18\x03 \x01(\x05\x12\x1f\n\x17\x63ontrolnet_conditioning\x18\x04 \x01(\x02\x12\x10\n\x08strength\x18\x05 \x01(\x02\",\n\x0cPoseResponse\x12\x1c\n\x14processed_image_data\x18\x01 \x01(\x0c\x32J\n\x13PoseChangingService\x12\x33\n\nChangePose\x12\x11.pose.PoseRequest\x1a\x12.pose.PoseResponseb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\npose.proto\x12\x04pose\"\x92\x02\n\x0bPoseRequest\x12\x12\n\nimage_data\x18\x01 \x01(\x0c\x12\x19\n\x11new_skeleton_data\x18\x02 \x01(\x0c\x12\x11\n\tnum_steps\x18\x03 \x01(\x05\x12\x1f\n\x17\x63ontrolnet_conditioning\x18\x04 \x01(\x02\x12\x10\n\x08strength\x18\x05 \x01(\x02\x12)\n\routput_format\x18\x06 \x01(\x0e\x32\x12.pose.OutputFormat\x12\x0f\n\x07quality\x18\x07 \x01(\x05\x12\x1f\n\x12png_compress_level\x18\x08 \x01(\x05H\x00\x88\x01\x01\x12\x11\n\x04seed\x18\t \x01(\x03H\x01\x88\x01\x01\x42\x15\n\x13_png_compress_levelB\x07\n\x05_seed\"]\n\x0cPoseResponse\x12\x1c\n\x14processed_image_data\x18\x01 \x01(\x0c\x12\r\n\x05width\x18\x02 \x01(\x05\x12\x0e\n\x06height\x18\x03 \x01(\x05\x12\x10\n\x08\x63hannels\x18\x04 \x01(\x05\"\xa5\x01\n\x0cPoseProgress\x12\r\n\x05stage\x18\x01 \x01(\t\x12\x0c\n\x04step\x18\x02 \x01(\x05\x12\x13\n\x0btotal_steps\x18\x03 \x01(\x05\x12\x14\n\x0cpreview_data\x18\x04 \x01(\x0c\x12\x1c\n\x14processed_image_data\x18\x05 \x01(\x0c\x12\r\n\x05width\x18\x06 \x01(\x05\x12\x0e\n\x06height\x18\x07 \x01(\x05\x12\x10\n\x08\x63hannels\x18\x08 \x01(\x05\"W\n\tPoseChunk\x12(\n\x06header\x18\x01 \x01(\x0b\x32\x16.pose.PoseUploadHeaderH\x00\x12\x15\n\x0bimage_chunk\x18\x02 \x01(\x0cH\x00\x42\t\n\x07payload\"J\n\x10PoseUploadHeader\x12\"\n\x07request\x18\x01 \x01(\x0b\x32\x11.pose.PoseRequest\x12\x12\n\nimage_size\x18\x02 \x01(\x03\"m\n\x0ePoseImageChunk\x12\x0c\n\x04\x64\x61ta\x18\x01 \x01(\x0c\x12\x0e\n\x06offset\x18\x02 \x01(\x03\x12\x0c\n\x04last\x18\x03 \x01(\x08\x12\r\n\x05width\x18\x04 \x01(\x05\x12\x0e\n\x06height\x18\x05 \x01(\x05\x12\x10\n\x08\x63hannels\x18\x06 \x01(\x05\"_\n\x0fPoseSharedImage\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\r\n\x05width\x18\x02 \x01(\x05\x12\x0e\n\x06height\x18\x03 \x01(\x05\x12\x10\n\x08\x63hannels\x18\x04 \x01(\x05\x12\r\n\x05\x64type\x18\x05 \x01(\t\"u\n\x11PoseSharedRequest\x12\"\n\x07request\x18\x01 \x01(\x0b\x32\x11.pose.PoseRequest\x12$\n\x05image\x18\x02 \x01(\x0b\x32\x15.pose.PoseSharedImage\x12\x16\n\x0eoutput_segment\x18\x03 \x01(\t\"E\n\x12PoseSharedResponse\x12\r\n\x05width\x18\x01 \x01(\x05\x12\x0e\n\x06height\x18\x02 \x01(\x05\x12\x10\n\x08\x63hannels\x18\x03 \x01(\x05*8\n\x0cOutputFormat\x12\x07\n\x03PNG\x10\x00\x12\x08\n\x04JPEG\x10\x01\x12\x08\n\x04WEBP\x10\x02\x12\x0b\n\x07RAW_RGB\x10\x03\x32\x8e\x02\n\x13PoseChangingService\x12\x33\n\nChangePose\x12\x11.pose.PoseRequest\x1a\x12.pose.PoseResponse\x12;\n\x10\x43hangePoseStream\x12\x11.pose.PoseRequest\x1a\x12.pose.PoseProgress0\x01\x12>\n\x11\x43hangePoseChunked\x12\x0f.pose.PoseChunk\x1a\x14.pose.PoseImageChunk(\x01\x30\x01\x12\x45\n\x10\x43hangePoseShared\x12\x17.pose.PoseSharedRequest\x1a\x18.pose.PoseSharedResponseb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'pose_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
+  _globals['_OUTPUTFORMAT']._serialized_start=1123
+  _globals['_OUTPUTFORMAT']._serialized_end=1179
   _globals['_POSEREQUEST']._serialized_start=21
-  _globals['_POSEREQUEST']._serialized_end=151
-  _globals['_POSERESPONSE']._serialized_start=153
-  _globals['_POSERESPONSE']._serialized_end=197
-  _globals['_POSECHANGINGSERVICE']._serialized_start=199
-  _globals['_POSECHANGINGSERVICE']._serialized_end=273
+  _globals['_POSEREQUEST']._serialized_end=295
+  _globals['_POSERESPONSE']._serialized_start=297
+  _globals['_POSERESPONSE']._serialized_end=390
+  _globals['_POSEPROGRESS']._serialized_start=393
+  _globals['_POSEPROGRESS']._serialized_end=558
+  _globals['_POSECHUNK']._serialized_start=560
+  _globals['_POSECHUNK']._serialized_end=647
+  _globals['_POSEUPLOADHEADER']._serialized_start=649
+  _globals['_POSEUPLOADHEADER']._serialized_end=723
+  _globals['_POSEIMAGECHUNK']._serialized_start=725
+  _globals['_POSEIMAGECHUNK']._serialized_end=834
+  _globals['_POSESHAREDIMAGE']._serialized_start=836
+  _globals['_POSESHAREDIMAGE']._serialized_end=931
+  _globals['_POSESHAREDREQUEST']._serialized_start=933
+  _globals['_POSESHAREDREQUEST']._serialized_end=1050
+  _globals['_POSESHAREDRESPONSE']._serialized_start=1052
+  _globals['_POSESHAREDRESPONSE']._serialized_end=1121
+  _globals['_POSECHANGINGSERVICE']._serialized_start=1182
+  _globals['_POSECHANGINGSERVICE']._serialized_end=1452
 # @@protoc_insertion_point(module_scope)
@@ -39,6 +39,21 @@ class PoseChangingServiceStub(object):
                 request_serializer=pose__pb2.PoseRequest.SerializeToString,
                 response_deserializer=pose__pb2.PoseResponse.FromString,
                 _registered_method=True)
+        self.ChangePoseStream = channel.unary_stream(
+                '/pose.PoseChangingService/ChangePoseStream',
+                request_serializer=pose__pb2.PoseRequest.SerializeToString,
+                response_deserializer=pose__pb2.PoseProgress.FromString,
+                _registered_method=True)
+        self.ChangePoseChunked = channel.stream_stream(
+                '/pose.PoseChangingService/ChangePoseChunked',
+                request_serializer=pose__pb2.PoseChunk.SerializeToString,
+                response_deserializer=pose__pb2.PoseImageChunk.FromString,
+                _registered_method=True)
+        self.ChangePoseShared = channel.unary_unary(
+                '/pose.PoseChangingService/ChangePoseShared',
+                request_serializer=pose__pb2.PoseSharedRequest.SerializeToString,
+                response_deserializer=pose__pb2.PoseSharedResponse.FromString,
+                _registered_method=True)
 
 
 class PoseChangingServiceServicer(object):
@@ -50,6 +65,31 @@ class PoseChangingServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def ChangePoseStream(self, request, context):
+        """Same as ChangePose, but reports stage events and low-resolution previews while it runs.
+        The last message carries the final image.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ChangePoseChunked(self, request_iterator, context):
+        """Same as ChangePose, but the image is uploaded in chunks and the encoded
+        result is streamed back in chunks, so payloads are not bound by the message size limit.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ChangePoseShared(self, request, context):
+        """Same as ChangePose for clients on the server's host (see server.unix_socket): the image is
+        read from a shared memory segment and the result is written as raw pixels into a segment
+        the client provides, nothing is encoded, copied into messages or decoded.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_PoseChangingServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -58,6 +98,21 @@ def add_PoseChangingServiceServicer_to_server(servicer, server):
                     request_deserializer=pose__pb2.PoseRequest.FromString,
                     response_serializer=pose__pb2.PoseResponse.SerializeToString,
             ),
+            'ChangePoseStream': grpc.unary_stream_rpc_method_handler(
+                    servicer.ChangePoseStream,
+                    request_deserializer=pose__pb2.PoseRequest.FromString,
+                    response_serializer=pose__pb2.PoseProgress.SerializeToString,
+            ),
+            'ChangePoseChunked': grpc.stream_stream_rpc_method_handler(
+                    servicer.ChangePoseChunked,
+                    request_deserializer=pose__pb2.PoseChunk.FromString,
+                    response_serializer=pose__pb2.PoseImageChunk.SerializeToString,
+            ),
+            'ChangePoseShared': grpc.unary_unary_rpc_method_handler(
+                    servicer.ChangePoseShared,
+                    request_deserializer=pose__pb2.PoseSharedRequest.FromString,
+                    response_serializer=pose__pb2.PoseSharedResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'pose.PoseChangingService', rpc_method_handlers)
@@ -95,3 +150,84 @@ class PoseChangingService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def ChangePoseStream(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/pose.PoseChangingService/ChangePoseStream',
+            pose__pb2.PoseRequest.SerializeToString,
+            pose__pb2.PoseProgress.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ChangePoseChunked(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/pose.PoseChangingService/ChangePoseChunked',
+            pose__pb2.PoseChunk.SerializeToString,
+            pose__pb2.PoseImageChunk.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ChangePoseShared(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/pose.PoseChangingService/ChangePoseShared',
+            pose__pb2.PoseSharedRequest.SerializeToString,
+            pose__pb2.PoseSharedResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
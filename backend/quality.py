@@ -0,0 +1,134 @@
+import threading
+from collections import namedtuple
+
+#settings of one quality level, tiers are ordered from the best to the cheapest. pose requests
+#keep their own step count scaled by pose_steps_scale, they have no upscaler or depth model
+QualityTier = namedtuple(
+    "QualityTier", ["name", "relight_steps", "realesrgan", "depth_model", "pose_steps_scale"]
+)
+
+TIERS = (
+    QualityTier("full", 50, True, "large", 1.0),
+    QualityTier("high", 35, True, "large", 0.75),
+    QualityTier("medium", 25, False, "large", 0.5),
+    QualityTier("low", 15, False, "small", 0.35),
+    QualityTier("draft", 8, False, "small", 0.2),
+)
+FULL = TIERS[0]
+
+TIER_METADATA_KEY = "x-quality-tier"
+
+
+def pose_steps(tier, num_steps):
+    """Denoising steps a pose request asking for `num_steps` runs in `tier`."""
+    if tier is None:
+        return num_steps
+    return max(1, round(num_steps * tier.pose_steps_scale))
+
+
+def _span_seconds(spans, name):
+    return sum(span.wall_s for span in spans if span.name == name)
+
+
+class QualitySelector:
+    """
+    Picks the best quality tier a request can finish in before its deadline.
+
+    The cost of every tier is predicted from per-stage costs learned from the spans of recent
+    requests: seconds per denoising step, Real-ESRGAN vs LANCZOS upscaling, the large vs the
+    small depth model and everything else. Stages a tier has not run yet keep their defaults.
+
+    Args:
+        headroom: Fraction of the time left that a request may plan to use, the rest absorbs
+                  estimation errors, encoding and the network
+    """
+
+    #initial guesses in seconds, replaced by moving averages as requests complete
+    DEFAULT_COSTS = {
+        "relight_step": 0.15,
+        "upscale_realesrgan": 1.0,
+        "upscale_lanczos": 0.05,
+        "depth_large": 0.6,
+        "depth_small": 0.15,
+        "relight_other": 2.0,
+        "pose_step": 0.2,
+        "pose_other": 1.5,
+    }
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, headroom=0.8):
+        self.headroom = headroom
+        self.costs = dict(self.DEFAULT_COSTS)
+        self.chosen = {tier.name: 0 for tier in TIERS}
+        self._lock = threading.Lock()
+
+    def estimate_s(self, kind, tier, num_steps=None):
+        """
+        Predicted seconds of inference for a request of `kind` ("relight" or "change_pose") in `tier`.
+        `num_steps` is the effective step count a pose request asks for.
+        """
+        with self._lock:
+            costs = dict(self.costs)
+        if kind == "relight":
+            return (
+                costs["relight_other"]
+                + tier.relight_steps * costs["relight_step"]
+                + costs["upscale_realesrgan" if tier.realesrgan else "upscale_lanczos"]
+                + costs[f"depth_{tier.depth_model}"]
+            )
+        return costs["pose_other"] + pose_steps(tier, num_steps) * costs["pose_step"]
+
+    def choose(self, kind, budget_s, num_steps=None):
+        """
+        Best tier whose estimate fits `budget_s` seconds (None for no deadline), the cheapest
+        tier if none does.
+        """
+        tier = TIERS[-1]
+        if budget_s is None:
+            tier = FULL
+        else:
+            for candidate in TIERS:
+                if self.estimate_s(kind, candidate, num_steps) <= budget_s * self.headroom:
+                    tier = candidate
+                    break
+        with self._lock:
+            self.chosen[tier.name] += 1
+        return tier
+
+    def observe(self, kind, tier, spans, elapsed_s, num_steps):
+        """
+        Learn from a finished request that ran `num_steps` denoising steps in `tier` and took
+        `elapsed_s` seconds, `spans` are its Tracer spans. Requests answered without running
+        the model (no diffusion span) are ignored.
+        """
+        diffusion_s = _span_seconds(spans, "diffusion")
+        if not diffusion_s or not num_steps:
+            return
+
+        samples = {}
+        if kind == "relight":
+            #the diffusion span also holds the VAE/CLIP encoders, only the denoising loop scales with steps
+            denoise_s = _span_seconds(spans, "denoise") or diffusion_s
+            upscale_s = _span_seconds(spans, "upscale")
+            depth_s = _span_seconds(spans, "depth_estimation")
+            samples["relight_step"] = denoise_s / num_steps
+            if upscale_s:
+                samples["upscale_realesrgan" if tier.realesrgan else "upscale_lanczos"] = upscale_s
+            if depth_s:
+                samples[f"depth_{tier.depth_model}"] = depth_s
+            samples["relight_other"] = max(elapsed_s - denoise_s - upscale_s - depth_s, 0.0)
+        else:
+            samples["pose_step"] = diffusion_s / num_steps
+            samples["pose_other"] = max(elapsed_s - diffusion_s, 0.0)
+
+        with self._lock:
+            for key, value in samples.items():
+                self.costs[key] += self.EWMA_ALPHA * (value - self.costs[key])
+
+    def stats(self):
+        """
+        Returns:
+            dict: requests per chosen tier and the current stage cost estimates in seconds
+        """
+        with self._lock:
+            return {"chosen": dict(self.chosen), "stage_costs_s": dict(self.costs)}
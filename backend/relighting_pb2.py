@@ -24,17 +24,33 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x10relighting.proto\x12\nrelighting\"J\n\x0eRelightRequest\x12\x12\n\nimage_data\x18\x01 \x01(\x0c\x12\x11\n\tmask_data\x18\x02 \x01(\x0c\x12\x11\n\tjson_data\x18\x03 \x01(\x0c\"/\n\x0fRelightResponse\x12\x1c\n\x14processed_image_data\x18\x01 \x01(\x0c\x32W\n\x11RelightingService\x12\x42\n\x07Relight\x12\x1a.relighting.RelightRequest\x1a\x1b.relighting.RelightResponseb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x10relighting.proto\x12\nrelighting\"\xe0\x01\n\x0eRelightRequest\x12\x12\n\nimage_data\x18\x01 \x01(\x0c\x12\x11\n\tmask_data\x18\x02 \x01(\x0c\x12\x11\n\tjson_data\x18\x03 \x01(\x0c\x12/\n\routput_format\x18\x04 \x01(\x0e\x32\x18.relighting.OutputFormat\x12\x0f\n\x07quality\x18\x05 \x01(\x05\x12\x1f\n\x12png_compress_level\x18\x06 \x01(\x05H\x00\x88\x01\x01\x12\x11\n\x04seed\x18\x07 \x01(\x03H\x01\x88\x01\x01\x42\x15\n\x13_png_compress_levelB\x07\n\x05_seed\"`\n\x0fRelightResponse\x12\x1c\n\x14processed_image_data\x18\x01 \x01(\x0c\x12\r\n\x05width\x18\x02 \x01(\x05\x12\x0e\n\x06height\x18\x03 \x01(\x05\x12\x10\n\x08\x63hannels\x18\x04 \x01(\x05\"\xa8\x01\n\x0fRelightProgress\x12\r\n\x05stage\x18\x01 \x01(\t\x12\x0c\n\x04step\x18\x02 \x01(\x05\x12\x13\n\x0btotal_steps\x18\x03 \x01(\x05\x12\x14\n\x0cpreview_data\x18\x04 \x01(\x0c\x12\x1c\n\x14processed_image_data\x18\x05 \x01(\x0c\x12\r\n\x05width\x18\x06 \x01(\x05\x12\x0e\n\x06height\x18\x07 \x01(\x05\x12\x10\n\x08\x63hannels\x18\x08 \x01(\x05\"y\n\x0cRelightChunk\x12\x31\n\x06header\x18\x01 \x01(\x0b\x32\x1f.relighting.RelightUploadHeaderH\x00\x12\x15\n\x0bimage_chunk\x18\x02 \x01(\x0cH\x00\x12\x14\n\nmask_chunk\x18\x03 \x01(\x0cH\x00\x42\t\n\x07payload\"i\n\x13RelightUploadHeader\x12+\n\x07request\x18\x01 \x01(\x0b\x32\x1a.relighting.RelightRequest\x12\x12\n\nimage_size\x18\x02 \x01(\x03\x12\x11\n\tmask_size\x18\x03 \x01(\x03\"i\n\nImageChunk\x12\x0c\n\x04\x64\x61ta\x18\x01 \x01(\x0c\x12\x0e\n\x06offset\x18\x02 \x01(\x03\x12\x0c\n\x04last\x18\x03 \x01(\x08\x12\r\n\x05width\x18\x04 \x01(\x05\x12\x0e\n\x06height\x18\x05 \x01(\x05\x12\x10\n\x08\x63hannels\x18\x06 \x01(\x05\"[\n\x0bSharedImage\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\r\n\x05width\x18\x02 \x01(\x05\x12\x0e\n\x06height\x18\x03 \x01(\x05\x12\x10\n\x08\x63hannels\x18\x04 \x01(\x05\x12\r\n\x05\x64type\x18\x05 \x01(\t\"\xaa\x01\n\x14RelightSharedRequest\x12+\n\x07request\x18\x01 \x01(\x0b\x32\x1a.relighting.RelightRequest\x12&\n\x05image\x18\x02 \x01(\x0b\x32\x17.relighting.SharedImage\x12%\n\x04mask\x18\x03 \x01(\x0b\x32\x17.relighting.SharedImage\x12\x16\n\x0eoutput_segment\x18\x04 \x01(\t\"H\n\x15RelightSharedResponse\x12\r\n\x05width\x18\x01 \x01(\x05\x12\x0e\n\x06height\x18\x02 \x01(\x05\x12\x10\n\x08\x63hannels\x18\x03 \x01(\x05*8\n\x0cOutputFormat\x12\x07\n\x03PNG\x10\x00\x12\x08\n\x04JPEG\x10\x01\x12\x08\n\x04WEBP\x10\x02\x12\x0b\n\x07RAW_RGB\x10\x03\x32\xc1\x02\n\x11RelightingService\x12\x42\n\x07Relight\x12\x1a.relighting.RelightRequest\x1a\x1b.relighting.RelightResponse\x12J\n\rRelightStream\x12\x1a.relighting.RelightRequest\x1a\x1b.relighting.RelightProgress0\x01\x12\x46\n\x0eRelightChunked\x12\x18.relighting.RelightChunk\x1a\x16.relighting.ImageChunk(\x01\x30\x01\x12T\n\rRelightShared\x12 .relighting.RelightSharedRequest\x1a!.relighting.RelightSharedResponseb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'relighting_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
-  _globals['_RELIGHTREQUEST']._serialized_start=32
-  _globals['_RELIGHTREQUEST']._serialized_end=106
-  _globals['_RELIGHTRESPONSE']._serialized_start=108
-  _globals['_RELIGHTRESPONSE']._serialized_end=155
-  _globals['_RELIGHTINGSERVICE']._serialized_start=157
-  _globals['_RELIGHTINGSERVICE']._serialized_end=244
+  _globals['_OUTPUTFORMAT']._serialized_start=1205
+  _globals['_OUTPUTFORMAT']._serialized_end=1261
+  _globals['_RELIGHTREQUEST']._serialized_start=33
+  _globals['_RELIGHTREQUEST']._serialized_end=257
+  _globals['_RELIGHTRESPONSE']._serialized_start=259
+  _globals['_RELIGHTRESPONSE']._serialized_end=355
+  _globals['_RELIGHTPROGRESS']._serialized_start=358
+  _globals['_RELIGHTPROGRESS']._serialized_end=526
+  _globals['_RELIGHTCHUNK']._serialized_start=528
+  _globals['_RELIGHTCHUNK']._serialized_end=649
+  _globals['_RELIGHTUPLOADHEADER']._serialized_start=651
+  _globals['_RELIGHTUPLOADHEADER']._serialized_end=756
+  _globals['_IMAGECHUNK']._serialized_start=758
+  _globals['_IMAGECHUNK']._serialized_end=863
+  _globals['_SHAREDIMAGE']._serialized_start=865
+  _globals['_SHAREDIMAGE']._serialized_end=956
+  _globals['_RELIGHTSHAREDREQUEST']._serialized_start=959
+  _globals['_RELIGHTSHAREDREQUEST']._serialized_end=1129
+  _globals['_RELIGHTSHAREDRESPONSE']._serialized_start=1131
+  _globals['_RELIGHTSHAREDRESPONSE']._serialized_end=1203
+  _globals['_RELIGHTINGSERVICE']._serialized_start=1264
+  _globals['_RELIGHTINGSERVICE']._serialized_end=1585
 # @@protoc_insertion_point(module_scope)
@@ -39,6 +39,21 @@ class RelightingServiceStub(object):
                 request_serializer=relighting__pb2.RelightRequest.SerializeToString,
                 response_deserializer=relighting__pb2.RelightResponse.FromString,
                 _registered_method=True)
+        self.RelightStream = channel.unary_stream(
+                '/relighting.RelightingService/RelightStream',
+                request_serializer=relighting__pb2.RelightRequest.SerializeToString,
+                response_deserializer=relighting__pb2.RelightProgress.FromString,
+                _registered_method=True)
+        self.RelightChunked = channel.stream_stream(
+                '/relighting.RelightingService/RelightChunked',
+                request_serializer=relighting__pb2.RelightChunk.SerializeToString,
+                response_deserializer=relighting__pb2.ImageChunk.FromString,
+                _registered_method=True)
+        self.RelightShared = channel.unary_unary(
+                '/relighting.RelightingService/RelightShared',
+                request_serializer=relighting__pb2.RelightSharedRequest.SerializeToString,
+                response_deserializer=relighting__pb2.RelightSharedResponse.FromString,
+                _registered_method=True)
 
 
 class RelightingServiceServicer(object):
@@ -50,6 +65,31 @@ class RelightingServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def RelightStream(self, request, context):
+        """Same as Relight, but reports stage events and low-resolution previews while it runs.
+        The last message carries the final image.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def RelightChunked(self, request_iterator, context):
+        """Same as Relight, but the image and mask are uploaded in chunks and the encoded
+        result is streamed back in chunks, so payloads are not bound by the message size limit.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def RelightShared(self, request, context):
+        """Same as Relight for clients on the server's host (see server.unix_socket): the image and
+        mask are read from shared memory segments and the result is written as raw pixels into a
+        segment the client provides, nothing is encoded, copied into messages or decoded.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_RelightingServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -58,6 +98,21 @@ def add_RelightingServiceServicer_to_server(servicer, server):
                     request_deserializer=relighting__pb2.RelightRequest.FromString,
                     response_serializer=relighting__pb2.RelightResponse.SerializeToString,
             ),
+            'RelightStream': grpc.unary_stream_rpc_method_handler(
+                    servicer.RelightStream,
+                    request_deserializer=relighting__pb2.RelightRequest.FromString,
+                    response_serializer=relighting__pb2.RelightProgress.SerializeToString,
+            ),
+            'RelightChunked': grpc.stream_stream_rpc_method_handler(
+                    servicer.RelightChunked,
+                    request_deserializer=relighting__pb2.RelightChunk.FromString,
+                    response_serializer=relighting__pb2.ImageChunk.SerializeToString,
+            ),
+            'RelightShared': grpc.unary_unary_rpc_method_handler(
+                    servicer.RelightShared,
+                    request_deserializer=relighting__pb2.RelightSharedRequest.FromString,
+                    response_serializer=relighting__pb2.RelightSharedResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'relighting.RelightingService', rpc_method_handlers)
@@ -95,3 +150,84 @@ class RelightingService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def RelightStream(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/relighting.RelightingService/RelightStream',
+            relighting__pb2.RelightRequest.SerializeToString,
+            relighting__pb2.RelightProgress.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def RelightChunked(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/relighting.RelightingService/RelightChunked',
+            relighting__pb2.RelightChunk.SerializeToString,
+            relighting__pb2.ImageChunk.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def RelightShared(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/relighting.RelightingService/RelightShared',
+            relighting__pb2.RelightSharedRequest.SerializeToString,
+            relighting__pb2.RelightSharedResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
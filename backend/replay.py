@@ -0,0 +1,204 @@
+"""
+Replays captured production traffic (capture.sample_rate in config.yaml) against an Aurora backend node.
+
+Requests are sent with the RPC, metadata and deadline they arrived with, at their original
+pace or sped up, and the report compares the latencies to the ones the capturing server saw:
+
+    python -m backend.replay backend/ml_models/relighting/captures --target localhost:50051
+    python -m backend.replay captures/capture-20260101-120000-4242-0001.bin --speed 4 --rpc Relight
+
+`--speed 0` sends the requests back to back instead, `--concurrency` bounding those in flight.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import grpc
+
+from . import relighting_pb2
+from . import relighting_pb2_grpc
+from . import pose_pb2
+from . import pose_pb2_grpc
+from .bench import Recorder, summarize_latencies
+from .capture import capture_files, read_capture
+from .chunking import iter_chunks
+
+CHUNK_SIZE = 64 * 1024
+
+
+def load_records(args):
+    """Captured (header, request) pairs in arrival order, after the --rpc filter and --limit."""
+    records = []
+    for path in capture_files(args.captures):
+        for header, request in read_capture(path):
+            if args.rpc and header["rpc"] not in args.rpc:
+                continue
+            records.append((header, request))
+    records.sort(key=lambda record: record[0]["arrival_unix_s"])
+    return records[:args.limit] if args.limit else records
+
+
+def relight_upload(request):
+    """RelightChunked messages of `request`: the header, then the image and mask chunks."""
+    header = relighting_pb2.RelightRequest()
+    header.CopyFrom(request)
+    header.ClearField("image_data")
+    header.ClearField("mask_data")
+    yield relighting_pb2.RelightChunk(header=relighting_pb2.RelightUploadHeader(
+        request=header, image_size=len(request.image_data), mask_size=len(request.mask_data)
+    ))
+    for chunk in iter_chunks(request.image_data, CHUNK_SIZE):
+        yield relighting_pb2.RelightChunk(image_chunk=chunk)
+    for chunk in iter_chunks(request.mask_data, CHUNK_SIZE):
+        yield relighting_pb2.RelightChunk(mask_chunk=chunk)
+
+
+def pose_upload(request):
+    """ChangePoseChunked messages of `request`: the header, then the image chunks."""
+    header = pose_pb2.PoseRequest()
+    header.CopyFrom(request)
+    header.ClearField("image_data")
+    yield pose_pb2.PoseChunk(header=pose_pb2.PoseUploadHeader(request=header, image_size=len(request.image_data)))
+    for chunk in iter_chunks(request.image_data, CHUNK_SIZE):
+        yield pose_pb2.PoseChunk(image_chunk=chunk)
+
+
+async def send(stubs, rpc, request, timeout, metadata):
+    """Send one captured request. Returns (status code name, seconds to the first streamed message or None)."""
+    relight_stub, pose_stub = stubs
+    method = getattr(relight_stub if rpc.startswith("Relight") else pose_stub, rpc)
+    try:
+        if rpc in ("Relight", "ChangePose"):
+            await method(request, timeout=timeout, metadata=metadata)
+            return "OK", None
+
+        if rpc == "RelightChunked":
+            call = method(relight_upload(request), timeout=timeout, metadata=metadata)
+        elif rpc == "ChangePoseChunked":
+            call = method(pose_upload(request), timeout=timeout, metadata=metadata)
+        else:
+            call = method(request, timeout=timeout, metadata=metadata)
+        start = time.monotonic()
+        first_message_s = None
+        async for _ in call:
+            if first_message_s is None:
+                first_message_s = time.monotonic() - start
+        return "OK", first_message_s
+    except grpc.RpcError as e:
+        return e.code().name, None
+
+
+async def run_replay(args, records):
+    recorder = Recorder(0.0)
+    rpcs = sorted({header["rpc"] for header, _ in records})
+    origin = records[0][0]["arrival_unix_s"] if records else 0.0
+    fresh_seed = args.seed * 1_000_000
+    in_flight = set()
+    slots = asyncio.Semaphore(args.concurrency)
+
+    channel_options = [("grpc.max_receive_message_length", -1), ("grpc.max_send_message_length", -1)]
+    async with grpc.aio.insecure_channel(args.target, options=channel_options) as channel:
+        stubs = (relighting_pb2_grpc.RelightingServiceStub(channel), pose_pb2_grpc.PoseChangingServiceStub(channel))
+
+        async def one(header, request, timeout, metadata):
+            try:
+                request_start = time.monotonic()
+                code, first_message_s = await send(stubs, header["rpc"], request, timeout, metadata)
+                recorder.record(header["rpc"], request_start, time.monotonic(), code, first_message_s)
+            finally:
+                slots.release()
+
+        start = time.monotonic()
+        for header, request in records:
+            if args.speed > 0:
+                await asyncio.sleep(max(start + (header["arrival_unix_s"] - origin) / args.speed - time.monotonic(), 0))
+                if slots.locked():
+                    #the client is saturated, count it instead of falling behind the captured pace
+                    recorder.dropped += 1
+                    continue
+            await slots.acquire()
+
+            if args.fresh_seeds:
+                #keeps the server's result cache out of the measurement when a capture is replayed twice
+                fresh_seed += 1
+                request.seed = fresh_seed
+            timeout = args.timeout if args.timeout is not None else header["deadline_s"]
+            metadata = tuple(tuple(item) for item in header["metadata"]) if args.metadata else ()
+            task = asyncio.create_task(one(header, request, timeout, metadata))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    report = recorder.report(rpcs)
+    report["captured"] = {
+        "requests": len(records),
+        "duration_s": (records[-1][0]["arrival_unix_s"] - origin) if records else 0.0,
+        #server-side latencies at capture time, the replay's are measured at the client
+        "latency_s": {
+            rpc: summarize_latencies([
+                header["elapsed_s"] for header, _ in records if header["rpc"] == rpc and header["code"] == "OK"
+            ])
+            for rpc in rpcs
+        },
+    }
+    report["config"] = {
+        "target": args.target,
+        "speed": args.speed,
+        "concurrency": args.concurrency,
+        "rpcs": rpcs,
+        "fresh_seeds": args.fresh_seeds,
+    }
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured traffic against an Aurora backend node")
+    parser.add_argument("captures", nargs="+", help="Capture files or directories holding them")
+    parser.add_argument("--target", default="localhost:50051", help="host:port of the server")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Pace relative to the capture, e.g. 4 replays an hour in 15 minutes, 0 sends back to back")
+    parser.add_argument("--concurrency", type=int, default=64, help="Most requests in flight")
+    parser.add_argument("--rpc", action="append", default=[],
+                        help="Only replay this RPC, e.g. Relight or ChangePoseStream (repeatable)")
+    parser.add_argument("--limit", type=int, default=None, help="Replay only the first N captured requests")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Per-request deadline in seconds instead of the captured one")
+    parser.add_argument("--no-metadata", dest="metadata", action="store_false",
+                        help="Leave out the captured metadata (tenant, priority, ...)")
+    parser.add_argument("--fresh-seeds", action="store_true",
+                        help="Give each request a new seed instead of the captured one")
+    parser.add_argument("--seed", type=int, default=0, help="Base of the --fresh-seeds seeds")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    records = load_records(args)
+    if not records:
+        print("[WARNING] : No captured requests to replay", file=sys.stderr)
+        return
+    print(f"[INFO] : Replaying {len(records)} captured requests against {args.target}", file=sys.stderr)
+
+    report = asyncio.run(run_replay(args, records))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    total = report["total"]
+    latency = total["latency_s"]
+    print(
+        f"[INFO] : {total['ok']}/{total['requests']} ok, {total['throughput_rps']:.2f} req/s, "
+        f"p50 {latency['p50'] or 0:.2f} s, p95 {latency['p95'] or 0:.2f} s, p99 {latency['p99'] or 0:.2f} s",
+        file=sys.stderr
+    )
+
+
+if __name__ == "__main__":
+    main()
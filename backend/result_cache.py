@@ -0,0 +1,182 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+
+def cache_key(kind, *parts):
+    """
+    Content hash of a request: sha256 over `kind` and every part.
+
+    Parts may be bytes or any value with a stable repr (numbers, None). Each part is
+    length-prefixed so neighbouring parts cannot run into each other.
+    """
+    digest = hashlib.sha256(kind.encode())
+    for part in parts:
+        data = bytes(part) if isinstance(part, (bytes, bytearray, memoryview)) else repr(part).encode()
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def image_nbytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+class ResultCache:
+    """
+    Two-tier cache of processed images keyed by cache_key().
+
+    The memory tier is an LRU of decoded images under a byte budget. The optional disk tier
+    keeps a PNG per key in `disk_dir`, survives restarts and is trimmed oldest-first to
+    `disk_max_bytes`. Disk hits are promoted to memory.
+
+    Args:
+        max_bytes: Budget of the memory tier (0 disables it)
+        disk_dir: Directory of the disk tier (None disables it)
+        disk_max_bytes: Budget of the disk tier
+    """
+
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()  #key -> image, least recently used first
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  #key -> file size, oldest first
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 or bool(self.disk_dir)
+
+    def get(self, key):
+        """Returns the cached PIL.Image for `key`, or None."""
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return image
+            on_disk = key in self._disk
+
+        if on_disk:
+            try:
+                with Image.open(self._disk_path(key)) as cached:
+                    image = cached.copy()
+            except OSError as e:
+                print(f"[WARNING] : Dropping unreadable cache entry {key}: {e}")
+                self._drop_disk(key)
+            else:
+                with self._lock:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self._put_memory(key, image)
+                return image
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, image):
+        """Store the processed image for `key` in both tiers."""
+        with self._lock:
+            self._put_memory(key, image)
+        if self.disk_dir:
+            self._put_disk(key, image)
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits, disk_hits, misses, hit_rate and entry/byte counts of both tiers
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _put_memory(self, key, image):
+        size = image_nbytes(image)
+        if size > self.max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= image_nbytes(self._memory.pop(key))
+        self._memory[key] = image
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= image_nbytes(evicted)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.png")
+
+    def _load_disk_index(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".png"):
+                continue
+            stat = os.stat(os.path.join(self.disk_dir, name))
+            entries.append((stat.st_mtime, name[:-len(".png")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        print(f"[INFO] : Result cache found {len(self._disk)} entries ({self._disk_bytes / 2**20:.0f} MB) on disk")
+
+    def _put_disk(self, key, image):
+        #write to a temp file and rename, so readers never see a partial PNG
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                image.save(f, format="PNG", compress_level=1)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError as e:
+            print(f"[WARNING] : Could not write cache entry {key}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            self._disk_bytes += size - self._disk.pop(key, 0)
+            self._disk[key] = size
+            evicted = []
+            while self._disk_bytes > self.disk_max_bytes and len(self._disk) > 1:
+                old_key, old_size = self._disk.popitem(last=False)
+                self._disk_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._disk_path(old_key))
+            except OSError:
+                pass
+
+    def _drop_disk(self, key):
+        with self._lock:
+            self._disk_bytes -= self._disk.pop(key, 0)
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
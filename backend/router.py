@@ -0,0 +1,429 @@
+"""
+Cache-affine request router in front of several Aurora backend nodes.
+
+Serves RelightingService and PoseChangingService itself and forwards every call to one of
+the nodes, so clients only change the address they connect to:
+
+    python -m backend.router --port 50050 --node 10.0.0.1:50051 --node 10.0.0.2:50051 --node 10.0.0.3:50051
+
+Calls go to the node owning their key on a consistent hash ring, so the repeated edits of a
+photo land where its encodings, latents and results are already cached. The key is the
+session header when the client sends one, otherwise the size and first bytes of the image.
+Nodes are polled with AdminService.GetStatus. A node that stops answering or fails a call
+with UNAVAILABLE is skipped until it answers again. A node whose queue for the model is
+busier than `balance_factor` above the average hands its calls to the next node on the
+ring (consistent hashing with bounded loads).
+"""
+import argparse
+import asyncio
+import bisect
+import hashlib
+import math
+
+import grpc
+
+from . import relighting_pb2_grpc
+from . import pose_pb2_grpc
+from . import admin_pb2
+from . import admin_pb2_grpc
+
+#image bytes hashed into the route key, the first chunk of a *Chunked upload (streaming.chunk_size_kb)
+ROUTE_KEY_BYTES = 64 * 1024
+
+#calls failing with these codes before any response was forwarded are tried on the next node
+FAILOVER_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.RESOURCE_EXHAUSTED)
+
+#metadata set by the gRPC stack rather than the client, the forwarded call gets its own
+_TRANSPORT_METADATA = ("user-agent", ":authority", "content-type", "te")
+
+NODE_METADATA_KEY = "x-backend-node"
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def route_key(session, image_size, image_prefix):
+    """
+    Position of a call on the hash ring: its session key if there is one, otherwise the image
+    size and first ROUTE_KEY_BYTES bytes, which a unary call and a chunked upload of the same
+    image have in common.
+    """
+    if session:
+        return _hash64(b"session:" + str(session).encode())
+    return _hash64(image_size.to_bytes(8, "little") + bytes(image_prefix[:ROUTE_KEY_BYTES]))
+
+
+class HashRing:
+    """
+    Consistent hash ring of node addresses, each placed at `virtual_nodes` points so keys
+    spread evenly and only the keys of a removed node move.
+    """
+
+    def __init__(self, nodes, virtual_nodes=64):
+        self.nodes = list(nodes)
+        points = sorted(
+            (_hash64(f"{node}#{i}".encode()), index)
+            for index, node in enumerate(self.nodes) for i in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [index for _, index in points]
+
+    def candidates(self, key):
+        """All nodes, in ring order starting at the owner of `key`."""
+        order = []
+        start = bisect.bisect(self._hashes, key)
+        for i in range(len(self._owners)):
+            node = self.nodes[self._owners[(start + i) % len(self._owners)]]
+            if node not in order:
+                order.append(node)
+                if len(order) == len(self.nodes):
+                    break
+        return order
+
+
+class Node:
+    """A backend node with its channel, health and the load of its relight and pose queues."""
+
+    def __init__(self, address):
+        self.address = address
+        channel_options = [("grpc.max_receive_message_length", -1), ("grpc.max_send_message_length", -1)]
+        self.channel = grpc.aio.insecure_channel(address, options=channel_options)
+        self.stubs = {
+            "relight": relighting_pb2_grpc.RelightingServiceStub(self.channel),
+            "pose": pose_pb2_grpc.PoseChangingServiceStub(self.channel),
+        }
+        self.admin = admin_pb2_grpc.AdminServiceStub(self.channel)
+        self.healthy = True
+        self.reported_load = {"relight": 0, "pose": 0}  #queued + running jobs from the last GetStatus
+        self.in_flight = {"relight": 0, "pose": 0}      #calls this router has open on the node
+        self.routed = 0
+
+    def load(self, model):
+        #the reported load lags by up to a poll interval, the router's own calls are current
+        return max(self.reported_load[model], self.in_flight[model])
+
+    def update(self, status):
+        queues = {queue.name: queue.depth + queue.in_flight for queue in status.queues}
+        if queues:
+            self.reported_load = {model: queues.get(model, 0) for model in self.reported_load}
+        else:
+            #the sync server has no queues, count its calls instead
+            for model, prefix in (("relight", "Relight"), ("pose", "ChangePose")):
+                self.reported_load[model] = sum(rpc.in_flight for rpc in status.rpcs if prefix in rpc.name)
+
+
+class _BufferedUpload:
+    """
+    Client upload of a *Chunked call, read ahead far enough to route it and kept so a failed
+    attempt can be sent again to the next node.
+    """
+
+    def __init__(self, request_iterator):
+        self._source = request_iterator.__aiter__()
+        self._messages = []
+        self._exhausted = False
+        self._lock = asyncio.Lock()
+
+    async def _pull(self):
+        async with self._lock:
+            if self._exhausted:
+                return False
+            try:
+                self._messages.append(await self._source.__anext__())
+            except StopAsyncIteration:
+                self._exhausted = True
+                return False
+            return True
+
+    async def route_info(self):
+        """Returns (image size, first image bytes) of the upload for route_key()."""
+        while True:
+            header = next((m.header for m in self._messages if m.WhichOneof("payload") == "header"), None)
+            prefix = b"".join(m.image_chunk for m in self._messages if m.WhichOneof("payload") == "image_chunk")
+            if header is not None and len(prefix) >= min(ROUTE_KEY_BYTES, header.image_size):
+                return header.image_size, prefix
+            if not await self._pull():
+                #a broken upload, the node reports what is wrong with it
+                return (header.image_size if header is not None else 0), prefix
+
+    async def replay(self):
+        """The upload from its first message, reading the rest from the client as needed."""
+        index = 0
+        while True:
+            if index < len(self._messages):
+                yield self._messages[index]
+                index += 1
+            elif not await self._pull():
+                return
+
+
+class Router:
+    """
+    Picks the node of every call and forwards it there, see the module docstring.
+
+    Args:
+        addresses: host:port of the backend nodes
+        virtual_nodes: Ring points per node
+        balance_factor: How far above the average load a node may be before its calls spill
+                        over to the next node on the ring
+        min_spill_load: Queued + running jobs below which a node keeps its calls whatever the
+                        others carry, a job in flight is normal and not worth a cache miss
+        health_interval_s: Seconds between GetStatus polls of every node
+        session_header: Metadata key clients may send a session key in
+    """
+
+    def __init__(self, addresses, virtual_nodes=64, balance_factor=0.25, min_spill_load=2, health_interval_s=2.0,
+                 session_header="x-session-id"):
+        self.nodes = {address: Node(address) for address in addresses}
+        self.ring = HashRing(addresses, virtual_nodes)
+        self.balance_factor = balance_factor
+        self.min_spill_load = min_spill_load
+        self.health_interval_s = health_interval_s
+        self.session_header = session_header
+        self._health_task = None
+
+    async def start(self):
+        await asyncio.gather(*(self._poll(node) for node in self.nodes.values()))
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+        for node in self.nodes.values():
+            await node.channel.close()
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval_s)
+            await asyncio.gather(*(self._poll(node) for node in self.nodes.values()))
+
+    async def _poll(self, node):
+        try:
+            status = await node.admin.GetStatus(admin_pb2.StatusRequest(), timeout=self.health_interval_s)
+        except grpc.RpcError as e:
+            self._set_healthy(node, False, e.code().name)
+            return
+        node.update(status)
+        self._set_healthy(node, True)
+
+    def _set_healthy(self, node, healthy, reason=""):
+        if healthy == node.healthy:
+            return
+        node.healthy = healthy
+        if healthy:
+            print(f"[INFO] : Node {node.address} is healthy again")
+        else:
+            print(f"[WARNING] : Node {node.address} is unhealthy ({reason}), routing around it")
+
+    def pick(self, key, model):
+        """
+        Nodes to try for a call with `key`, best first: the first healthy node on the ring
+        below the load bound, the other healthy nodes in ring order, then the unhealthy ones
+        in case their health is stale.
+        """
+        ring_order = [self.nodes[address] for address in self.ring.candidates(key)]
+        healthy = [node for node in ring_order if node.healthy]
+        unhealthy = [node for node in ring_order if not node.healthy]
+        if not healthy:
+            return unhealthy
+
+        total = sum(node.load(model) for node in healthy)
+        capacity = max(math.ceil((1 + self.balance_factor) * (total + 1) / len(healthy)), self.min_spill_load)
+        for i, node in enumerate(healthy):
+            if node.load(model) < capacity:
+                return [node] + healthy[:i] + healthy[i + 1:] + unhealthy
+        return healthy + unhealthy
+
+    def key(self, context, image_size, image_prefix):
+        session = dict(context.invocation_metadata() or ()).get(self.session_header)
+        return route_key(session, image_size, image_prefix)
+
+    async def unary(self, context, model, method, request):
+        """Forward a unary call, trying the next node on UNAVAILABLE / RESOURCE_EXHAUSTED."""
+        key = self.key(context, len(request.image_data), request.image_data[:ROUTE_KEY_BYTES])
+        error = None
+        for node in self.pick(key, model):
+            call = getattr(node.stubs[model], method)(
+                request, timeout=context.time_remaining(), metadata=forward_metadata(context)
+            )
+            node.in_flight[model] += 1
+            try:
+                response = await call
+            except grpc.RpcError as e:
+                error = e
+                if e.code() in FAILOVER_CODES:
+                    self._failed(node, e)
+                    continue
+                await abort_with(context, e)
+            finally:
+                node.in_flight[model] -= 1
+            node.routed += 1
+            await forward_response_metadata(context, call, node)
+            return response
+        await abort_with(context, error)
+
+    async def stream(self, context, model, method, request=None, upload=None):
+        """
+        Forward a server streaming call (`request`) or a *Chunked call (`upload`, a
+        _BufferedUpload). Failing over is only possible until the first response message
+        has been forwarded.
+        """
+        if upload is not None:
+            image_size, image_prefix = await upload.route_info()
+            key = self.key(context, image_size, image_prefix)
+        else:
+            key = self.key(context, len(request.image_data), request.image_data[:ROUTE_KEY_BYTES])
+
+        error = None
+        for node in self.pick(key, model):
+            call = getattr(node.stubs[model], method)(
+                upload.replay() if upload is not None else request,
+                timeout=context.time_remaining(), metadata=forward_metadata(context)
+            )
+            node.in_flight[model] += 1
+            forwarded = False
+            try:
+                async for message in call:
+                    if not forwarded:
+                        await context.send_initial_metadata(await initial_metadata(call, node))
+                        forwarded = True
+                    yield message
+            except grpc.RpcError as e:
+                error = e
+                if not forwarded and e.code() in FAILOVER_CODES:
+                    self._failed(node, e)
+                    continue
+                await abort_with(context, e)
+            finally:
+                node.in_flight[model] -= 1
+                #no-op once the call has finished, stops the node's work if the client left
+                call.cancel()
+            node.routed += 1
+            if not forwarded:
+                await context.send_initial_metadata(await initial_metadata(call, node))
+            context.set_trailing_metadata(tuple(await call.trailing_metadata() or ()))
+            return
+        await abort_with(context, error)
+
+    def _failed(self, node, error):
+        if error.code() == grpc.StatusCode.UNAVAILABLE:
+            self._set_healthy(node, False, error.details() or error.code().name)
+
+    def stats(self):
+        """
+        Returns:
+            dict: per node address its health, current loads and calls routed to it
+        """
+        return {
+            node.address: {
+                "healthy": node.healthy,
+                "load": {model: node.load(model) for model in node.in_flight},
+                "routed": node.routed,
+            }
+            for node in self.nodes.values()
+        }
+
+
+def forward_metadata(context):
+    return tuple(
+        (key, value) for key, value in context.invocation_metadata() or ()
+        if not key.startswith("grpc-") and key not in _TRANSPORT_METADATA
+    )
+
+
+async def initial_metadata(call, node):
+    """Initial metadata of the node's response (x-quality-tier, ...) plus the node that served the call."""
+    metadata = tuple(await call.initial_metadata() or ())
+    return metadata + ((NODE_METADATA_KEY, node.address),)
+
+
+async def forward_response_metadata(context, call, node):
+    await context.send_initial_metadata(await initial_metadata(call, node))
+    context.set_trailing_metadata(tuple(await call.trailing_metadata() or ()))
+
+
+async def abort_with(context, error):
+    """End the call with the status of the node's `error` (UNAVAILABLE if no node was reachable)."""
+    if error is None:
+        await context.abort(grpc.StatusCode.UNAVAILABLE, "No backend node available")
+    await context.abort(error.code(), error.details() or "", tuple(error.trailing_metadata() or ()))
+
+
+class RoutedRelightingService(relighting_pb2_grpc.RelightingServiceServicer):
+    def __init__(self, router):
+        self.router = router
+
+    async def Relight(self, request, context):
+        return await self.router.unary(context, "relight", "Relight", request)
+
+    async def RelightStream(self, request, context):
+        async for message in self.router.stream(context, "relight", "RelightStream", request=request):
+            yield message
+
+    async def RelightChunked(self, request_iterator, context):
+        upload = _BufferedUpload(request_iterator)
+        async for chunk in self.router.stream(context, "relight", "RelightChunked", upload=upload):
+            yield chunk
+
+
+class RoutedPoseChangingService(pose_pb2_grpc.PoseChangingServiceServicer):
+    def __init__(self, router):
+        self.router = router
+
+    async def ChangePose(self, request, context):
+        return await self.router.unary(context, "pose", "ChangePose", request)
+
+    async def ChangePoseStream(self, request, context):
+        async for message in self.router.stream(context, "pose", "ChangePoseStream", request=request):
+            yield message
+
+    async def ChangePoseChunked(self, request_iterator, context):
+        upload = _BufferedUpload(request_iterator)
+        async for chunk in self.router.stream(context, "pose", "ChangePoseChunked", upload=upload):
+            yield chunk
+
+
+async def serve(args):
+    router = Router(
+        args.node, args.virtual_nodes, args.balance_factor, args.min_spill_load, args.health_interval, args.session_header
+    )
+    await router.start()
+    channel_options = [("grpc.max_receive_message_length", -1), ("grpc.max_send_message_length", -1)]
+    server = grpc.aio.server(options=channel_options)
+    relighting_pb2_grpc.add_RelightingServiceServicer_to_server(RoutedRelightingService(router), server)
+    pose_pb2_grpc.add_PoseChangingServiceServicer_to_server(RoutedPoseChangingService(router), server)
+    server.add_insecure_port(f"[::]:{args.port}")
+    await server.start()
+    print(f"Router started on port {args.port}, routing to {', '.join(args.node)}")
+    try:
+        await server.wait_for_termination()
+    finally:
+        await server.stop(5)
+        await router.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Route Aurora requests across backend nodes")
+    parser.add_argument("--port", type=int, default=50050, help="Port the router listens on")
+    parser.add_argument("--node", action="append", required=True, help="host:port of a backend node (repeatable)")
+    parser.add_argument("--session-header", default="x-session-id",
+                        help="Metadata key of the session key clients may route by instead of the image")
+    parser.add_argument("--virtual-nodes", type=int, default=64, help="Hash ring points per node")
+    parser.add_argument("--balance-factor", type=float, default=0.25,
+                        help="Load above the average a node may carry before calls spill to the next node")
+    parser.add_argument("--min-spill-load", type=int, default=2,
+                        help="Queued + running jobs below which a node never hands calls to the next one")
+    parser.add_argument("--health-interval", type=float, default=2.0, help="Seconds between node status polls")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    try:
+        asyncio.run(serve(parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
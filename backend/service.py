@@ -1,99 +1,1205 @@
+import asyncio
+import contextvars
+import functools
 import grpc
-import io
 import json
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 import numpy as np
-from PIL import Image
 
 from . import relighting_pb2
 from . import relighting_pb2_grpc
 from . import pose_pb2
 from . import pose_pb2_grpc
+from . import admin_pb2
+from . import admin_pb2_grpc
 
-from .ml_models import RelightingModel, PoseCorrectionPipeline
+from .chunking import ChunkWriter, ChunkedUpload
+from .image_io import decode_image, decode_inputs, scale_points
+from .encoding import encoder_pool, encode_response, encode_response_async, output_options, prepare_output, write_image
+from .admission import AdmissionController, AdmissionRejected, estimate_relight_cost, estimate_pose_cost
+from .inference_queue import QueueFullError
+from .metrics import ServerStats, status_code_name
+from .result_cache import ResultCache, cache_key
+from .tracing import Tracer, traced
+from .cancellation import RequestCancelled, context_cancel_token
+from .single_flight import SingleFlight
+from .capture import TrafficCapture, replayable_metadata
+from .shm_transport import OutputSegmentTooSmall, SharedMemoryError, read_shared_image, write_shared_image
+from .quality import FULL, TIER_METADATA_KEY, QualitySelector, pose_steps
+from .worker_pool import WorkerPool
+from .cpu_slots import CpuSlots, plan_slots
+from .staged_engine import StagedEngine
+from .ml_models import RelightingModel, PoseCorrectionPipeline, cfg
+from .ml_models.model_manager import ModelManager
+from .ml_models.stub_models import StubRelightingModel, StubPoseCorrectionPipeline
+from .ml_models.previews import latents_to_preview, encode_preview
 from .model.lights_model import LightsRequest
 
-relight_pipeline = RelightingModel()
-pose_pipeline = PoseCorrectionPipeline()
+#both pipelines load their components lazily and share one memory budget
+model_manager = ModelManager(cfg.MEMORY_BUDGET_BYTES)
+if cfg.STUB_MODELS:
+    relight_pipeline = StubRelightingModel(step_ms=cfg.STUB_STEP_MS)
+    pose_pipeline = StubPoseCorrectionPipeline(step_ms=cfg.STUB_STEP_MS)
+else:
+    relight_pipeline = RelightingModel(models=model_manager)
+    pose_pipeline = PoseCorrectionPipeline(
+        max_batch_size=cfg.POSE_MAX_BATCH_SIZE,
+        max_batch_wait_ms=cfg.POSE_MAX_BATCH_WAIT_MS,
+        models=model_manager,
+        cpu_offload=cfg.POSE_CPU_OFFLOAD
+    )
 
-class RelightingService(relighting_pb2_grpc.RelightingServiceServicer):
-    def Relight(self, request, context):
+result_cache = ResultCache(cfg.RESULT_CACHE_BYTES, cfg.RESULT_CACHE_DIR, cfg.RESULT_CACHE_DISK_BYTES)
+#identical requests running at the same time share one computation
+single_flight = SingleFlight()
+#learns stage costs from finished requests, picks quality tiers when quality.deadline_aware is on
+quality_selector = QualitySelector(cfg.QUALITY_HEADROOM)
+
+#set by start_worker_pool when inference runs in worker processes (server.worker_processes)
+worker_pool = None
+
+#in-process inference runs in one of these groups of cores (cpu_slots in config.yaml)
+cpu_slots = None
+if cfg.CPU_SLOTS:
+    cpu_slots = CpuSlots(plan_slots(cfg.CPU_SLOTS, cfg.CPU_SLOTS_RESERVED_CORES, cfg.CPU_SLOTS_CORES))
+
+#in-process relight requests run through these stage pools (staged_relight in config.yaml)
+relight_engine = None
+if cfg.STAGED_RELIGHT:
+    relight_engine = StagedEngine("relight", [
+        ("prepare", cfg.STAGED_PREPARE_WORKERS),
+        ("diffusion", cfg.STAGED_DIFFUSION_WORKERS),
+        ("finish", cfg.STAGED_FINISH_WORKERS),
+    ], cfg.STAGED_QUEUE_SIZE, cpu_slots)
+    if cfg.SERVER_MODE == "aio" and cfg.RELIGHT_QUEUE_WORKERS < len(relight_engine.stages):
+        print(f"[WARNING] : relight_queue.num_workers is {cfg.RELIGHT_QUEUE_WORKERS}, the relight stages "
+              f"only overlap with at least {len(relight_engine.stages)} requests in flight")
+
+#set by start_capture when a sample of the requests is recorded for replay (capture.sample_rate)
+traffic_capture = None
+#the CapturedRequest of the call being handled, for handlers that only know their request after an upload
+_captured_request = contextvars.ContextVar("captured_request", default=None)
+
+
+def start_worker_pool(num_workers):
+    """Run inference in `num_workers` worker processes instead of this one."""
+    global worker_pool
+    #the workers are pinned to the CPU slots instead of taking turns in them
+    worker_pool = WorkerPool(num_workers, cfg.MEMORY_BUDGET_BYTES, cpu_slots.layout if cpu_slots is not None else None)
+    worker_pool.start()
+
+
+def stop_worker_pool():
+    global worker_pool
+    if worker_pool is not None:
+        worker_pool.stop()
+        worker_pool = None
+
+
+def start_capture(directory, sample_rate, max_file_bytes, max_files):
+    """Record `sample_rate` of the requests into rotating capture files in `directory`."""
+    global traffic_capture
+    traffic_capture = TrafficCapture(directory, sample_rate, max_file_bytes, max_files)
+    print(f"[INFO] : Capturing {sample_rate:.1%} of the requests into {directory}")
+
+
+def stop_capture():
+    global traffic_capture
+    if traffic_capture is not None:
+        traffic_capture.close()
+        stats = traffic_capture.stats()
+        print(f"[INFO] : Captured {stats['captured']} requests ({stats['dropped']} dropped)")
+        traffic_capture = None
+
+
+@contextmanager
+def cpu_slot(tracer=None, cancel_token=None):
+    """Run the body in a free CPU slot when cpu_slots are configured, the wait for it is traced as "cpu_slot"."""
+    if cpu_slots is None:
+        yield
+        return
+    with traced(tracer, "cpu_slot"):
+        index = cpu_slots.acquire(cancel_token)
+    try:
+        yield
+    finally:
+        cpu_slots.release(index)
+
+
+def server_stats(queues=(), admission=None):
+    """ServerStats reporting on `queues`, `admission` and this module's models, caches and worker pool."""
+    quality = quality_selector if cfg.QUALITY_DEADLINE_AWARE else None
+    #with a worker pool the slots only hold the workers' layout, and the stages are unused
+    slots = cpu_slots if worker_pool is None else None
+    stages = relight_engine if worker_pool is None else None
+    pose_batcher = getattr(pose_pipeline, "batcher", None) if worker_pool is None else None
+    return ServerStats(queues, model_manager, result_cache, worker_pool, admission, single_flight, quality, slots,
+                       stages, pose_batcher)
+
+
+class ProgressReporter:
+    """
+    Turns pipeline stage/step callbacks into progress messages for the streaming RPCs.
+
+    Args:
+        message_cls: Progress message type (RelightProgress or PoseProgress)
+        emit: Callable that delivers a message to the client, called from the inference worker thread
+        preview_every: Attach a latent preview every N denoising steps
+        preview_size: Side length of the previews in pixels
+    """
+
+    def __init__(self, message_cls, emit, preview_every=cfg.PREVIEW_EVERY_N_STEPS, preview_size=cfg.PREVIEW_SIZE):
+        self.message_cls = message_cls
+        self.emit = emit
+        self.preview_every = max(1, preview_every)
+        self.preview_size = preview_size
+
+    def stage(self, name):
+        self.emit(self.message_cls(stage=name))
+
+    def step(self, step, total_steps, latents):
+        message = self.message_cls(stage="denoising", step=step, total_steps=total_steps)
+        if step % self.preview_every == 0 or step == total_steps:
+            message.preview_data = encode_preview(latents_to_preview(latents, self.preview_size))
+        self.emit(message)
+
+
+def run_cached(reporter, produce, key, use_cache=True):
+    """Return the cached result for the request with content hash `key`, or run `produce()` and cache its result."""
+    if not use_cache or not result_cache.enabled:
+        return produce()
+
+    processed_image = result_cache.get(key)
+    if processed_image is not None:
+        if reporter is not None:
+            reporter.stage("cached")
+        return processed_image
+
+    processed_image = produce()
+    result_cache.put(key, processed_image)
+    return processed_image
+
+
+@contextmanager
+def request_trace(context, rpc, request=None):
+    """
+    Tracer for one request, None when tracing is off.
+
+    When the handler completes, the spans go out as `server-timing` trailing metadata and, if
+    tracing.chrome_trace_dir is set, into a Chrome trace file. Aborted requests report nothing.
+
+    When traffic capture samples the call, `request` is captured with its spans and status once
+    the handler ends, aborted or not. Handlers of chunked uploads pass None and call
+    capture_upload() once the upload is assembled.
+    """
+    captured = None
+    if traffic_capture is not None:
+        captured = traffic_capture.sample(
+            rpc, replayable_metadata(context.invocation_metadata()), context.time_remaining()
+        )
+    if captured is None and not cfg.TRACING_ENABLED:
+        yield None
+        return
+
+    #captures keep their stage timings even with tracing off
+    tracer = Tracer(sync_cuda=cfg.TRACING_SYNC_CUDA)
+    if captured is not None:
+        if request is not None:
+            captured.set_request(request)
+        _captured_request.set(captured)
+    try:
+        yield tracer
+    except BaseException as e:
+        if captured is not None:
+            traffic_capture.finish(captured, status_code_name(context, e), tracer.spans)
+        raise
+    finally:
+        _captured_request.set(None)
+
+    if captured is not None:
+        traffic_capture.finish(captured, status_code_name(context), tracer.spans)
+    if not cfg.TRACING_ENABLED:
+        return
+    if tracer.spans:
+        context.set_trailing_metadata((("server-timing", tracer.server_timing()),))
+    if cfg.TRACE_DIR:
+        os.makedirs(cfg.TRACE_DIR, exist_ok=True)
+        name = f"{rpc}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.json"
+        tracer.save_chrome_trace(os.path.join(cfg.TRACE_DIR, name))
+
+
+def capture_upload(request, data):
+    """Give the capture of the current call, if it is sampled, the request assembled from a chunked upload."""
+    captured = _captured_request.get()
+    if captured is not None:
+        captured.set_request(request, data.get("image"), data.get("mask"))
+
+
+def request_seed(request):
+    return request.seed if request.HasField("seed") else None
+
+
+def relight_key(request, image_data=None, mask_data=None, tier=None):
+    """
+    Content hash of a RelightRequest's inputs, `image_data`/`mask_data` override the request fields.
+    Results of a degraded quality `tier` get their own keys.
+    """
+    return cache_key(
+        "relight",
+        request.image_data if image_data is None else image_data,
+        request.mask_data if mask_data is None else mask_data,
+        request.json_data,
+        request_seed(request),
+        *(() if tier in (None, FULL) else (tier.name,))
+    )
+
+
+def pose_options(request, tier=None):
+    """
+    Returns (num_steps, controlnet_conditioning, strength) of a PoseRequest, with the defaults
+    filled in and the steps cut down to the quality `tier`.
+    """
+    num_steps = 30
+    controlnet_conditioning = 0.85
+    strength = 1.5
+
+    if request.num_steps:
+        num_steps = request.num_steps
+    if request.controlnet_conditioning:
+        controlnet_conditioning = request.controlnet_conditioning
+    if request.strength:
+        strength = request.strength
+    return pose_steps(tier, num_steps), controlnet_conditioning, strength
+
+
+def effective_pose_steps(num_steps, strength):
+    #img2img inpainting only runs the last `strength` fraction of the schedule
+    return max(int(num_steps * min(strength, 1.0)), 1)
+
+
+def pose_key(request, image_data=None, tier=None):
+    """Content hash of a PoseRequest's inputs, `image_data` overrides the request field."""
+    return cache_key(
+        "change_pose",
+        request.image_data if image_data is None else image_data,
+        request.new_skeleton_data,
+        *pose_options(request, tier),
+        request_seed(request)
+    )
+
+
+def choose_tier(context, kind, request, queue_wait_s=0.0):
+    """
+    Quality tier for a request of `kind` that is expected to wait `queue_wait_s` for a worker,
+    the best one that fits in the call's remaining deadline. None unless quality.deadline_aware is on.
+    """
+    if not cfg.QUALITY_DEADLINE_AWARE:
+        return None
+    remaining = context.time_remaining()
+    budget_s = remaining - queue_wait_s if remaining is not None else None
+    num_steps = None
+    if kind == "change_pose":
+        num_steps, _, strength = pose_options(request)
+        num_steps = effective_pose_steps(num_steps, strength)
+    return quality_selector.choose(kind, budget_s, num_steps)
+
+
+def pick_tier(context, kind, request):
+    """choose_tier for the sync servicers, the tier is sent to the client as initial metadata."""
+    tier = choose_tier(context, kind, request)
+    if tier is not None:
+        context.send_initial_metadata(((TIER_METADATA_KEY, tier.name),))
+    return tier
+
+
+async def pick_tier_async(context, kind, request, inference_queue, admission):
+    """choose_tier for the aio servicers, after the estimated wait in `inference_queue`."""
+    if not cfg.QUALITY_DEADLINE_AWARE:
+        return None
+    _, priority = admission.classify(context)
+    tier = choose_tier(context, kind, request, inference_queue.estimated_wait_s(priority))
+    await context.send_initial_metadata(((TIER_METADATA_KEY, tier.name),))
+    return tier
+
+
+def run_observed(kind, tier, num_steps, tracer, run):
+    """Return `run(tracer)` and let the quality selector learn stage costs from the spans it records."""
+    if tracer is None and cfg.QUALITY_DEADLINE_AWARE:
+        tracer = Tracer()
+    start = time.perf_counter()
+    result = run(tracer)
+    if tracer is not None:
+        quality_selector.observe(kind, tier or FULL, tracer.spans, time.perf_counter() - start, num_steps)
+    return result
+
+
+def relight_image(request, reporter=None, image_data=None, mask_data=None, tracer=None, cancel_token=None,
+                  use_cache=True, tier=None, image=None, mask=None):
+    """
+    Run a RelightRequest through the relighting model.
+
+    `image_data`/`mask_data` override the request fields, e.g. with buffers assembled
+    from a chunked upload. `image`/`mask` are inputs that are already decoded, e.g. read from
+    shared memory, `image_data`/`mask_data` then only key the result cache. Uploads are decoded
+    upright and capped to decoding.max_input_pixels, the mask at the image's size. An optional `tracer`
+    records the time spent in every stage, an optional `cancel_token` aborts the work with
+    RequestCancelled once the client is gone. `use_cache=False` always runs the model and
+    leaves the result cache alone. A quality `tier` other than FULL trades steps, upscaler and
+    depth model for speed.
+
+    Returns:
+        PIL.Image: the relit image
+    """
+    if reporter is not None:
+        reporter.stage("decoding")
+    if image_data is None:
+        image_data = request.image_data
+    if mask_data is None:
+        mask_data = request.mask_data
+
+    staged = relight_engine is not None and worker_pool is None
+    if image is None and staged:
+        #decoded in the engine's prepare stage, while other requests are in the denoiser
+        def decode_upload():
+            with traced(tracer, "decode"):
+                return decode_inputs(image_data, mask_data, cfg.MAX_INPUT_PIXELS)[:2]
+    elif image is None:
+        with traced(tracer, "decode"):
+            image, mask, _ = decode_inputs(image_data, mask_data, cfg.MAX_INPUT_PIXELS)
+
+    lightmap = None
+    if request.json_data:
         try:
-            image_data = request.image_data
-            image = Image.open(io.BytesIO(image_data))
-            
-            lightmap = None
-            if request.json_data:
-                try:
-                    lights_request = LightsRequest.model_validate_json(request.json_data)
-                    lightmap = lights_request.lights
-                except Exception as e:
-                    print(f"Error parsing json_data: {e}")
-            
-            if request.mask_data:
-                mask = Image.open(io.BytesIO(request.mask_data))
-            else:
-                mask = None
-
-            processed_image = relight_pipeline.predict(image, mask, lights_config=lightmap)
-            
-            output_buffer = io.BytesIO()
-            processed_image[0].save(output_buffer, format='PNG')
-            processed_image_data = output_buffer.getvalue()
-            
-            return relighting_pb2.RelightResponse(processed_image_data=processed_image_data)
+            lights_request = LightsRequest.model_validate_json(request.json_data)
+            lightmap = lights_request.lights
         except Exception as e:
-            print(f"Error processing request: {e}")
-            context.set_details(str(e))
-            context.set_code(grpc.StatusCode.INTERNAL)
-            return relighting_pb2.RelightResponse()
+            print(f"Error parsing json_data: {e}")
 
-class PoseChangingService(pose_pb2_grpc.PoseChangingServiceServicer):
-    def ChangePose(self, request, context):
+    seed = request_seed(request)
+    stage_callback = reporter.stage if reporter is not None else None
+    step_callback = reporter.step if reporter is not None else None
+
+    tier = tier or FULL
+    settings = {
+        "num_inference_steps": tier.relight_steps,
+        "use_realesrgan": tier.realesrgan,
+        "depth_model": tier.depth_model,
+    }
+
+    def produce(tracer):
+        if worker_pool is not None:
+            return worker_pool.run(
+                "relight", {"image": image, "mask": mask}, stage_callback, step_callback, tracer, cancel_token,
+                lights_config=lightmap, seed=seed, **settings
+            )
+
+        if staged:
+            #every stage takes a CPU slot of its own, a slot held for the whole request would serialize them
+            processed_image = relight_pipeline.predict(
+                image, mask, lights_config=lightmap, seed=seed,
+                stage_callback=stage_callback,
+                step_callback=step_callback,
+                tracer=tracer,
+                cancel_token=cancel_token,
+                engine=relight_engine,
+                decode=decode_upload if image is None else None,
+                **settings
+            )
+            return processed_image[0]
+
+        with cpu_slot(tracer, cancel_token):
+            processed_image = relight_pipeline.predict(
+                image, mask, lights_config=lightmap, seed=seed,
+                stage_callback=stage_callback,
+                step_callback=step_callback,
+                tracer=tracer,
+                cancel_token=cancel_token,
+                **settings
+            )
+        return processed_image[0]
+
+    processed_image = run_cached(
+        reporter, lambda: run_observed("relight", tier, tier.relight_steps, tracer, produce),
+        relight_key(request, image_data, mask_data, tier), use_cache
+    )
+    if cancel_token is not None:
+        #the result is cached, but nobody is waiting for it to be encoded
+        cancel_token.check()
+    return processed_image
+
+
+def change_pose_image(request, reporter=None, image_data=None, tracer=None, cancel_token=None, use_cache=True,
+                      tier=None, image=None):
+    """
+    Run a PoseRequest through the pose correction pipeline.
+
+    `image_data` overrides the request field, e.g. with a buffer assembled from a chunked upload.
+    `image` is an input that is already decoded, `image_data` then only keys the result cache.
+    An upload is decoded upright and capped to decoding.max_input_pixels, the skeleton scaled with it.
+    An optional `tracer` records the time spent in every stage, an optional `cancel_token`
+    aborts the work with RequestCancelled once the client is gone. `use_cache=False` always
+    runs the model and leaves the result cache alone. A quality `tier` other than FULL runs
+    fewer denoising steps than requested.
+
+    Returns:
+        PIL.Image: the re-posed image
+    """
+    if reporter is not None:
+        reporter.stage("decoding")
+    if image_data is None:
+        image_data = request.image_data
+    scale = (1.0, 1.0)
+    if image is None:
+        with traced(tracer, "decode"):
+            image, scale = decode_image(image_data, cfg.MAX_INPUT_PIXELS)
+
+    offset_config = []
+    num_steps, controlnet_conditioning, strength = pose_options(request, tier)
+
+    if request.new_skeleton_data:
         try:
-            image_data = request.image_data
-            image = Image.open(io.BytesIO(image_data))
-            
-            offset_config = []
-            num_steps = 30
-            controlnet_conditioning = 0.85
-            strength = 1.5
-
-            if request.num_steps:
-                num_steps = request.num_steps
-            if request.controlnet_conditioning:
-                controlnet_conditioning = request.controlnet_conditioning
-            if request.strength:
-                strength = request.strength
-
-            if request.new_skeleton_data:
-                try:
-                    json_str = request.new_skeleton_data.decode('utf-8')
-                    offset_config = json.loads(json_str)
-                    print(f"Received offset config: {offset_config}")
-                except Exception as e:
-                    print(f"Error parsing new_skeleton_data: {e}")
-                    raise ValueError("Invalid skeleton data format")
-
-            if not offset_config:
-                 # If no config, return original image
-                 print("No offset config provided, returning original image")
-                 processed_image = image
-            else:
-                processed_image = pose_pipeline.process_request(
-                    image_input=image_data, 
-                    offset_config=offset_config, 
-                    number_of_steps=num_steps, 
-                    strength=strength, 
-                    controlnet_conditioning=controlnet_conditioning
-                )
-            
-            output_buffer = io.BytesIO()
-            processed_image.save(output_buffer, format='PNG')
-            processed_image_data = output_buffer.getvalue()
-            
-            return pose_pb2.PoseResponse(processed_image_data=processed_image_data)
+            json_str = request.new_skeleton_data.decode('utf-8')
+            offset_config = json.loads(json_str)
+            print(f"Received offset config: {offset_config}")
         except Exception as e:
-            print(f"Error processing pose request: {e}")
-            context.set_details(str(e))
-            context.set_code(grpc.StatusCode.INTERNAL)
-            return pose_pb2.PoseResponse()
\ No newline at end of file
+            print(f"Error parsing new_skeleton_data: {e}")
+            raise ValueError("Invalid skeleton data format")
+        #the skeleton is in pixels of the upload, the pipeline gets the image as it was decoded
+        try:
+            offset_config = scale_points(offset_config, scale)
+        except (TypeError, IndexError, KeyError) as e:
+            raise ValueError("Invalid skeleton data format") from e
+
+    if not offset_config:
+         # If no config, return original image
+         print("No offset config provided, returning original image")
+         return image
+
+    seed = request_seed(request)
+    stage_callback = reporter.stage if reporter is not None else None
+    step_callback = reporter.step if reporter is not None else None
+
+    def produce(tracer):
+        if worker_pool is not None:
+            return worker_pool.run(
+                "change_pose", {"image": image}, stage_callback, step_callback, tracer, cancel_token,
+                offset_config=offset_config,
+                number_of_steps=num_steps,
+                strength=strength,
+                controlnet_conditioning=controlnet_conditioning,
+                seed=seed
+            )
+
+        with cpu_slot(tracer, cancel_token):
+            return pose_pipeline.process_request(
+                image_input=image,
+                offset_config=offset_config,
+                number_of_steps=num_steps,
+                strength=strength,
+                controlnet_conditioning=controlnet_conditioning,
+                stage_callback=stage_callback,
+                step_callback=step_callback,
+                seed=seed,
+                tracer=tracer,
+                cancel_token=cancel_token
+            )
+
+    processed_image = run_cached(
+        reporter, lambda: run_observed("change_pose", tier, effective_pose_steps(num_steps, strength), tracer, produce),
+        pose_key(request, image_data, tier), use_cache
+    )
+    if cancel_token is not None:
+        cancel_token.check()
+    return processed_image
+
+
+def encode_chunks(image, request, chunk_cls, emit, chunk_size=cfg.CHUNK_SIZE, tracer=None):
+    """Encode the processed image as `request` asks and `emit` chunk_cls messages while the encoder runs."""
+    output_format, quality, png_compress_level = output_options(request)
+    with traced(tracer, "encode"):
+        image, (width, height, channels) = prepare_output(image, output_format)
+
+        def emit_chunk(data, offset, last):
+            emit(chunk_cls(data=data, offset=offset, last=last, width=width, height=height, channels=channels))
+
+        writer = ChunkWriter(emit_chunk, chunk_size)
+        write_image(image, writer, output_format, quality, png_compress_level)
+        writer.close()
+
+
+def coalesced_callback(reporter):
+    return (lambda: reporter.stage("coalesced")) if reporter is not None else None
+
+
+def run_coalesced(key, run, request, reporter=None, tracer=None, cancel_token=None, **kwargs):
+    """
+    Return `run(request, reporter, tracer=tracer, cancel_token=..., **kwargs)`, or the result of the
+    identical request with content hash `key` that is already running.
+    """
+    return single_flight.run(
+        key,
+        lambda shared_token: run(request, reporter, tracer=tracer, cancel_token=shared_token, **kwargs),
+        cancel_token,
+        coalesced_callback(reporter)
+    )
+
+
+async def run_admitted(admission, context, inference_queue, cost, key, run, request, reporter=None, tracer=None,
+                       cancel_token=None, **kwargs):
+    """
+    Await `run(request, reporter, tracer=tracer, cancel_token=..., **kwargs)` from `inference_queue`
+    behind admission control, or the result of the identical request with content hash `key` that is
+    already queued or running. A request that attaches to another one costs nothing and skips admission.
+    """
+    async def start(shared_token):
+        with admission.admit(context, inference_queue, cost) as ticket:
+            return await ticket.submit(run, request, reporter, tracer=tracer, cancel_token=shared_token, **kwargs)
+
+    return await single_flight.run_async(key, start, cancel_token, coalesced_callback(reporter))
+
+
+def relight(request, reporter=None, tracer=None, cancel_token=None, tier=None):
+    """Run a RelightRequest through the relighting model and build the response."""
+    processed_image = run_coalesced(
+        relight_key(request, tier=tier), relight_image, request, reporter, tracer, cancel_token, tier=tier
+    )
+    if reporter is not None:
+        reporter.stage("encoding")
+    return encode_response(processed_image, request, relighting_pb2.RelightResponse, tracer)
+
+
+def change_pose(request, reporter=None, tracer=None, cancel_token=None, tier=None):
+    """Run a PoseRequest through the pose correction pipeline and build the response."""
+    processed_image = run_coalesced(
+        pose_key(request, tier=tier), change_pose_image, request, reporter, tracer, cancel_token, tier=tier
+    )
+    if reporter is not None:
+        reporter.stage("encoding")
+    return encode_response(processed_image, request, pose_pb2.PoseResponse, tracer)
+
+
+def run_with_events(job):
+    """Run `job(emit)` on a helper thread, yield everything it emits and return its result."""
+    events = queue.Queue()
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = job(events.put)
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            events.put(None)
+
+    threading.Thread(target=target, daemon=True).start()
+    while (message := events.get()) is not None:
+        yield message
+
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+def threadsafe_emitter(events):
+    """Build an emit callable that worker threads can use to feed an asyncio.Queue."""
+    loop = asyncio.get_running_loop()
+    return lambda message: loop.call_soon_threadsafe(events.put_nowait, message)
+
+
+async def forward_events(job, events):
+    """Yield what a running job puts on `events` until the job completes."""
+    while not job.done():
+        next_event = asyncio.ensure_future(events.get())
+        await asyncio.wait({next_event, job}, return_when=asyncio.FIRST_COMPLETED)
+        if next_event.done():
+            yield next_event.result()
+        else:
+            next_event.cancel()
+    while not events.empty():
+        yield events.get_nowait()
+
+
+def stream_sync(run, request, message_cls, tracer=None, cancel_token=None):
+    """
+    Run `run(request, reporter, tracer=tracer, cancel_token=cancel_token)` on a helper thread
+    and yield its progress, then the encoded image.
+    """
+    processed_image = yield from run_with_events(
+        lambda emit: run(request, ProgressReporter(message_cls, emit), tracer=tracer, cancel_token=cancel_token)
+    )
+    yield message_cls(stage="encoding")
+    yield encode_response(processed_image, request, message_cls, tracer, stage="done")
+
+
+async def stream_async(run, request, message_cls, tracer=None, cancel_token=None):
+    """
+    Await the coroutine `run(request, reporter, tracer=tracer, cancel_token=cancel_token)`
+    (see run_admitted) and yield its progress, then the encoded image.
+    """
+    events = asyncio.Queue()
+    job = asyncio.ensure_future(run(
+        request, ProgressReporter(message_cls, threadsafe_emitter(events)), tracer=tracer, cancel_token=cancel_token
+    ))
+    try:
+        async for message in forward_events(job, events):
+            yield message
+        processed_image = job.result()
+        yield message_cls(stage="encoding")
+        yield await encode_response_async(processed_image, request, message_cls, tracer, stage="done")
+    finally:
+        #client went away, the job is dropped if no other request waits for it and no worker has picked it up yet
+        job.cancel()
+
+
+def receive_upload(request_iterator, parts):
+    """Assemble a chunked upload. Returns (request, {part: bytearray})."""
+    upload = ChunkedUpload(parts, cfg.MAX_UPLOAD_BYTES)
+    for message in request_iterator:
+        upload.add(message)
+    return upload.finish()
+
+
+async def receive_upload_async(request_iterator, parts):
+    """Assemble a chunked upload from an async iterator. Returns (request, {part: bytearray})."""
+    upload = ChunkedUpload(parts, cfg.MAX_UPLOAD_BYTES)
+    async for message in request_iterator:
+        upload.add(message)
+    return upload.finish()
+
+
+async def stream_encoded_async(image, request, chunk_cls, tracer=None):
+    """Encode the processed image on the encoder pool and yield its chunks as they are produced."""
+    events = asyncio.Queue()
+    job = asyncio.get_running_loop().run_in_executor(
+        encoder_pool, encode_chunks, image, request, chunk_cls, threadsafe_emitter(events), cfg.CHUNK_SIZE, tracer
+    )
+    async for chunk in forward_events(job, events):
+        yield chunk
+    job.result()
+
+
+def read_shared_inputs(request, parts, tracer=None):
+    """
+    Copy the `parts` ("image", "mask") of a RelightSharedRequest / PoseSharedRequest out of shared memory.
+
+    Every part is required, images are limited to decoding.max_input_pixels like uploads.
+
+    Returns:
+        tuple: ({part: PIL.Image}, {part: bytes keying the result cache})
+    """
+    for part in parts:
+        if not request.HasField(part):
+            raise SharedMemoryError(f"The request names no {part} segment")
+    images, keys = {}, {}
+    with traced(tracer, "shm_read"):
+        for part in parts:
+            images[part], keys[part] = read_shared_image(getattr(request, part), cfg.MAX_INPUT_PIXELS)
+    return images, keys
+
+
+def write_shared_output(image, request, message_cls, tracer=None):
+    """Write the processed image into the request's output segment and describe its layout in a message_cls."""
+    with traced(tracer, "shm_write"):
+        width, height, channels = write_shared_image(image, request.output_segment)
+    return message_cls(width=width, height=height, channels=channels)
+
+
+async def run_on_encoder_pool(fn, *args):
+    """Shared memory copies stand in for decoding and encoding, they run on the encoder pool off the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(encoder_pool, functools.partial(fn, *args))
+
+
+def report_shared_memory_error(context, error):
+    """Fail a shared memory request whose segments are missing or do not fit, the client can fix and retry it."""
+    print(f"[WARNING] : {error}")
+    context.set_details(str(error))
+    if isinstance(error, OutputSegmentTooSmall):
+        context.set_code(grpc.StatusCode.OUT_OF_RANGE)
+    else:
+        context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+
+
+def report_cancelled(context, error):
+    """Finish a request whose work was abandoned because the client left or its deadline passed."""
+    print(f"[INFO] : {error}, skipped its remaining work")
+    context.set_details(str(error))
+    if error.reason == "deadline exceeded":
+        context.set_code(grpc.StatusCode.DEADLINE_EXCEEDED)
+    else:
+        context.set_code(grpc.StatusCode.CANCELLED)
+
+
+async def abort_overloaded(context, error):
+    """
+    Reject a request turned away by a full queue or the admission controller with
+    RESOURCE_EXHAUSTED, and tell the client when to come back.
+    """
+    context.set_trailing_metadata((("grpc-retry-pushback-ms", str(error.retry_after_ms)),))
+    await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(error))
+
+
+class RelightingService(relighting_pb2_grpc.RelightingServiceServicer):
+    def Relight(self, request, context):
+        with request_trace(context, "Relight", request) as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                tier = pick_tier(context, "relight", request)
+                return relight(request, tracer=tracer, cancel_token=cancel_token, tier=tier)
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+                return relighting_pb2.RelightResponse()
+            except Exception as e:
+                print(f"Error processing request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+                return relighting_pb2.RelightResponse()
+
+    def RelightStream(self, request, context):
+        with request_trace(context, "RelightStream", request) as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                tier = pick_tier(context, "relight", request)
+                yield from stream_sync(
+                    functools.partial(run_coalesced, relight_key(request, tier=tier), relight_image, tier=tier),
+                    request, relighting_pb2.RelightProgress, tracer, cancel_token
+                )
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+            except Exception as e:
+                print(f"Error processing request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+
+    def RelightChunked(self, request_iterator, context):
+        with request_trace(context, "RelightChunked") as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                request, data = receive_upload(request_iterator, ("image", "mask"))
+                capture_upload(request, data)
+                tier = pick_tier(context, "relight", request)
+                processed_image = run_coalesced(
+                    relight_key(request, data["image"], data["mask"], tier), relight_image, request,
+                    image_data=data["image"], mask_data=data["mask"], tier=tier,
+                    tracer=tracer, cancel_token=cancel_token
+                )
+                yield from run_with_events(
+                    lambda emit: encode_chunks(processed_image, request, relighting_pb2.ImageChunk, emit, tracer=tracer)
+                )
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+            except Exception as e:
+                print(f"Error processing request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+
+    def RelightShared(self, request, context):
+        #not captured for replay, the pixels are not part of the request
+        with request_trace(context, "RelightShared") as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                images, keys = read_shared_inputs(request, ("image", "mask"), tracer)
+                tier = pick_tier(context, "relight", request.request)
+                processed_image = run_coalesced(
+                    relight_key(request.request, keys["image"], keys["mask"], tier), relight_image, request.request,
+                    image_data=keys["image"], mask_data=keys["mask"], image=images["image"], mask=images["mask"],
+                    tier=tier, tracer=tracer, cancel_token=cancel_token
+                )
+                return write_shared_output(processed_image, request, relighting_pb2.RelightSharedResponse, tracer)
+            except SharedMemoryError as e:
+                report_shared_memory_error(context, e)
+                return relighting_pb2.RelightSharedResponse()
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+                return relighting_pb2.RelightSharedResponse()
+            except Exception as e:
+                print(f"Error processing request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+                return relighting_pb2.RelightSharedResponse()
+
+class PoseChangingService(pose_pb2_grpc.PoseChangingServiceServicer):
+    def ChangePose(self, request, context):
+        with request_trace(context, "ChangePose", request) as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                tier = pick_tier(context, "change_pose", request)
+                return change_pose(request, tracer=tracer, cancel_token=cancel_token, tier=tier)
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+                return pose_pb2.PoseResponse()
+            except Exception as e:
+                print(f"Error processing pose request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+                return pose_pb2.PoseResponse()
+
+    def ChangePoseStream(self, request, context):
+        with request_trace(context, "ChangePoseStream", request) as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                tier = pick_tier(context, "change_pose", request)
+                yield from stream_sync(
+                    functools.partial(run_coalesced, pose_key(request, tier=tier), change_pose_image, tier=tier),
+                    request, pose_pb2.PoseProgress, tracer, cancel_token
+                )
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+            except Exception as e:
+                print(f"Error processing pose request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+
+    def ChangePoseChunked(self, request_iterator, context):
+        with request_trace(context, "ChangePoseChunked") as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                request, data = receive_upload(request_iterator, ("image",))
+                capture_upload(request, data)
+                tier = pick_tier(context, "change_pose", request)
+                processed_image = run_coalesced(
+                    pose_key(request, data["image"], tier), change_pose_image, request,
+                    image_data=data["image"], tracer=tracer, cancel_token=cancel_token, tier=tier
+                )
+                yield from run_with_events(
+                    lambda emit: encode_chunks(processed_image, request, pose_pb2.PoseImageChunk, emit, tracer=tracer)
+                )
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+            except Exception as e:
+                print(f"Error processing pose request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+
+    def ChangePoseShared(self, request, context):
+        #not captured for replay, the pixels are not part of the request
+        with request_trace(context, "ChangePoseShared") as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                images, keys = read_shared_inputs(request, ("image",), tracer)
+                tier = pick_tier(context, "change_pose", request.request)
+                processed_image = run_coalesced(
+                    pose_key(request.request, keys["image"], tier), change_pose_image, request.request,
+                    image_data=keys["image"], image=images["image"], tier=tier, tracer=tracer, cancel_token=cancel_token
+                )
+                return write_shared_output(processed_image, request, pose_pb2.PoseSharedResponse, tracer)
+            except SharedMemoryError as e:
+                report_shared_memory_error(context, e)
+                return pose_pb2.PoseSharedResponse()
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+                return pose_pb2.PoseSharedResponse()
+            except Exception as e:
+                print(f"Error processing pose request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+                return pose_pb2.PoseSharedResponse()
+
+
+class AsyncRelightingService(relighting_pb2_grpc.RelightingServiceServicer):
+    """grpc.aio servicer that runs Relight requests from a bounded inference queue, behind admission control."""
+
+    def __init__(self, queue, admission=None):
+        self.queue = queue
+        self.admission = admission if admission is not None else AdmissionController()
+
+    async def Relight(self, request, context):
+        with request_trace(context, "Relight", request) as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                tier = await pick_tier_async(context, "relight", request, self.queue, self.admission)
+                processed_image = await run_admitted(
+                    self.admission, context, self.queue, estimate_relight_cost(request),
+                    relight_key(request, tier=tier), relight_image, request,
+                    tracer=tracer, cancel_token=cancel_token, tier=tier
+                )
+                return await encode_response_async(processed_image, request, relighting_pb2.RelightResponse, tracer)
+            except (QueueFullError, AdmissionRejected) as e:
+                await abort_overloaded(context, e)
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+                return relighting_pb2.RelightResponse()
+            except Exception as e:
+                print(f"Error processing request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+                return relighting_pb2.RelightResponse()
+
+    async def RelightStream(self, request, context):
+        with request_trace(context, "RelightStream", request) as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                tier = await pick_tier_async(context, "relight", request, self.queue, self.admission)
+                run = functools.partial(
+                    run_admitted, self.admission, context, self.queue, estimate_relight_cost(request),
+                    relight_key(request, tier=tier), relight_image, tier=tier
+                )
+                async for message in stream_async(run, request, relighting_pb2.RelightProgress, tracer, cancel_token):
+                    yield message
+            except (QueueFullError, AdmissionRejected) as e:
+                await abort_overloaded(context, e)
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+            except Exception as e:
+                print(f"Error processing request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+
+    async def RelightChunked(self, request_iterator, context):
+        with request_trace(context, "RelightChunked") as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                request, data = await receive_upload_async(request_iterator, ("image", "mask"))
+                capture_upload(request, data)
+                tier = await pick_tier_async(context, "relight", request, self.queue, self.admission)
+                processed_image = await run_admitted(
+                    self.admission, context, self.queue, estimate_relight_cost(request, data["image"]),
+                    relight_key(request, data["image"], data["mask"], tier), relight_image, request,
+                    image_data=data["image"], mask_data=data["mask"], tier=tier,
+                    tracer=tracer, cancel_token=cancel_token
+                )
+                async for chunk in stream_encoded_async(processed_image, request, relighting_pb2.ImageChunk, tracer):
+                    yield chunk
+            except (QueueFullError, AdmissionRejected) as e:
+                await abort_overloaded(context, e)
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+            except Exception as e:
+                print(f"Error processing request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+
+    async def RelightShared(self, request, context):
+        #not captured for replay, the pixels are not part of the request
+        with request_trace(context, "RelightShared") as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                images, keys = await run_on_encoder_pool(read_shared_inputs, request, ("image", "mask"), tracer)
+                tier = await pick_tier_async(context, "relight", request.request, self.queue, self.admission)
+                megapixels = images["image"].width * images["image"].height / 1e6
+                processed_image = await run_admitted(
+                    self.admission, context, self.queue, estimate_relight_cost(request.request, megapixels=megapixels),
+                    relight_key(request.request, keys["image"], keys["mask"], tier), relight_image, request.request,
+                    image_data=keys["image"], mask_data=keys["mask"], image=images["image"], mask=images["mask"],
+                    tier=tier, tracer=tracer, cancel_token=cancel_token
+                )
+                return await run_on_encoder_pool(
+                    write_shared_output, processed_image, request, relighting_pb2.RelightSharedResponse, tracer
+                )
+            except (QueueFullError, AdmissionRejected) as e:
+                await abort_overloaded(context, e)
+            except SharedMemoryError as e:
+                report_shared_memory_error(context, e)
+                return relighting_pb2.RelightSharedResponse()
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+                return relighting_pb2.RelightSharedResponse()
+            except Exception as e:
+                print(f"Error processing request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+                return relighting_pb2.RelightSharedResponse()
+
+class AsyncPoseChangingService(pose_pb2_grpc.PoseChangingServiceServicer):
+    """grpc.aio servicer that runs ChangePose requests from a bounded inference queue, behind admission control."""
+
+    def __init__(self, queue, admission=None):
+        self.queue = queue
+        self.admission = admission if admission is not None else AdmissionController()
+
+    async def ChangePose(self, request, context):
+        with request_trace(context, "ChangePose", request) as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                tier = await pick_tier_async(context, "change_pose", request, self.queue, self.admission)
+                processed_image = await run_admitted(
+                    self.admission, context, self.queue, estimate_pose_cost(request), pose_key(request, tier=tier),
+                    change_pose_image, request, tracer=tracer, cancel_token=cancel_token, tier=tier
+                )
+                return await encode_response_async(processed_image, request, pose_pb2.PoseResponse, tracer)
+            except (QueueFullError, AdmissionRejected) as e:
+                await abort_overloaded(context, e)
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+                return pose_pb2.PoseResponse()
+            except Exception as e:
+                print(f"Error processing pose request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+                return pose_pb2.PoseResponse()
+
+    async def ChangePoseStream(self, request, context):
+        with request_trace(context, "ChangePoseStream", request) as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                tier = await pick_tier_async(context, "change_pose", request, self.queue, self.admission)
+                run = functools.partial(
+                    run_admitted, self.admission, context, self.queue, estimate_pose_cost(request),
+                    pose_key(request, tier=tier), change_pose_image, tier=tier
+                )
+                async for message in stream_async(run, request, pose_pb2.PoseProgress, tracer, cancel_token):
+                    yield message
+            except (QueueFullError, AdmissionRejected) as e:
+                await abort_overloaded(context, e)
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+            except Exception as e:
+                print(f"Error processing pose request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+
+    async def ChangePoseChunked(self, request_iterator, context):
+        with request_trace(context, "ChangePoseChunked") as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                request, data = await receive_upload_async(request_iterator, ("image",))
+                capture_upload(request, data)
+                tier = await pick_tier_async(context, "change_pose", request, self.queue, self.admission)
+                processed_image = await run_admitted(
+                    self.admission, context, self.queue, estimate_pose_cost(request, data["image"]),
+                    pose_key(request, data["image"], tier), change_pose_image, request,
+                    image_data=data["image"], tracer=tracer, cancel_token=cancel_token, tier=tier
+                )
+                async for chunk in stream_encoded_async(processed_image, request, pose_pb2.PoseImageChunk, tracer):
+                    yield chunk
+            except (QueueFullError, AdmissionRejected) as e:
+                await abort_overloaded(context, e)
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+            except Exception as e:
+                print(f"Error processing pose request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+
+    async def ChangePoseShared(self, request, context):
+        #not captured for replay, the pixels are not part of the request
+        with request_trace(context, "ChangePoseShared") as tracer:
+            cancel_token = context_cancel_token(context)
+            try:
+                images, keys = await run_on_encoder_pool(read_shared_inputs, request, ("image",), tracer)
+                tier = await pick_tier_async(context, "change_pose", request.request, self.queue, self.admission)
+                megapixels = images["image"].width * images["image"].height / 1e6
+                processed_image = await run_admitted(
+                    self.admission, context, self.queue, estimate_pose_cost(request.request, megapixels=megapixels),
+                    pose_key(request.request, keys["image"], tier), change_pose_image, request.request,
+                    image_data=keys["image"], image=images["image"], tier=tier, tracer=tracer, cancel_token=cancel_token
+                )
+                return await run_on_encoder_pool(
+                    write_shared_output, processed_image, request, pose_pb2.PoseSharedResponse, tracer
+                )
+            except (QueueFullError, AdmissionRejected) as e:
+                await abort_overloaded(context, e)
+            except SharedMemoryError as e:
+                report_shared_memory_error(context, e)
+                return pose_pb2.PoseSharedResponse()
+            except RequestCancelled as e:
+                report_cancelled(context, e)
+                return pose_pb2.PoseSharedResponse()
+            except Exception as e:
+                print(f"Error processing pose request: {e}")
+                context.set_details(str(e))
+                context.set_code(grpc.StatusCode.INTERNAL)
+                return pose_pb2.PoseSharedResponse()
+
+
+def build_status(status):
+    """Convert a ServerStats snapshot into a StatusResponse."""
+    return admin_pb2.StatusResponse(
+        uptime_s=status["uptime_s"],
+        rpcs=[
+            admin_pb2.RpcStatus(
+                name=rpc["name"],
+                requests=rpc["requests"],
+                errors=rpc["errors"],
+                in_flight=rpc["in_flight"],
+                latency_avg_s=rpc["latency_sum_s"] / rpc["requests"] if rpc["requests"] else 0.0,
+                latency_p50_s=rpc["latency_p50_s"],
+                latency_p95_s=rpc["latency_p95_s"]
+            )
+            for rpc in status["rpcs"]
+        ],
+        queues=[admin_pb2.QueueStatus(**queue) for queue in status["queues"]],
+        worker_processes=status["worker_processes"],
+        models=[admin_pb2.ModelStatus(**model) for model in status["models"]],
+        cache=admin_pb2.CacheStatus(**status["cache"]),
+        memory=admin_pb2.MemoryStatus(**status["memory"]),
+        admission=admin_pb2.AdmissionStatus(**status["admission"]) if status["admission"] else None,
+        single_flight=admin_pb2.SingleFlightStatus(**status["single_flight"]) if status["single_flight"] else None,
+        quality=admin_pb2.QualityStatus(**status["quality"]) if status["quality"] else None,
+        pose_batching=admin_pb2.BatchingStatus(**status["pose_batching"]) if status["pose_batching"] else None
+    )
+
+
+#components whose loader takes another checkpoint, what ReloadRequest.source names for them
+RELOAD_SOURCES = {
+    "neural_gaffer": "Neural Gaffer checkpoint directory",
+    "realesrgan": "Real-ESRGAN weights file",
+    "controlnet_inpaint": "Stable Diffusion inpainting base model id or directory",
+}
+
+
+def reload_model(request, context):
+    """
+    Swap in a new version of the model component named by a ReloadRequest, see ModelManager.reload.
+
+    Blocks until the new version serves. On failure the current version keeps serving.
+    """
+    if worker_pool is not None:
+        context.set_details("Models are loaded in the inference worker processes, restart the server to reload them")
+        context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+        return admin_pb2.ReloadResponse()
+    if request.source and request.component not in RELOAD_SOURCES:
+        context.set_details(f"{request.component} has no source to choose, reload it without one")
+        context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+        return admin_pb2.ReloadResponse()
+
+    try:
+        result = model_manager.reload(request.component, request.source or None)
+    except KeyError as e:
+        context.set_details(e.args[0])
+        context.set_code(grpc.StatusCode.NOT_FOUND)
+        return admin_pb2.ReloadResponse()
+    except Exception as e:
+        print(f"[WARNING] : Reloading {request.component} failed, the current version keeps serving: {e}")
+        context.set_details(f"Reloading {request.component} failed: {e}")
+        context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+        return admin_pb2.ReloadResponse()
+
+    return admin_pb2.ReloadResponse(
+        component=result["name"],
+        version=result["version"],
+        source=result["source"] or "",
+        load_s=result["load_s"],
+        warmup_s=result["warmup_s"],
+        draining=result["draining"]
+    )
+
+
+class AdminService(admin_pb2_grpc.AdminServiceServicer):
+    def __init__(self, stats):
+        self.stats = stats
+
+    def GetStatus(self, request, context):
+        return build_status(self.stats.snapshot())
+
+    def ReloadModel(self, request, context):
+        return reload_model(request, context)
+
+class AsyncAdminService(admin_pb2_grpc.AdminServiceServicer):
+    """
+    grpc.aio servicer for the admin RPCs. Status is answered on the event loop without
+    queueing, reloads load and warm up the new version on an executor thread.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    async def GetStatus(self, request, context):
+        return build_status(self.stats.snapshot())
+
+    async def ReloadModel(self, request, context):
+        return await asyncio.get_running_loop().run_in_executor(None, reload_model, request, context)
@@ -0,0 +1,95 @@
+import hashlib
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from PIL import Image
+
+#channels of a SharedImage -> PIL mode of its uint8 pixels
+CHANNEL_MODES = {1: "L", 3: "RGB", 4: "RGBA"}
+
+
+class SharedMemoryError(Exception):
+    """Raised for a shared memory segment that does not exist or does not fit the layout it was sent with."""
+
+
+class OutputSegmentTooSmall(SharedMemoryError):
+    """Raised when the client's output segment cannot hold the result."""
+
+
+@contextmanager
+def attach(name):
+    """
+    Map the client's shared memory segment `name` into this process.
+
+    The client owns the segment: it is closed but never unlinked here, and is taken off the
+    resource tracker that would otherwise unlink it when the server exits.
+    """
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except (FileNotFoundError, ValueError) as e:
+        raise SharedMemoryError(f"Shared memory segment {name!r} cannot be opened: {e}") from e
+    resource_tracker.unregister(shm._name, "shared_memory")
+    try:
+        yield shm
+    finally:
+        shm.close()
+
+
+def read_shared_image(descriptor, max_pixels=0):
+    """
+    Copy the image described by a SharedImage / PoseSharedImage message out of its segment.
+
+    Images of more than `max_pixels` pixels (0: no limit) are rejected before they are copied,
+    uploads of that size would be decoded reduced instead (see image_io).
+
+    Returns:
+        tuple: (PIL.Image, bytes identifying the pixels for result_cache.cache_key)
+    """
+    if descriptor.dtype not in ("", "uint8"):
+        raise SharedMemoryError(f"Unsupported dtype {descriptor.dtype!r}, only uint8 images are accepted")
+    if descriptor.channels not in CHANNEL_MODES:
+        raise SharedMemoryError(f"Unsupported channel count {descriptor.channels}, use 1, 3 or 4")
+    if descriptor.width <= 0 or descriptor.height <= 0:
+        raise SharedMemoryError(f"Invalid image size {descriptor.width}x{descriptor.height}")
+    if max_pixels and descriptor.width * descriptor.height > max_pixels:
+        raise SharedMemoryError(
+            f"A {descriptor.width}x{descriptor.height} image exceeds the {max_pixels} pixels this server "
+            f"accepts (decoding.max_input_pixels), scale it down before sending it"
+        )
+
+    shape = (descriptor.height, descriptor.width, descriptor.channels)
+    nbytes = descriptor.height * descriptor.width * descriptor.channels
+    with attach(descriptor.name) as shm:
+        if shm.size < nbytes:
+            raise SharedMemoryError(
+                f"Segment {descriptor.name!r} holds {shm.size} bytes, a {descriptor.width}x{descriptor.height} "
+                f"image with {descriptor.channels} channels needs {nbytes}"
+            )
+        array = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf).copy()
+
+    image = Image.fromarray(array[:, :, 0] if descriptor.channels == 1 else array)
+    #the layout is part of the key, the same bytes are a different image at another width.
+    #The pixels are hashed in place, a bytes copy of them would double the copy out of the segment
+    layout = b"raw:%dx%dx%d:" % (descriptor.width, descriptor.height, descriptor.channels)
+    return image, layout + hashlib.sha256(memoryview(array)).digest()
+
+
+def write_shared_image(image, name):
+    """
+    Write `image` as uint8 rows into the client's segment `name`.
+
+    Returns:
+        tuple: (width, height, channels) of the written pixels
+    """
+    if image.mode not in ("L", "RGB", "RGBA"):
+        image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+    array = np.asarray(image)
+    with attach(name) as shm:
+        if shm.size < array.nbytes:
+            raise OutputSegmentTooSmall(
+                f"Output segment {name!r} holds {shm.size} bytes, the {image.width}x{image.height} "
+                f"{image.mode} result needs {array.nbytes}"
+            )
+        np.ndarray(array.shape, dtype=np.uint8, buffer=shm.buf)[...] = array
+    return image.width, image.height, len(image.getbands())
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+from concurrent.futures import Future, TimeoutError
+
+from .cancellation import RequestCancelled, SharedCancelToken
+
+
+class _Flight:
+    def __init__(self, cancel_token):
+        self.cancel_token = SharedCancelToken([cancel_token])
+        self.future = None  #concurrent.futures.Future (run) or asyncio.Task (run_async)
+        self.waiters = 1
+
+
+class SingleFlight:
+    """
+    Runs identical requests that overlap in time only once.
+
+    The first request with a key starts the computation. Requests with the same key that
+    arrive while it runs attach to it and share its result or error, e.g. a client retrying
+    a call that timed out on its side. The computation gets a SharedCancelToken, so it is
+    only abandoned once every attached request has been cancelled. A request that attaches
+    just as the others gave up starts the computation over.
+
+    `run()` is for the sync server's threads, `run_async()` for the event loop.
+    """
+
+    #how often a waiting run() looks at its cancel token
+    CANCEL_POLL_S = 0.1
+
+    def __init__(self):
+        self.started = 0
+        self.coalesced = 0
+        self._flights = {}  #key -> _Flight
+        self._lock = threading.Lock()
+
+    def _join(self, key, cancel_token, start):
+        """
+        Attach to the running flight with `key`, or create one whose future is `start(flight)`.
+
+        Returns:
+            (flight, True if this request started it)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and not flight.future.done() and not flight.cancel_token.cancelled:
+                flight.cancel_token.add(cancel_token)
+                flight.waiters += 1
+                self.coalesced += 1
+                return flight, False
+
+            flight = _Flight(cancel_token)
+            flight.future = start(flight)
+            self._flights[key] = flight
+            self.started += 1
+            return flight, True
+
+    def _finish(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def run(self, key, fn, cancel_token=None, on_coalesced=None):
+        """
+        Return `fn(shared_cancel_token)`, or the result of the call with `key` that is already running.
+
+        Args:
+            key: Content hash of the request (see result_cache.cache_key)
+            fn: Callable doing the work, it gets the CancelToken to pass on to the pipelines
+            cancel_token: CancelToken of this request, if any
+            on_coalesced: Optional callable, called when this request attaches to a running call
+        """
+        while True:
+            flight, leader = self._join(key, cancel_token, lambda flight: Future())
+            if leader:
+                try:
+                    result = fn(flight.cancel_token)
+                except BaseException as e:
+                    flight.future.set_exception(e)
+                    raise
+                else:
+                    flight.future.set_result(result)
+                    return result
+                finally:
+                    self._finish(key, flight)
+
+            if on_coalesced is not None:
+                on_coalesced()
+            try:
+                if cancel_token is None:
+                    return flight.future.result()
+                while True:
+                    try:
+                        return flight.future.result(timeout=self.CANCEL_POLL_S)
+                    except TimeoutError:
+                        cancel_token.check()
+            except RequestCancelled:
+                if cancel_token is not None and cancel_token.cancelled:
+                    raise
+                #everybody else left just before this request attached, run it again
+
+    async def run_async(self, key, start, cancel_token=None, on_coalesced=None):
+        """
+        Await `start(shared_cancel_token)`, or the result of the call with `key` that is already running.
+
+        The computation runs as its own task, it outlives the request that started it as long
+        as other requests wait for it. It is cancelled once nobody does.
+
+        Args:
+            key: Content hash of the request (see result_cache.cache_key)
+            start: Coroutine function doing the work, it gets the CancelToken to pass on to the pipelines
+            cancel_token: CancelToken of this request, if any
+            on_coalesced: Optional callable, called when this request attaches to a running call
+        """
+        while True:
+            flight, leader = self._join(
+                key, cancel_token, lambda flight: asyncio.ensure_future(start(flight.cancel_token))
+            )
+            if leader:
+                flight.future.add_done_callback(lambda _, key=key, flight=flight: self._finish(key, flight))
+
+            if not leader and on_coalesced is not None:
+                on_coalesced()
+            try:
+                return await asyncio.shield(flight.future)
+            except RequestCancelled:
+                if cancel_token is not None and cancel_token.cancelled:
+                    raise
+            finally:
+                flight.waiters -= 1
+                if not flight.waiters and not flight.future.done():
+                    #drops the job if it is still queued
+                    flight.future.cancel()
+
+    def stats(self):
+        """
+        Returns:
+            dict: computations started, requests that attached to a running one and computations in flight
+        """
+        with self._lock:
+            in_flight = len(self._flights)
+        return {"started": self.started, "coalesced": self.coalesced, "in_flight": in_flight}
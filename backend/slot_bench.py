@@ -0,0 +1,207 @@
+"""
+Compares CPU slot shapes (cpu_slots in config.yaml) on this node.
+
+Runs `--clients` concurrent requests for `--duration` seconds per shape, in process and
+without gRPC, and reports throughput and latency for each as JSON. A shape SxC splits the
+cores into S slots of C cores, "none" runs the requests unpinned with every library sized
+to all cores, the way the server behaves without slots:
+
+    python -m backend.slot_bench --shapes none,1x16,2x8,4x4,8x2 --clients 10 --duration 60
+    python -m backend.slot_bench --workload relight --image-size 512x512 --steps 10
+
+The synthetic workload runs convolutions, OpenCV filters and numpy work like the CPU side of
+the pipelines. The relight and pose workloads run the configured pipelines (service.relight_image
+and service.change_pose_image) on synthetic requests, with models.stub they only sleep.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+import torch
+
+from .bench import parse_size, summarize_latencies
+from .cpu_slots import CpuSlots, available_cores
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+
+def default_shapes(num_cores):
+    """"none" plus 1, 2, 4... slots, each with an equal share of the cores."""
+    shapes = ["none"]
+    slots = 1
+    while slots <= num_cores:
+        shapes.append(f"{slots}x{num_cores // slots}")
+        slots *= 2
+    return shapes
+
+
+def shape_layout(shape, cores):
+    """Core tuples of the shape "SxC" taken from `cores`, None for "none"."""
+    if shape == "none":
+        return None
+    num_slots, per_slot = (int(part) for part in shape.lower().split("x"))
+    if num_slots * per_slot > len(cores):
+        raise ValueError(f"Shape {shape} needs {num_slots * per_slot} cores, {len(cores)} are available")
+    return [tuple(cores[i * per_slot:(i + 1) * per_slot]) for i in range(num_slots)]
+
+
+def synthetic_workload(width, height):
+    """A request's worth of CPU work: a conv stack on latents, image filtering and resizing."""
+    weights = [torch.randn(64, 64, 3, 3) * 0.05 for _ in range(4)]
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+    def run():
+        with torch.no_grad():
+            x = torch.randn(1, 64, height // 4, width // 4)
+            for weight in weights:
+                x = torch.relu(torch.nn.functional.conv2d(x, weight, padding=1))
+        if cv2 is not None:
+            blurred = cv2.GaussianBlur(image, (15, 15), 0)
+            cv2.resize(blurred, (width * 2, height * 2), interpolation=cv2.INTER_LANCZOS4)
+        else:
+            np.sort(image.reshape(-1, 3), axis=0)
+    return run
+
+
+def pipeline_workload(task, width, height, steps):
+    """One relight or pose request through the configured pipelines, bypassing the result cache."""
+    from . import service
+    from .warmup import _warmup_requests
+
+    relight_request, pose_request = _warmup_requests(width, height, steps, random.Random(0))
+
+    def run():
+        if task == "relight":
+            service.relight_image(relight_request, use_cache=False)
+        else:
+            service.change_pose_image(pose_request, use_cache=False)
+    return run, service
+
+
+def run_shape(shape, cores, workload, clients, duration, warmup, service=None):
+    """
+    Closed loop of `clients` threads on one shape. Returns its report.
+
+    With `service` the shape's slots are installed as service.cpu_slots, which the pipeline
+    workloads run in, the synthetic workload is wrapped in them here.
+    """
+    layout = shape_layout(shape, cores)
+    slots = CpuSlots(layout) if layout is not None else None
+    if layout is None and cv2 is not None:
+        #back to OpenCV's default, a previous shape sized it to its slots
+        cv2.setNumThreads(-1)
+    gate = slots if service is None else None
+    if service is not None:
+        service.cpu_slots = slots
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    start = time.monotonic()
+    measure_from = start + warmup
+    deadline = measure_from + duration
+
+    def client():
+        while time.monotonic() < deadline:
+            request_start = time.monotonic()
+            try:
+                if gate is not None:
+                    with gate.slot():
+                        workload()
+                else:
+                    workload()
+            except Exception as e:
+                with lock:
+                    errors[0] += 1
+                print(f"[WARNING] : Request failed: {e}", file=sys.stderr)
+                continue
+            if request_start >= measure_from:
+                with lock:
+                    latencies.append(time.monotonic() - request_start)
+
+    threads = [threading.Thread(target=client, name=f"slot-bench-{i}") for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - measure_from
+
+    return {
+        "shape": shape,
+        "slots": len(layout) if layout is not None else 0,
+        "cores_per_slot": len(layout[0]) if layout is not None else len(cores),
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput_rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "latency_s": summarize_latencies(latencies),
+        "slot_wait_s": slots.stats()["wait_s"] if slots is not None else 0.0,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare CPU inference slot shapes on this node")
+    parser.add_argument("--shapes", help="Comma separated shapes, SxC (S slots of C cores) or none "
+                                         "(default: none plus 1, 2, 4... slots over all cores)")
+    parser.add_argument("--reserved-cores", type=int, default=0, help="Cores left out of every shape")
+    parser.add_argument("--clients", type=int, default=10,
+                        help="Concurrent requests, like the sync server's threads (server.sync_max_workers)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Measured seconds per shape")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Seconds of load before measuring each shape")
+    parser.add_argument("--workload", choices=("synthetic", "relight", "pose"), default="synthetic")
+    parser.add_argument("--image-size", type=parse_size, default=(512, 512), help="WIDTHxHEIGHT of the inputs")
+    parser.add_argument("--steps", type=int, default=4, help="Denoising steps of the pose workload")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cores = available_cores()[args.reserved_cores:]
+    shapes = args.shapes.split(",") if args.shapes else default_shapes(len(cores))
+    width, height = args.image_size
+
+    if args.workload == "synthetic":
+        workload, service = synthetic_workload(width, height), None
+    else:
+        workload, service = pipeline_workload(args.workload, width, height, args.steps)
+
+    results = []
+    for shape in shapes:
+        print(f"[INFO] : Shape {shape}, {args.clients} clients for {args.duration:.0f} s", file=sys.stderr)
+        result = run_shape(shape, cores, workload, args.clients, args.duration, args.warmup, service)
+        results.append(result)
+        latency = result["latency_s"]
+        print(
+            f"[INFO] : {shape}: {result['throughput_rps']:.2f} req/s, "
+            f"p50 {latency['p50'] or 0:.3f} s, p95 {latency['p95'] or 0:.3f} s",
+            file=sys.stderr
+        )
+
+    report = {
+        "results": results,
+        "config": {
+            "cores": len(cores),
+            "clients": args.clients,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "workload": args.workload,
+            "image_size": [width, height],
+        },
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
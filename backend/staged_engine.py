@@ -0,0 +1,138 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+
+class StagedEngine:
+    """
+    Runs requests through a fixed sequence of stages, every stage on its own pool of threads.
+
+    A request is a list of steps, one callable per stage: the first is called without arguments,
+    every following one with the result of the previous step, the last one's result is the
+    request's. While one request is in a slow stage (e.g. the denoiser), the stages before and
+    after it work on other requests. A bounded queue sits in front of every stage, a stage whose
+    successor's queue is full waits for room, so a slow stage throttles the ones feeding it
+    instead of letting their results pile up.
+
+    A failing step fails the request and skips its remaining stages, steps check the request's
+    cancel token themselves (a step whose token already fired is not started).
+
+    Args:
+        name: Name of the engine, used for its threads (e.g. "relight")
+        stages: List of (stage name, number of threads) in the order requests go through them
+        queue_size: Requests that may wait in front of every stage
+        cpu_slots: Optional CpuSlots every step runs in, like whole requests without the engine
+    """
+
+    #how often a waiting run() looks at its cancel token
+    CANCEL_POLL_S = 0.1
+
+    def __init__(self, name, stages, queue_size=2, cpu_slots=None):
+        self.name = name
+        self.stages = [(stage, workers) for stage, workers in stages]
+        self.queue_size = queue_size
+        self.cpu_slots = cpu_slots
+        self.started_at = time.monotonic()
+
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in self.stages]
+        self._lock = threading.Lock()
+        self._busy = [0] * len(self.stages)
+        self._busy_s = [0.0] * len(self.stages)
+        self._completed = [0] * len(self.stages)
+        self._failed = [0] * len(self.stages)
+
+        for index, (stage, workers) in enumerate(self.stages):
+            for i in range(workers):
+                thread = threading.Thread(target=self._worker, args=(index,), name=f"{name}-{stage}-{i}", daemon=True)
+                thread.start()
+        print(f"[INFO] : {name} stages: {', '.join(f'{stage} ({workers})' for stage, workers in self.stages)}")
+
+    def run(self, steps, cancel_token=None, on_done=None):
+        """
+        Run `steps` (one callable per stage) through the stages and block until the last one returns.
+
+        With a `cancel_token` the wait ends with its RequestCancelled once it fires, the request's
+        next step is then not started. `on_done()` is called once the request has left the stages,
+        finished or failed, which can be after a cancelled run() returned.
+        """
+        if len(steps) != len(self.stages):
+            raise ValueError(f"{self.name} takes {len(self.stages)} steps, got {len(steps)}")
+        future = Future()
+        if on_done is not None:
+            future.add_done_callback(lambda _: on_done())
+        self._put(0, (steps, None, future, cancel_token), cancel_token)
+        if cancel_token is None:
+            return future.result()
+
+        while True:
+            try:
+                return future.result(timeout=self.CANCEL_POLL_S)
+            except TimeoutError:
+                cancel_token.check()
+
+    def _put(self, index, job, cancel_token=None):
+        """Put `job` in front of stage `index`, waiting for room, or for `cancel_token` to fire."""
+        while True:
+            try:
+                self._queues[index].put(job, timeout=self.CANCEL_POLL_S if cancel_token is not None else None)
+                return
+            except queue.Full:
+                cancel_token.check()
+
+    def _worker(self, index):
+        while True:
+            steps, value, future, cancel_token = self._queues[index].get()
+            with self._lock:
+                self._busy[index] += 1
+            start = time.perf_counter()
+            try:
+                if cancel_token is not None:
+                    cancel_token.check()
+                if self.cpu_slots is not None:
+                    with self.cpu_slots.slot(cancel_token):
+                        value = steps[index](*(() if index == 0 else (value,)))
+                else:
+                    value = steps[index](*(() if index == 0 else (value,)))
+            except Exception as e:
+                failed = True
+                future.set_exception(e)
+            else:
+                failed = False
+            finally:
+                with self._lock:
+                    self._busy[index] -= 1
+                    self._busy_s[index] += time.perf_counter() - start
+                    self._completed[index] += 1
+                    self._failed[index] += int(failed)
+
+            if failed:
+                continue
+            if index + 1 == len(self.stages):
+                future.set_result(value)
+            else:
+                #waits while the next stage is backed up, which holds up this stage in turn
+                self._put(index + 1, (steps, value, future, cancel_token))
+
+    def stats(self):
+        """
+        Returns:
+            list of dict: per stage its threads, busy threads, queued requests, requests run and failed,
+                          busy seconds and utilization (busy share of its threads' time since start)
+        """
+        elapsed = time.monotonic() - self.started_at
+        with self._lock:
+            return [
+                {
+                    "stage": stage,
+                    "workers": workers,
+                    "busy": self._busy[index],
+                    "depth": self._queues[index].qsize(),
+                    "max_size": self.queue_size,
+                    "completed": self._completed[index],
+                    "failed": self._failed[index],
+                    "busy_s": self._busy_s[index],
+                    "utilization": self._busy_s[index] / (workers * elapsed) if elapsed > 0 else 0.0,
+                }
+                for index, (stage, workers) in enumerate(self.stages)
+            ]
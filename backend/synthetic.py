@@ -0,0 +1,72 @@
+"""
+Synthetic requests for the benchmark client (bench.py) and the startup warmup (warmup.py):
+images with realistic entropy, object masks, light setups and ChangePose skeletons.
+"""
+import io
+import json
+
+from PIL import Image, ImageDraw
+
+#COCO-ish keypoints of a standing person as fractions of the image size, in the order
+#change_pose expects: right/left wrist and elbow, hips, knees, ankles
+BASE_SKELETON = [
+    (0.30, 0.55), (0.33, 0.40), (0.70, 0.55), (0.67, 0.40), (0.42, 0.58),
+    (0.58, 0.58), (0.42, 0.75), (0.58, 0.75), (0.42, 0.92), (0.58, 0.92),
+]
+
+LIGHT_COLORS = ["#ffffff", "#ffd6a0", "#a0c8ff", "#ff9a6b"]
+
+
+def synthetic_image(width, height, rng):
+    """A gradient background with a blob in the middle, so encoders see realistic entropy."""
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(20):
+        x, y = rng.randrange(width), rng.randrange(height)
+        radius = rng.randrange(4, max(width, height) // 8 + 5)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=color)
+    draw.ellipse((width * 0.3, height * 0.2, width * 0.7, height * 0.95), fill=(180, 140, 120))
+    return image
+
+
+def object_mask(width, height):
+    mask = Image.new("L", (width, height), 0)
+    ImageDraw.Draw(mask).ellipse((width * 0.3, height * 0.2, width * 0.7, height * 0.95), fill=255)
+    return mask
+
+
+def encode_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def random_lights(count, rng):
+    """LightsRequest json with `count` random point and line lights (coordinates are normalized)."""
+    lights = []
+    for _ in range(count):
+        if rng.random() < 0.5:
+            geometry = {
+                "type": "SingleLightSource",
+                "center": [rng.random(), rng.random() * 0.6],
+                "radius": rng.uniform(3, 15),
+            }
+        else:
+            geometry = {
+                "type": "LineString",
+                "coordinates": [[rng.random(), rng.random() * 0.6] for _ in range(2)],
+            }
+        lights.append({
+            "geometry": geometry,
+            "properties": {"temperature": rng.randrange(2500, 7500), "color": rng.choice(LIGHT_COLORS)},
+        })
+    return json.dumps({"lights": lights}).encode()
+
+
+def random_skeleton(width, height, max_offset, rng):
+    """Target keypoints for ChangePose: BASE_SKELETON moved by up to `max_offset` pixels."""
+    return json.dumps([
+        [x * width + rng.uniform(-max_offset, max_offset), y * height + rng.uniform(-max_offset, max_offset)]
+        for x, y in BASE_SKELETON
+    ]).encode()
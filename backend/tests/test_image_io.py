@@ -0,0 +1,30 @@
+import io
+
+from PIL import Image, ImageDraw
+
+from backend.image_io import decode_inputs, reduction_factor
+
+
+def encode(image, format):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def test_jpeg_mask_follows_an_image_reduced_by_three():
+    #a PNG image is box-reduced by 3, libjpeg can only draft the JPEG mask at 1/2 of it
+    width, height, max_pixels = 600, 450, 200 * 150
+    assert reduction_factor(width, height, max_pixels) == 3
+    image_data = encode(Image.new("RGB", (width, height), (90, 120, 150)), "PNG")
+    mask = Image.new("L", (width, height), 0)
+    ImageDraw.Draw(mask).rectangle((300, 150, 449, 299), fill=255)
+
+    image, mask, scale = decode_inputs(image_data, encode(mask, "JPEG"), max_pixels)
+
+    assert image.size == (200, 150)
+    assert mask.size == image.size
+    assert scale == (1 / 3, 1 / 3)
+    #the object is still where the image has it: x 100-149, y 50-99
+    assert mask.getpixel((125, 75)) > 200
+    assert mask.getpixel((75, 75)) < 50
+    assert mask.getpixel((125, 125)) < 50
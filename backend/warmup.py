@@ -0,0 +1,77 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import service
+from . import relighting_pb2
+from . import pose_pb2
+from .synthetic import synthetic_image, object_mask, encode_png, random_lights, random_skeleton
+from .encoding import encode_response
+
+
+def _warmup_requests(width, height, pose_steps, rng):
+    image_data = encode_png(synthetic_image(width, height, rng))
+    relight_request = relighting_pb2.RelightRequest(
+        image_data=image_data,
+        mask_data=encode_png(object_mask(width, height)),
+        json_data=random_lights(2, rng),
+        seed=0
+    )
+    pose_request = pose_pb2.PoseRequest(
+        image_data=image_data,
+        new_skeleton_data=random_skeleton(width, height, 40, rng),
+        num_steps=pose_steps,
+        seed=0
+    )
+    return relight_request, pose_request
+
+
+def _run(request, image_fn, message_cls):
+    #a reporter with previews on every step also warms up the streaming RPCs' preview decoding
+    reporter = service.ProgressReporter(message_cls, lambda message: None, preview_every=1)
+    processed_image = image_fn(request, reporter, use_cache=False)
+    encode_response(processed_image, request, message_cls)
+
+
+def warmup(resolutions, pose_steps=4):
+    """
+    Run synthetic requests through both pipelines at every resolution in `resolutions`.
+
+    The first request otherwise pays for loading the models, numba compiling the shadow
+    raymarcher, cuDNN/oneDNN picking kernels for every input shape and the lazy setup inside
+    MediaPipe, transformers and diffusers. With a worker pool, every worker process gets its
+    own warmup request. Results bypass the result cache.
+
+    Every component is loaded, under a memory budget that does not hold them all the ones
+    warmed up last evict the others again.
+
+    Args:
+        resolutions: List of (width, height) input sizes to warm up
+        pose_steps: Denoising steps of the warmup pose requests
+    """
+    parallel = service.worker_pool.num_workers if service.worker_pool is not None else 1
+    if service.model_manager.memory_budget_bytes is not None:
+        print("[WARNING] : Warming up loads every model component, components that do not fit "
+              "models.memory_budget_gb next to the others are evicted again")
+    rng = random.Random(0)
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(parallel, thread_name_prefix="warmup") as executor:
+        for width, height in resolutions:
+            relight_request, pose_request = _warmup_requests(width, height, pose_steps, rng)
+            for name, request, image_fn, message_cls in (
+                ("relight", relight_request, service.relight_image, relighting_pb2.RelightProgress),
+                ("change_pose", pose_request, service.change_pose_image, pose_pb2.PoseProgress),
+            ):
+                t0 = time.perf_counter()
+                #concurrent jobs, a worker process only takes a new job once it is idle again
+                jobs = [executor.submit(_run, request, image_fn, message_cls) for _ in range(parallel)]
+                try:
+                    for job in jobs:
+                        job.result()
+                except Exception as e:
+                    print(f"[WARNING] : Warmup of {name} at {width}x{height} failed: {e}")
+                    continue
+                print(f"[INFO] : Warmed up {name} at {width}x{height} in {time.perf_counter() - t0:.1f} s")
+
+    print(f"[INFO] : Warmup done in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,273 @@
+import multiprocessing
+import queue
+import threading
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+from .cancellation import CancelToken, RequestCancelled
+from .cpu_slots import apply_thread_limits
+from .tracing import Tracer
+
+#where a decoded image lives: shared memory block name plus the array layout
+SharedImage = namedtuple("SharedImage", ["name", "shape", "dtype"])
+
+#modes that round-trip through a plain numpy array
+SHAREABLE_MODES = ("1", "L", "RGB", "RGBA")
+
+
+class WorkerCrashedError(Exception):
+    """Raised when an inference worker process dies while running a job."""
+
+
+def share_image(image):
+    """
+    Copy a PIL image into a new shared memory block.
+
+    The caller owns the block and has to `unlink()` it once the receiver is done with it.
+
+    Returns:
+        tuple: (SharedMemory, SharedImage)
+    """
+    if image.mode not in SHAREABLE_MODES:
+        image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+    array = np.asarray(image)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, SharedImage(shm.name, array.shape, array.dtype.str)
+
+
+def load_shared_image(descriptor, unlink=False):
+    """Copy the image described by a SharedImage out of shared memory, optionally freeing the block."""
+    shm = shared_memory.SharedMemory(name=descriptor.name)
+    try:
+        array = np.ndarray(descriptor.shape, dtype=np.dtype(descriptor.dtype), buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+    return Image.fromarray(array)
+
+
+def _relight(pipelines, image, mask=None, **kwargs):
+    return pipelines["relight"].predict(image, mask, **kwargs)[0]
+
+
+def _change_pose(pipelines, image, **kwargs):
+    return pipelines["pose"].process_request(image_input=image, **kwargs)
+
+
+#task name -> callable(pipelines, **images, **kwargs) returning a PIL image
+TASKS = {
+    "relight": _relight,
+    "change_pose": _change_pose,
+}
+
+
+def _worker_main(conn, memory_budget_bytes, cancel_event, cores=None):
+    """
+    Entry point of an inference worker process.
+
+    Receives (task, images, kwargs, report_progress, trace) jobs over `conn` and answers with
+    ("stage", name) / ("step", step, total_steps, latents) progress messages followed by
+    ("result", SharedImage, spans) or ("error", exception). `trace` is None or the Tracer's
+    sync_cuda flag. The front end sets `cancel_event` to abort the running job. A None job
+    stops the worker. With `cores` the process is pinned to them before anything is loaded.
+    """
+    if cores:
+        #threads started from here on, torch's and numba's pools included, inherit the affinity
+        apply_thread_limits(cores)
+
+    from .ml_models import RelightingModel, PoseCorrectionPipeline, cfg
+    from .ml_models.model_manager import ModelManager
+    from .ml_models.stub_models import StubRelightingModel, StubPoseCorrectionPipeline
+
+    models = ModelManager(memory_budget_bytes)
+    if cfg.STUB_MODELS:
+        pipelines = {
+            "relight": StubRelightingModel(step_ms=cfg.STUB_STEP_MS),
+            "pose": StubPoseCorrectionPipeline(step_ms=cfg.STUB_STEP_MS),
+        }
+    else:
+        pipelines = {
+            "relight": RelightingModel(models=models),
+            "pose": PoseCorrectionPipeline(models=models, cpu_offload=cfg.POSE_CPU_OFFLOAD),
+        }
+
+    def send_stage(name):
+        conn.send(("stage", name))
+
+    def send_step(step, total_steps, latents):
+        conn.send(("step", step, total_steps, latents.detach().float().cpu().numpy()))
+
+    cancel_token = CancelToken(event=cancel_event)
+
+    try:
+        while (job := conn.recv()) is not None:
+            task, images, kwargs, report_progress, trace = job
+            try:
+                decoded = {name: load_shared_image(descriptor) for name, descriptor in images.items()}
+                if report_progress:
+                    kwargs.update(stage_callback=send_stage, step_callback=send_step)
+                tracer = Tracer(sync_cuda=trace) if trace is not None else None
+                result = TASKS[task](pipelines, **decoded, **kwargs, tracer=tracer, cancel_token=cancel_token)
+
+                #the front end copies the result out and unlinks the block
+                shm, descriptor = share_image(result)
+                shm.close()
+                conn.send(("result", descriptor, tracer.spans if tracer is not None else []))
+            except RequestCancelled as e:
+                conn.send(("error", e))
+            except Exception as e:
+                print(f"Error in inference worker: {e}")
+                try:
+                    conn.send(("error", e))
+                except Exception:
+                    conn.send(("error", RuntimeError(str(e))))
+    except (EOFError, KeyboardInterrupt):
+        pass
+
+
+class _Worker:
+    def __init__(self, context, index, memory_budget_bytes, cores=None):
+        self.index = index
+        self.cores = cores
+        self.conn, child_conn = context.Pipe()
+        self.cancel_event = context.Event()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, memory_budget_bytes, self.cancel_event, cores),
+            name=f"inference-worker-{index}", daemon=True
+        )
+        self.process.start()
+        #only the child holds the other end now, so recv() raises EOFError if it dies
+        child_conn.close()
+
+
+class WorkerPool:
+    """
+    Runs inference jobs in separate worker processes, each holding its own pipelines.
+
+    Keeps numba, OpenCV, MediaPipe and PIL work off the server's GIL and isolates the
+    server from crashes in native code. Images go to and from the workers through
+    `multiprocessing.shared_memory` blocks, only the small job arguments are pickled.
+    A worker that dies is replaced and its job fails with WorkerCrashedError.
+    A cancelled job is aborted inside the worker, which stays up for the next one.
+
+    Args:
+        num_workers: Number of worker processes
+        memory_budget_bytes: Model memory budget of every worker (see ModelManager)
+        cpu_layout: Optional list of core tuples (see cpu_slots.plan_slots), worker i is pinned to
+            cpu_layout[i % len(cpu_layout)]
+    """
+
+    def __init__(self, num_workers, memory_budget_bytes=None, cpu_layout=None):
+        self.num_workers = num_workers
+        self.memory_budget_bytes = memory_budget_bytes
+        self.cpu_layout = cpu_layout
+        #spawn, forked children cannot use CUDA
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = []
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+
+    def start(self):
+        for index in range(self.num_workers):
+            worker = _Worker(self._context, index, self.memory_budget_bytes, self._cores(index))
+            self._workers.append(worker)
+            self._idle.put(worker)
+        print(f"[INFO] : Started {self.num_workers} inference worker processes")
+
+    def stop(self, timeout=10):
+        """Ask the workers to exit and terminate those that do not."""
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.conn.close()
+
+    #how often a running job looks at its cancel token
+    CANCEL_POLL_S = 0.1
+
+    def run(self, task, images, stage_callback=None, step_callback=None, tracer=None, cancel_token=None, **kwargs):
+        """
+        Run `task` on the next free worker, blocking until it is done.
+
+        Args:
+            task: Name of the job in TASKS ("relight" or "change_pose")
+            images: Dict of PIL images passed to the task through shared memory (None values are skipped)
+            stage_callback: Optional callable(stage_name), called with the worker's stage updates
+            step_callback: Optional callable(step, total_steps, latents), latents arrive as numpy arrays
+            tracer: Optional Tracer, receives the spans the worker recorded
+            cancel_token: Optional CancelToken, the job is aborted in the worker once it fires
+            **kwargs: Extra (picklable) arguments for the task
+
+        Returns:
+            PIL.Image: the task's result
+        """
+        shared = {name: share_image(image) for name, image in images.items() if image is not None}
+        descriptors = {name: descriptor for name, (_, descriptor) in shared.items()}
+        worker = self._idle.get()
+        finished = False
+        try:
+            report_progress = stage_callback is not None or step_callback is not None
+            trace = tracer.sync_cuda if tracer is not None else None
+            worker.cancel_event.clear()
+            worker.conn.send((task, descriptors, kwargs, report_progress, trace))
+            while True:
+                if cancel_token is not None:
+                    while not worker.conn.poll(self.CANCEL_POLL_S):
+                        if cancel_token.cancelled:
+                            #the worker answers with RequestCancelled at its next check
+                            worker.cancel_event.set()
+                message = worker.conn.recv()
+                kind = message[0]
+                if kind == "stage":
+                    if stage_callback is not None:
+                        stage_callback(message[1])
+                elif kind == "step":
+                    if step_callback is not None:
+                        step_callback(*message[1:])
+                elif kind == "result":
+                    finished = True
+                    if tracer is not None:
+                        tracer.add(*message[2])
+                    return load_shared_image(message[1], unlink=True)
+                else:
+                    finished = True
+                    raise message[1]
+        except (EOFError, BrokenPipeError, ConnectionResetError) as e:
+            worker.process.join(1)
+            raise WorkerCrashedError(
+                f"Inference worker {worker.index} exited (code {worker.process.exitcode}) while running {task}"
+            ) from e
+        finally:
+            for shm, _ in shared.values():
+                shm.close()
+                shm.unlink()
+            if not finished:
+                #the worker is dead or out of sync with us, start a fresh one in its place
+                worker = self._replace(worker)
+            self._idle.put(worker)
+
+    def _cores(self, index):
+        return self.cpu_layout[index % len(self.cpu_layout)] if self.cpu_layout else None
+
+    def _replace(self, worker):
+        if worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join()
+        worker.conn.close()
+        print(f"[WARNING] : Restarting inference worker {worker.index}")
+        replacement = _Worker(self._context, worker.index, self.memory_budget_bytes, worker.cores)
+        with self._lock:
+            self._workers = [replacement if w is worker else w for w in self._workers]
+        return replacement